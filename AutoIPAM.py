@@ -1,12 +1,31 @@
-from zeep import Client
+import argparse
+import hashlib
+import itertools
 import ipaddress
+import bisect
 import csv
 import os
+import sys
 import json
 import time
-
-with open("config.json", "r") as config_file:
-    config = json.load(config_file)
+import random
+import sqlite3
+import threading
+import asyncio
+import contextlib
+import contextvars
+from collections import defaultdict
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+config = {}
+
+def loadConfig(path="config.json"):
+    """Load settings from a JSON config file into the module-level config."""
+    with open(path, "r") as config_file:
+        config.update(json.load(config_file))
+    return config
 
 class Block:
     def __init__(self, bluecat_manager):
@@ -14,13 +33,27 @@ class Block:
 
     def ProcessEntry(self, entry):
         network = ipaddress.ip_network(entry[2], strict=False)
-        chain = self.bluecat_manager.utils.dig(bluecat_manager.client, network.network_address, "IP4Block")
+        with self.bluecat_manager.instrumentation.phase("dig"):
+            chain = self.bluecat_manager.topology.chain(network.network_address, "IP4Block")
 
         if self.bluecat_manager.utils.checkIfExists(entry[2], chain):
             print(f"Block {entry[2]} already exists.")
         else:
+            properties = f"name={entry[1]}|" + self.bluecat_manager.block_properties
+            try:
+                with self.bluecat_manager.instrumentation.phase("write"):
+                    block_id = self.bluecat_manager.client.service.addIP4BlockByCIDR(chain[-1]['id'], entry[2], properties)
+            except Exception as e:
+                if BluecatUtils.faultKind(e) != "duplicate":
+                    raise
+                # The create may have gone through before a transient fault made it retry, so ask BAM what it has now
+                self.bluecat_manager.topology.reloadChildren(chain[-1]['id'])
+                if not self.bluecat_manager.utils.checkIfExists(entry[2], self.bluecat_manager.topology.chain(network.network_address, "IP4Block")):
+                    raise
+                print(f"Block {entry[2]} already exists.")
+                return
+            self.bluecat_manager.topology.addChild(chain[-1]['id'], "IP4Block", block_id, entry[1], f"CIDR={entry[2]}|{properties}")
             print(f"Added {entry[1]} block to {entry[2]}.")
-            self.bluecat_manager.client.service.addIP4BlockByCIDR(chain[-1]['id'], entry[2], f"name={entry[1]}|" + self.bluecat_manager.block_properties)
 
 class Network:
     def __init__(self, bluecat_manager):
@@ -28,8 +61,9 @@ class Network:
 
     def ProcessEntry(self, entry):
         network = ipaddress.ip_network(entry[2], strict=False)
-        block_chain = self.bluecat_manager.utils.dig(bluecat_manager.client, network.network_address, "IP4Block")
-        network_chain = self.bluecat_manager.utils.dig(bluecat_manager.client, network.network_address, "IP4Network", block_chain[-1]['id'])
+        with self.bluecat_manager.instrumentation.phase("dig"):
+            block_chain = self.bluecat_manager.topology.chain(network.network_address, "IP4Block")
+            network_chain = self.bluecat_manager.topology.chain(network.network_address, "IP4Network", block_chain[-1]['id'])
 
         if len(entry) != 4:
             gateway = ''
@@ -39,30 +73,26 @@ class Network:
         if self.bluecat_manager.utils.checkIfExists(entry[2], network_chain):
             print(f"Network {entry[2]} already exists.")
         else:
-            network_id = self.bluecat_manager.client.service.addIP4Network(block_chain[-1]['id'], entry[2], f'name={entry[1]}|{gateway}' + self.bluecat_manager.block_properties)
+            properties = f'name={entry[1]}|{gateway}' + self.bluecat_manager.block_properties
+            try:
+                with self.bluecat_manager.instrumentation.phase("write"):
+                    network_id = self.bluecat_manager.client.service.addIP4Network(block_chain[-1]['id'], entry[2], properties)
+            except Exception as e:
+                if BluecatUtils.faultKind(e) != "duplicate":
+                    raise
+                # The create may have gone through before a transient fault made it retry, so ask BAM what it has now
+                self.bluecat_manager.topology.reloadChildren(block_chain[-1]['id'])
+                if not self.bluecat_manager.utils.checkIfExists(entry[2], self.bluecat_manager.topology.chain(network.network_address, "IP4Network", block_chain[-1]['id'])):
+                    raise
+                print(f"Network {entry[2]} already exists.")
+                return
+            self.bluecat_manager.topology.addChild(block_chain[-1]['id'], "IP4Network", network_id, entry[1], f"CIDR={entry[2]}|{properties}")
             print(f"Added {entry[1]} network to {entry[2]}.")
 
 class Host:
     def __init__(self, bluecat_manager):
         self.bluecat_manager = bluecat_manager
 
-    def ProcessEntry(self, entry):
-        valid = self.checkIfValidHostname(entry[1])
-        if valid[0]:
-            block_chain = self.bluecat_manager.utils.dig(bluecat_manager.client, entry[2], "IP4Block")
-            network_chain = self.bluecat_manager.utils.dig(bluecat_manager.client, entry[2], "IP4Network", block_chain[-1]['id'])
-
-            # Only send the comments and add type if they are in the entry and passed validation
-            if entry[3] and entry[4] and self.areCommentsSectionValid(entry[3], entry[4]):
-                self.addHost(self.bluecat_manager.top_level_view_id, network_chain[-1]['id'], entry[1], entry[2], entry[3], entry[4])
-            else:
-                # Otherwise, if they are in the entry but haven't passed verification, send the warning message and then send without comments
-                if entry[3] and entry[4]:
-                    print(f"Excluded comments from ({entry[1]}, {entry[2]}) as it hasn't passed validation.")
-                self.addHost(self.bluecat_manager.top_level_view_id, network_chain[-1]['id'], entry[1], entry[2])
-        else:
-            print(valid[1])
-
     def areCommentsSectionValid(self, comments, comments_action):
         """Checks if the comments section is valid before sending off to other functions
 
@@ -84,43 +114,21 @@ class Host:
 
         return True
 
-    def updateRecord(self, data, new, _type, delim = ",", replace = False):
-        """Modifies the properties field of a host record with new data
+    def hostKey(self, hostname):
+        """Split a hostname into the zone (host area) and the normalised name relative to it, as used by the DNS dictionary.
 
         Args:
-            data (dic): Dictionary containing the entry for a specific host record
-            new (str): The data to update the record with, could either be an additional IP address, a new comment or something else completely
-            _type (str): The type of field to update e.g. "addresses", "comments" etc.
-            delim (str, optional): If the operation is to add (replace = False) then define the delimiter between exsiting and new values. "," by default but might want "\r\n" for new line.
-            replace (bool, optional): If replace is set to true, the field in question will be overwritten, otherwise it'll just be added to
+            hostname (str): The full hostname e.g. "test-host.test.xxx"
 
         Returns:
-            data (dic) : The updated dictionary containing the new data
+            tuple: (host_area, relative_name), both uppercase
         """
-        _type = f"{_type}="
-        # Split the properties string into a list of key-value pairs
-        properties_list = data['properties'].split('|')
-
-        # Iterate through the list and find the '_type' key
-        for i, prop in enumerate(properties_list):
-            if prop.startswith(_type):
-                old = prop.split('=')[1]
-                # Add the new details
-                if replace:
-                    updated = new
-                else:
-                    updated = old + delim + new
-                # Update the properties list with the new string
-                properties_list[i] = f'{_type}{updated}'
-                break
-
-        # Join the properties list back into a single string
-        updated_properties = '|'.join(properties_list)
-
-        # Update the data dictionary with the modified properties string
-        data['properties'] = updated_properties
+        elements = hostname.split('.')
+        return elements[-2].upper(), '.'.join(elements[:-2]).upper()
 
-        return data
+    def dnsRecord(self, entity):
+        """Reduce a host record entity to the compact record kept in the DNS dictionary."""
+        return entity if isinstance(entity, HostRecord) else HostRecord.fromEntity(entity)
 
     def buildDnsDict(self, host_area):
         """Populate the DNS dictionary with all hosts in a specific zone.
@@ -131,63 +139,172 @@ class Host:
         Returns:
             None
         """
-        for zone in self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, self.bluecat_manager.view_id, "Zone"):
-            if zone['name'].upper() == host_area:
-                subzone = zone['id']
+        subzone = self.bluecat_manager.zones.getId(host_area)
 
-        if subzone == 0:
+        if subzone is None:
             return False
 
-        if host_area in self.bluecat_manager.dns_dict:
-            self.bluecat_manager.dns_dict[host_area].extend(self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, subzone, "HostRecord", end=9999))
+        with self.bluecat_manager.dns_lock:
+            seen = dict(self.bluecat_manager.dns_dict.get(host_area, {}))
+
+        # Fetched without holding the dictionary lock, so lookups and writes in other zones carry on meanwhile
+        snapshot = self.bluecat_manager.snapshot
+        rows = snapshot.load("hosts", host_area) if snapshot else None
+        if rows is not None and snapshot.isCurrent(rows, self.bluecat_manager.client, subzone, "HostRecord"):
+            entities = rows
         else:
-            self.bluecat_manager.dns_dict[host_area] = self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, subzone, "HostRecord", end=9999)
+            entities = list(self.bluecat_manager.utils.iterEntities(self.bluecat_manager.client, subzone, "HostRecord"))
+            self.saveSnapshot(host_area, entities)
+
+        with self.bluecat_manager.dns_lock:
+            zone_hosts = self.bluecat_manager.dns_dict.setdefault(host_area, {})
+            for entity in entities:
+                if entity['name'] is not None:
+                    name = entity['name'].upper()
+                    if zone_hosts.get(name) is seen.get(name): # Keep records written while the zone was being fetched
+                        zone_hosts[name] = self.dnsRecord(entity)
+
+            self.bluecat_manager.full_updates += [host_area] # Add this domain to the list that have had full dictionaries built
+
+    def saveSnapshot(self, host_area, entities):
+        """Write a zone's host records to the snapshot cache, if one is configured."""
+        if self.bluecat_manager.snapshot:
+            rows = [(entity['name'].upper() if entity['name'] is not None else f"#{entity['id']}", entity['id'], entity['name'], entity['properties']) for entity in entities]
+            self.bluecat_manager.snapshot.store("hosts", host_area, rows)
+
+    def storeInDict(self, hostname, data):
+        """Upsert a host record that is already in hand into the dictionary (and the snapshot cache)."""
+        host_area, name = self.hostKey(hostname)
+
+        # Upsert, so repeated updates to the same host replace its record rather than piling up duplicates
+        with self.bluecat_manager.dns_lock:
+            self.bluecat_manager.dns_dict.setdefault(host_area, {})[name] = self.dnsRecord(data)
+        if self.bluecat_manager.snapshot:
+            self.bluecat_manager.snapshot.upsert("hosts", host_area, name, data['id'], data['name'], data['properties'])
+
+    def findExistingHost(self, hostname):
+        """ Finds the dictionary record (id, name and properties) of an existing host
 
-        self.bluecat_manager.full_updates += [host_area] # Add this domain to the list that have had full dictionaries built
+        Args:
+            hostname (str): The hostname of the record to find
 
-    def addToDict(self, hostname, _id):
-        """ Required to update the dictionary on the fly, not only once at the beginning.
-            This is important as it means updated records will not be overwritten and hosts that have been added after the dictionary creation will be seen
+        Returns:
+            dic: The record, or None if there is no such host
+        """
+        host_area, host_without_zone = self.hostKey(hostname)
+
+        with self.bluecat_manager.dns_lock:
+            zone_hosts = self.bluecat_manager.dns_dict.setdefault(host_area, {})
+            if host_area in self.bluecat_manager.full_updates or host_without_zone in zone_hosts:
+                return zone_hosts.get(host_without_zone)
+        snapshot = self.bluecat_manager.snapshot
+        if snapshot and snapshot.isLoaded("hosts", host_area):
+            # The whole zone is already in the snapshot cache, so loading it is cheaper than asking BAM
+            self.prefetchZone(host_area)
+            with self.bluecat_manager.dns_lock:
+                return zone_hosts.get(host_without_zone)
+        return self.lookupHost(hostname)
+
+    def lookupHost(self, hostname):
+        """ Ask BAM for a single host record by name, and remember the answer (including that there isn't one)
 
         Args:
-            hostname (str): The hostname of the record to be added to the dictionary
-            _id (int): The Bluecat ID value of the record to be added to the dictionary
+            hostname (str): The full hostname e.g. "test-host.test.xxx"
 
         Returns:
-            None
+            dic: The record, or None if there is no such host
         """
-        data = self.bluecat_manager.client.service.getEntityById(_id)
-        elements = hostname.split('.')
-        host_area = elements[-2].upper()
-        
-        if host_area in self.bluecat_manager.dns_dict:
-            self.bluecat_manager.dns_dict[host_area].append(data)
-        else:
-            self.bluecat_manager.dns_dict[host_area] = [data]
+        host_area, host_without_zone = self.hostKey(hostname)
+        zone_id = self.bluecat_manager.zones.getId(host_area)
+        if zone_id is None:
+            return None
+        entity = self.bluecat_manager.client.service.getEntityByName(zone_id, '.'.join(hostname.split('.')[:-2]), "HostRecord")
+        record = self.dnsRecord(entity) if entity and entity['id'] else None
+        with self.bluecat_manager.dns_lock:
+            self.bluecat_manager.dns_dict.setdefault(host_area, {})[host_without_zone] = record
+        return record
+
+    def prefetchZone(self, host_area):
+        """Load every host record in a zone in one go, for imports that touch many hosts in it.
+
+        Args:
+            host_area (str): The zone name e.g. "test"
+        """
+        host_area = host_area.upper()
+
+        def build():
+            if host_area not in self.bluecat_manager.full_updates:
+                print(f"Building dictionary for '{host_area.lower()}.'")
+                self.buildDnsDict(host_area)
 
-    def findExistingHostID(self, hostname):
-        """ Finds the object ID of an existing host
+        if host_area not in self.bluecat_manager.full_updates:
+            self.bluecat_manager.dns_loader.once(host_area, build)
+
+    def networkId(self, ip):
+        """Find the Bluecat ID of the network an IP is in from the topology index, or None if it isn't in one."""
+        ip_int = BluecatUtils.ipToInt(ip)
+        block_chain = self.bluecat_manager.topology.chain(ip_int, "IP4Block")
+        if not block_chain:
+            return None
+        network_chain = self.bluecat_manager.topology.chain(ip_int, "IP4Network", block_chain[-1]['id'])
+        return network_chain[-1]['id'] if network_chain else None
+
+    @staticmethod
+    def requestedNetwork(entry):
+        """Get the network CIDR a host row asks for the next free address in, or None if the row gives an address.
+            The CIDR can be given in place of the address, or the address left blank and the CIDR put in a sixth column.
+        """
+        if '/' in entry[2]:
+            return entry[2]
+        if not entry[2] and len(entry) > 5 and entry[5]:
+            return entry[5]
+        return None
+
+    def findNetwork(self, cidr):
+        """Find the network with exactly this CIDR in the topology index, or None if BAM doesn't have it."""
+        network = ipaddress.ip_network(cidr, strict=False)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        block_chain = self.bluecat_manager.topology.chain(first, "IP4Block")
+        network_chain = self.bluecat_manager.topology.chain(first, "IP4Network", block_chain[-1]['id']) if block_chain else []
+        if network_chain and (network_chain[-1].first, network_chain[-1].last) == (first, last):
+            return network_chain[-1]
+        return None
+
+    def nextFreeAddress(self, first, last, net_id=None, gateway=None):
+        """Take the next free address in a network from its bitmap, building the bitmap on first use.
 
         Args:
-            hostname (str): The hostname of the record of which the ID needs to be found
+            first (int): The network address
+            last (int): The broadcast address
+            net_id (int, optional): The Bluecat ID of the network, None for a network that isn't in BAM yet
+            gateway (int, optional): The network's gateway address
 
         Returns:
-            id (int): The Bluecat ID of the host
+            str: The address taken
         """
-        elements = hostname.split('.')
-        host_area = elements[-2]
-        modified_elements = elements[:-2]
-        host_without_zone = '.'.join(modified_elements)
-        subzone = 0
+        free = self.bluecat_manager.free_addresses
+        if not free.isLoaded(first, last):
+            free.build(first, last, self.bluecat_manager.addresses.load(net_id) if net_id is not None else (), gateway)
+        return str(ipaddress.ip_address(free.allocate(first, last)[0]))
+
+    def allocateAddress(self, hostname, cidr):
+        """Pick the address for a host row that names a network rather than an address.
+            A host that already has an address in the network gets nothing new, so rerunning the CSV changes nothing.
 
-        if host_area.upper() not in self.bluecat_manager.full_updates:
-            print(f"Building dictionary for '{host_area}.'")
-            self.buildDnsDict(host_area.upper())
+        Args:
+            hostname (str): The full hostname
+            cidr (str): The CIDR of the network
 
-        for host in self.bluecat_manager.dns_dict[host_area.upper()]:
-            if host['name'] is not None:
-                if host_without_zone.upper() == host['name'].upper():
-                    return host['id']
+        Returns:
+            str: The next free address in the network, or None if the host already has one there
+        """
+        network = self.findNetwork(cidr)
+        if network is None:
+            raise ValueError(f"Network {cidr} doesn't exist.")
+        existing = self.findExistingHost(hostname)
+        if existing is not None and any(network.first <= BluecatUtils.ipToInt(address) <= network.last for address in existing.addresses):
+            return None
+        return self.nextFreeAddress(network.first, network.last, network.id, network.gateway)
 
     def IsIpAlreadyAssigned(self, ip, net_id):
         """ Check to see if the IP address in the range is already assigned
@@ -200,162 +317,194 @@ class Host:
             True: The IP is already assigned to one of the addresses in the network range
             False: The IP address has not yet been assigned to
         """
-        existing_allocations = self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, net_id, "IP4Address")
-        if existing_allocations:
-            for entity in self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, net_id, "IP4Address"):
-                if ip == self.bluecat_manager.utils.extractAddress(entity['properties']):
-                    return True
-        return False
-
-    def updateComments(self, host_id, name, data, comments, comments_action):
-        """Updates the comments properties for an existing entry based on the required action
-
-        Args
-            host_id (int): ID of the host that the comments are being edited on.
-            name (str): The full name of the host that the comments are being edited on (including domains).
-            data (dic): The full data dictionary of the host provided.
-            comments (str): The comments to be added to the host.
-            comments_action(str): The action for the comment (add, append or replace).
-
-        Returns:
-            None
-        """
-        
-        properties = data['properties']
-        comments_key = "comments"
+        return self.bluecat_manager.addresses.contains(net_id, ip)
 
-        if comments_action.lower() == "add":
-            if comments_key not in properties:
-                data = self.addComments(data, comments)
-            else:
-                pass
-        elif comments_action.lower() == "append":
-            data = self.appendComments(data, comments, properties, comments_key)
-        elif comments_action.lower() == "replace":
-            data = self.replaceComments(data, comments, properties, comments_key)
-        else:
-            raise ValueError("Invalid comments_action value. Allowed values are 'Add', 'Append', 'Replace'.")
-
-        self.bluecat_manager.client.service.update(data)
-        self.addToDict(name, host_id)
-
-    def addComments(self, data, comments):
-        """ Updates the data field by creating, and adding to the comments field in the properties
+    @staticmethod
+    def commentsAfter(current, comments, comments_action):
+        """Work out a host's comments after one comment action (add only fills in missing comments).
 
         Args:
-            data (dic): The full data dictionary of the host provided.
-            comments (str): The comments to be added to the host.
+            current (str): The comments the host has now, or None if it has no comments field
+            comments (str): The comments from the row
+            comments_action (str): add, append or replace
 
         Returns:
-            data (dic): The data dictionary containing the comments attribute
+            str: The resulting comments, or None if there still aren't any
         """
-        data['properties'] += f"|comments={comments}"
-        return data
+        action = comments_action.lower()
+        if current is None or action == "replace":
+            return comments
+        if action == "append":
+            return current + "\r\n" + comments
+        return current
 
-    def appendComments(self, data, comments, properties, comments_key):
-        """ Tries to append the comments to the data field if it already has comments
-            If it doesn't, it calls addComments() to create and add the comments
+    def createHostRecord(self, _name, addresses, comments = None):
+        """ Create a host record with all of its addresses in one call.
 
         Args:
-            data (dic): The full data dictionary of the host provided.
-            comments (str): The comments to be added to the host.
-            properties (str): The properties field within the host record
-            comments_key (str): The key to look out for in the properties field (e.g. "comments")
+            _name (str): The full name of the record to add
+            addresses (list): The IP addresses to assign to the host record
+            comments (str, optional): The comments to add to the host record
 
         Returns:
-            data (dic): The data dictionary containing the comments attribute
+            None
         """
-        if comments_key in properties:
-            data = self.updateRecord(data, comments, comments_key, delim="\r\n", replace=False)
-        else:
-            self.addComments(data, comments)
-        return data
+        properties = f"reverseRecord=true|comments={comments}" if comments else "reverseRecord=true"
+        add_id = self.bluecat_manager.client.service.addHostRecord(self.bluecat_manager.top_level_view_id, _name, ','.join(addresses), "0", properties)
+        # Everything the dictionary keeps is already known, so there is no need to fetch the new record back
+        self.storeInDict(_name, HostRecord(add_id, '.'.join(_name.split('.')[:-2]), tuple(addresses), comments))
+        self.recordAddresses(addresses)
+        print(f"Assigned {_name} to {', '.join(addresses)}.")
 
-    def replaceComments(self, data, comments, properties, comments_key):
-        """ Tries to replace the comments to the data field if it already has comments
-            If it doesn't, it calls addComments() to create and add the comments
+    def writeHostRecord(self, host_id, _name, changes):
+        """ Apply a host's row changes to the record as BAM has it now, in one update call.
+
+        The changes are merged into the entity just fetched rather than the cached copy, so addresses and
+        comments written by anything else since the cache was filled are kept.
 
         Args:
-            data (dic): The full data dictionary of the host provided.
-            comments (str): The comments to be added to the host.
-            properties (str): The properties field within the host record
-            comments_key (str): The key to look out for in the properties field (e.g. "comments")
+            host_id (int): The Bluecat ID of the host record
+            _name (str): The full name of the host record
+            changes (list): (ip, comments, comments_action) for each row, in CSV order
 
         Returns:
-            data (dic): The data dictionary containing the comments attribute
+            None
         """
-        if comments_key in properties:
-            data = self.updateRecord(data, comments, comments_key, replace=True)
-        else:
-            self.addComments(data, comments)
-        return data
-                
-    def addNewHostRecord(self, view_id, _name, ip, comments):
-        """ Add a host record, given the host doesn't already exist and the IP isn't already assigned
-            If there are comments to add, then add them, otherwise just create the host record without comments
+        host = self.bluecat_manager.client.service.getEntityById(host_id)
+        current = HostRecord.fromEntity(host)
+        addresses, comments = self.mergeChanges(current, changes)
+        added = [address for address in addresses if address not in current.addresses]
+        properties = Properties(host['properties'])
+        properties['addresses'] = ','.join(addresses)
+        if comments is not None:
+            properties['comments'] = comments
+        host['properties'] = str(properties)
+        self.bluecat_manager.client.service.update(host)
+        self.storeInDict(_name, host)
+        self.recordAddresses(added)
+        print(f"Assigned {_name} to {', '.join(added)}. Existing record updated.")
+
+    def recordAddresses(self, addresses):
+        """Mark addresses as assigned in the address cache after a write."""
+        for address in addresses:
+            net_id = self.networkId(address)
+            if net_id is not None:
+                self.bluecat_manager.addresses.add(net_id, address)
+
+    def rowComments(self, entry):
+        """Get the comments and comment action from a host row, or (None, None) if it has none or they fail validation."""
+        if len(entry) > 4 and entry[3] and entry[4]:
+            if self.areCommentsSectionValid(entry[3], entry[4]):
+                return entry[3], entry[4]
+            print(f"Excluded comments from ({entry[1]}, {entry[2]}) as it hasn't passed validation.")
+        return None, None
+
+    def mergeChanges(self, existing, changes):
+        """Work out a host record's final addresses and comments after a series of rows, in CSV order.
 
         Args:
-            view_id (int): The Bluecat view ID
-            _name (str): The name of the record to add
-            ip (str): The initial IP address to assign to the host record
-            comments (str): The comments to add to the host record
+            existing (dic): The host's dictionary record, or None if it is being created
+            changes (list): (ip, comments, comments_action) for each row, comments None if the row has none
 
         Returns:
-            None
+            tuple: (addresses, comments), comments None if the record has no comments field
         """
-        if comments:
-            add_id = self.bluecat_manager.client.service.addHostRecord(view_id, _name, ip, "0", f"reverseRecord=true|comments={comments}")
+        if existing is None:
+            addresses, comments = [], None
         else:
-            add_id = self.bluecat_manager.client.service.addHostRecord(view_id, _name, ip, "0", f"reverseRecord=true")
-        # Add the new host record into the dictionary
-        self.addToDict(_name, add_id)
-        print(f"Assigned {_name} to {ip}.")
+            addresses, comments = list(existing.addresses), existing.comments
+
+        for i, (ip, row_comments, comments_action) in enumerate(changes):
+            if ip not in addresses:
+                addresses.append(ip)
+            if row_comments:
+                # A new record takes the first row's comments whatever the action
+                comments = row_comments if existing is None and i == 0 else self.commentsAfter(comments, row_comments, comments_action)
+        return addresses, comments
 
-    def updateHostRecord(self, _name, ip, comments, comments_action):
-        """ Finds the existing host record that is clashing and updates the record with the new IPs and comments.
-            Will call updateRecordWithIP() which will create the updated record.
-            If comments required, will call updateComments() which will sort out comments for the record.
+    def writeHost(self, _name, changes):
+        """ Apply every change for one hostname as a single create, or a single update if the host already exists.
 
         Args:
-            _name (str): The name of the record to update
-            ip (str): The new IP address to assign to the host record
-            comments (str): The comments to add to the host record
-            comments_action (str): How to add the comments (Should they only be added if there are none existing? Should they append? Should they replace existing?)
+            _name (str): The full name of the host record
+            changes (list): (ip, comments, comments_action) for each row, in CSV order
 
         Returns:
             None
         """
-        host_id = self.findExistingHostID(_name)
-        host = self.bluecat_manager.client.service.getEntityById(host_id)
-        self.bluecat_manager.client.service.update(self.updateRecord(host, ip, "addresses"))
-
-        if comments and comments_action:
-            self.updateComments(host_id, _name, host, comments, comments_action)
-            
-        print(f"Assigned {_name} to {ip}. Existing record with IP added.")
+        with self.bluecat_manager.instrumentation.phase("lookup"):
+            existing = self.findExistingHost(_name)
+        if existing is None:
+            addresses, comments = self.mergeChanges(None, changes)
+            try:
+                self.createHostRecord(_name, addresses, comments)
+                return
+            except Exception as e:
+                # A duplicate means the dictionary is out of date, so ask BAM for the record and update it instead
+                if BluecatUtils.faultKind(e) != "duplicate":
+                    raise
+                existing = self.lookupHost(_name)
+                if existing is None:
+                    raise
+                if set(addresses) <= set(existing.addresses) and comments == existing.comments:
+                    # The create went through but its reply was lost, so applying the rows again would repeat appended comments
+                    self.storeInDict(_name, existing)
+                    self.recordAddresses(addresses)
+                    print(f"Assigned {_name} to {', '.join(addresses)}.")
+                    return
+        self.writeHostRecord(existing['id'], _name, changes)
+
+    def ProcessEntries(self, entries):
+        """ Process every row for one hostname together, so the host record is written once.
+            Rows whose address is already assigned are skipped. Rows that name a network
+            instead of an address are given the network's next free address.
 
-    def addHost(self, view_id, net_id, _name, ip, comments = None, comments_action = None):
-        """ Tries to add a host with a specific IP address.
-            Initially just tries to add a new host record, failing this, will try to update the existing record.
-            
         Args:
-            view_id (int): The Bluecat view ID
-            net_id (int): The Bluecat ID for the network the host is being added to
-            _name (str): The name of the record to add (or update if the case may be)
-            ip (str): The IP address to assign to the host record
-            comments (str, optional): The comments to add to the host record
-            comments_action (str, optional): How to add the comments (Should they only be added if there are none existing? Should they append? Should they replace existing?)
+            entries (list): The CSV rows for the hostname, in CSV order
 
         Returns:
-            None
+            list: The error for each row, or None for rows that went through
         """
-        if self.IsIpAlreadyAssigned(ip, net_id):
-            print(f"Address ({ip}) already assigned.")
-        else:
+        with self.bluecat_manager.instrumentation.phase("validation"):
+            valid = self.checkIfValidHostname(entries[0][1])
+        if not valid[0]:
+            return [valid[1]] * len(entries)
+
+        errors = [None] * len(entries)
+        changes, pending, seen = [], [], set()
+        for i, entry in enumerate(entries):
+            try:
+                address, cidr = entry[2], self.requestedNetwork(entry)
+                if cidr is not None:
+                    with self.bluecat_manager.instrumentation.phase("allocate"):
+                        address = self.allocateAddress(entry[1], cidr)
+                    if address is None:
+                        print(f"{entry[1]} already has an address in {cidr}.")
+                        continue
+                with self.bluecat_manager.instrumentation.phase("dig"):
+                    ip_int = BluecatUtils.ipToInt(address)
+                    net_id = self.networkId(ip_int)
+                if net_id is None:
+                    raise ValueError(f"Address ({address}) is not in a network.")
+                with self.bluecat_manager.instrumentation.phase("exists"):
+                    assigned = ip_int in seen or self.IsIpAlreadyAssigned(ip_int, net_id)
+                if assigned:
+                    print(f"Address ({address}) already assigned.")
+                    continue
+                seen.add(ip_int)
+                changes.append((address,) + self.rowComments(entry))
+                pending.append(i)
+            except Exception as e:
+                errors[i] = str(e) or type(e).__name__
+
+        if changes:
             try:
-                self.addNewHostRecord(view_id, _name, ip, comments)
+                with self.bluecat_manager.instrumentation.phase("write"):
+                    self.writeHost(entries[0][1], changes)
             except Exception as e:
-                self.updateHostRecord(_name, ip, comments, comments_action)
+                for i in pending:
+                    errors[i] = str(e) or type(e).__name__
+        return errors
 
     def checkIfHostnameHasTwoDomains(self, hostname):
         """ Checks if a hostname has two layers of domains
@@ -383,7 +532,7 @@ class Host:
         """        
         elements = hostname.split('.')
         domain = elements[-1]
-        if domain.upper() != "":
+        if domain.upper() != config.get("parent_domain", "").upper():
             return False
         return True
 
@@ -397,13 +546,9 @@ class Host:
             True: Host has a valid subdomain
             False: Host has an invalid subdomain
         """  
-        host_area_exists = False
         elements = hostname.split('.')
         host_area = elements[-2]
-        for zone in self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, self.bluecat_manager.view_id, "Zone"):
-            if zone['name'].upper() == host_area.upper():
-                host_area_exists = True
-        if not host_area_exists:
+        if self.bluecat_manager.zones.getId(host_area) is None:
             return False
         return True
 
@@ -431,166 +576,2710 @@ class Host:
             )
         )
 
-class BluecatUtils:
-    @staticmethod
-    def checkIfExists(subnet, chain):
-        """Check if a subnet is in a chain."""
-        exists = False
-        for link in chain:
-            if subnet == BluecatUtils.extractCidr(link['properties']):
-                exists = True
-        return exists
+class Loader:
+    """Makes sure concurrent threads asking for the same uncached data share a single fetch.
+
+    Only the threads waiting on a key are held up while it loads; other keys load alongside it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loading = {} # key -> Future of the fetch in flight
+
+    def once(self, key, fetch):
+        with self.lock:
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = self.loading[key] = concurrent.futures.Future()
+        if owner:
+            try:
+                future.set_result(fetch())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.loading[key]
+        return future.result()
+
+class TopologyIndex:
+    """In-memory index of the block and network tree.
+
+    The children of each container are fetched once and held as sorted integer ranges, so finding the
+    block or network an IP sits in is a local bisect rather than a getEntities round trip per level.
+    """
+    def __init__(self, bluecat_manager):
+        self.bluecat_manager = bluecat_manager
+        self.containers = {} # (parent_id, type) -> {'starts': [...], 'children': [(first, last, entity), ...]}
+        self.lock = threading.RLock() # Held only to publish changes, never across a fetch
+        self.loader = Loader()
 
-    @staticmethod
-    def extractCidr(properties):
-        """Get the CIDR out of the properties field."""
-        for prop in properties.split('|'):
-            if prop.startswith('CIDR='):
-                return prop.replace('CIDR=', '')
+    def loadChildren(self, parent_id, _type):
+        """Fetch the children of a container once and store them as sorted integer ranges.
 
-    @staticmethod
-    def extractAddress(properties):
-        """Get the address out of the properties field."""
-        for prop in properties.split('|'):
-            if prop.startswith('address='):
-                return prop.replace('address=', '')
+        Args:
+            parent_id (int): The Bluecat ID of the container
+            _type (str): The type of children to load e.g. "IP4Block" or "IP4Network"
 
-    @staticmethod
-    def extractStartEnd(properties):
-        """Extract the start and end of a range from the properties field."""
-        start, end = None, None
-        for prop in properties.split('|'):
-            if prop.startswith('start='):
-                start = prop.replace('start=', '')
-            elif prop.startswith('end='):
-                end = prop.replace('end=', '')
-        return start, end
+        Returns:
+            dic: The index entry for the container
+        """
+        key = (parent_id, _type)
+        container = self.containers.get(key)
+        if container is None:
+            self.loader.once(key, lambda: self.fetchChildren(parent_id, _type))
+            container = self.containers[key]
+        return container
+
+    def fetchChildren(self, parent_id, _type):
+        """Fetch the children of a container from the snapshot cache or BAM and publish them to the index."""
+        if (parent_id, _type) in self.containers:
+            return # Published by a fetch that finished just before this one was started
+        snapshot = self.bluecat_manager.snapshot
+        rows = snapshot.load("topology", f"{parent_id}:{_type}") if snapshot else None
+        if rows is not None and snapshot.isCurrent(rows, self.bluecat_manager.client, parent_id, _type):
+            self.storeChildren(parent_id, _type, rows)
+        else:
+            entities = list(self.bluecat_manager.utils.iterEntities(self.bluecat_manager.client, parent_id, _type))
+            self.storeChildren(parent_id, _type, entities)
+            self.saveSnapshot(parent_id, _type, entities)
+
+    def reloadChildren(self, parent_id):
+        """Fetch a container's blocks and networks from BAM again, bypassing the snapshot cache.
+            Used when BAM reports an object that the index doesn't know about.
+
+        Args:
+            parent_id (int): The Bluecat ID of the container
+
+        Returns:
+            None
+        """
+        for _type in ("IP4Block", "IP4Network"):
+            entities = list(self.bluecat_manager.utils.iterEntities(self.bluecat_manager.client, parent_id, _type))
+            self.storeChildren(parent_id, _type, entities)
+            self.saveSnapshot(parent_id, _type, entities)
+
+    def saveSnapshot(self, parent_id, _type, entities):
+        """Write a container's children to the snapshot cache, if one is configured."""
+        if self.bluecat_manager.snapshot:
+            rows = [(str(entity['id']), entity['id'], entity['name'], entity['properties']) for entity in entities]
+            self.bluecat_manager.snapshot.store("topology", f"{parent_id}:{_type}", rows)
+
+    def storeChildren(self, parent_id, _type, entities):
+        """Index the fetched children of a container as sorted integer ranges of compact records."""
+        children = []
+        for entity in entities:
+            record = ContainerRecord.fromEntity(entity, _type)
+            if record.first is not None:
+                children.append((record.first, record.last, record))
+        children.sort(key=lambda child: child[0])
+        with self.lock:
+            self.containers[(parent_id, _type)] = {'starts': [child[0] for child in children], 'children': children}
 
     @staticmethod
-    def dig(client, ip, _type, begin_from=5):
+    def searchContainer(container, ip_int):
+        """Bisect a container's children for the one holding an IP, returning None if there isn't one."""
+        i = BluecatUtils.findRange(container['starts'], container['children'], ip_int)
+        return container['children'][i][2] if i is not None else None
+
+    def findChild(self, parent_id, _type, ip_int):
+        """Find the child of a container that holds an IP.
+
+        Args:
+            parent_id (int): The Bluecat ID of the container
+            _type (str): The type of child to look for
+            ip_int (int): The IP address as an integer
+
+        Returns:
+            The matching entity, or None if no child holds the IP
         """
-        Digs through all layers of objects to find the lowest level object that the IP fits in.
-        
+        return self.searchContainer(self.loadChildren(parent_id, _type), ip_int)
+
+    def chain(self, ip, _type, begin_from=5):
+        """Find the chain of containers holding an IP, from the index, only calling the API for containers not yet loaded.
+
         Args:
-            ip (str): IP address to search for.
+            ip (str or int): IP address to search for.
             _type (str): Type of object to dig through.
             begin_from (int, optional): Beginning object ID. Defaults to 5.
-        
+
         Returns:
             list: A chain of matching objects.
         """
+        ip_int = BluecatUtils.ipToInt(ip)
         chain = []
-        result = BluecatUtils.getEntities(client, begin_from, _type)
+        parent_id = begin_from
         while True:
-            end_of_chain, result, chain = BluecatUtils.processResult(client, result, ip, _type, chain)
-            if end_of_chain:
-                break
-        return chain
+            entity = self.findChild(parent_id, _type, ip_int)
+            if entity is None:
+                return chain
+            chain.append(entity)
+            parent_id = entity['id']
+
+    def addChild(self, parent_id, _type, _id, name, properties):
+        """Record a newly created block or network so later rows can see it without reloading.
+            BAM moves existing siblings that fall inside a new block underneath it, so do the same here.
+
+        Args:
+            parent_id (int): The Bluecat ID of the container the object was added to
+            _type (str): The type of the new object
+            _id (int): The Bluecat ID of the new object
+            name (str): The name of the new object
+            properties (str): The properties of the new object (must include the CIDR)
+
+        Returns:
+            None
+        """
+        entity = ContainerRecord.fromEntity({'id': _id, 'name': name, 'properties': properties}, _type)
+        first, last = entity.first, entity.last
+
+        with self.lock:
+            changed = []
+            for child_type in ("IP4Block", "IP4Network"):
+                key = (parent_id, child_type)
+                if key not in self.containers:
+                    continue
+                kept, moved = [], []
+                for child in self.containers[key]['children']:
+                    (moved if first <= child[0] and child[1] <= last else kept).append(child)
+                if child_type == _type:
+                    kept.append((first, last, entity))
+                    kept.sort(key=lambda child: child[0])
+                self.containers[key] = {'starts': [child[0] for child in kept], 'children': kept}
+                changed.append(key)
+                if _type == "IP4Block":
+                    self.containers[(_id, child_type)] = {'starts': [child[0] for child in moved], 'children': moved}
+                    changed.append((_id, child_type))
+
+            for key in changed:
+                self.saveSnapshot(key[0], key[1], [child[2] for child in self.containers[key]['children']])
+
+class ZoneCache:
+    """Map of zone name to zone ID for the configured view, loaded once per session.
+
+    The zone list hardly ever changes during a run, so it is only fetched again on an explicit refresh()
+    or, if a TTL is configured, once it is older than that.
+    """
+    def __init__(self, bluecat_manager, ttl=None):
+        self.bluecat_manager = bluecat_manager
+        self.ttl = ttl # Seconds before the zone list is re-fetched, None to keep it for the whole session
+        self.zones = None # uppercase zone name -> zone ID
+        self.loaded_at = 0
+        self.lock = threading.RLock()
+
+    def refresh(self):
+        """Re-fetch the zone list for the view."""
+        with self.lock:
+            zones = list(self.bluecat_manager.utils.iterEntities(self.bluecat_manager.client, self.bluecat_manager.view_id, "Zone"))
+            self.storeZones(zones)
+            if self.bluecat_manager.snapshot:
+                self.bluecat_manager.snapshot.store("zones", "zones", [(zone['name'].upper(), zone['id'], zone['name'], None) for zone in zones])
+
+    def storeZones(self, entities):
+        """Replace the zone map with freshly fetched zones."""
+        zones = {}
+        for zone in entities:
+            zones[zone['name'].upper()] = zone['id']
+        with self.lock:
+            self.zones = zones
+            self.loaded_at = time.monotonic()
+
+    def isStale(self):
+        """Check if the zone list needs fetching (never loaded, or older than the TTL)."""
+        return self.zones is None or (self.ttl is not None and time.monotonic() - self.loaded_at > self.ttl)
+
+    def getId(self, name):
+        """Get the ID of a zone in the view.
+
+        Args:
+            name (str): The name of the zone (any case)
+
+        Returns:
+            id (int): The Bluecat ID of the zone, or None if it doesn't exist
+        """
+        with self.lock:
+            snapshot = self.bluecat_manager.snapshot
+            if self.zones is None and snapshot:
+                rows = snapshot.load("zones", "zones")
+                if rows is not None and snapshot.isCurrent(rows, self.bluecat_manager.client, self.bluecat_manager.view_id, "Zone"):
+                    self.storeZones(rows)
+            if self.isStale():
+                self.refresh()
+            return self.zones.get(name.upper())
+
+class AddressIndex:
+    """Per-network set of assigned addresses, held as integers.
+
+    Each network's IP4Address entities are fetched once (paging through all of them) and then kept
+    current as host records are written, so IsIpAlreadyAssigned is a set lookup.
+    """
+    def __init__(self, bluecat_manager):
+        self.bluecat_manager = bluecat_manager
+        self.networks = {} # net_id -> set of integer addresses
+        self.lock = threading.RLock() # Held only to publish changes, never across a fetch
+        self.loader = Loader()
+
+    def load(self, net_id):
+        """Fetch every assigned address in a network, once.
+
+        Args:
+            net_id (int): The Bluecat ID of the network range
+
+        Returns:
+            set: The integer addresses assigned in the network
+        """
+        assigned = self.networks.get(net_id)
+        if assigned is None:
+            self.loader.once(net_id, lambda: self.fetchAddresses(net_id))
+            assigned = self.networks[net_id]
+        return assigned
+
+    def fetchAddresses(self, net_id):
+        """Fetch the assigned addresses of a network from the snapshot cache or BAM and publish them to the index."""
+        if net_id in self.networks:
+            return # Published by a fetch that finished just before this one was started
+        snapshot = self.bluecat_manager.snapshot
+        rows = snapshot.load("addresses", str(net_id)) if snapshot else None
+        if rows is not None and snapshot.isCurrent(rows, self.bluecat_manager.client, net_id, "IP4Address"):
+            with self.lock:
+                self.networks[net_id] = {int(row['item']) for row in rows}
+        else:
+            self.storeAddresses(net_id, self.bluecat_manager.utils.iterEntities(self.bluecat_manager.client, net_id, "IP4Address"))
+            self.saveSnapshot(net_id)
+
+    def saveSnapshot(self, net_id):
+        """Write a network's addresses to the snapshot cache, if one is configured."""
+        if self.bluecat_manager.snapshot:
+            self.bluecat_manager.snapshot.store("addresses", str(net_id), [(str(address), None, None, None) for address in self.networks[net_id]])
+
+    def storeAddresses(self, net_id, entities):
+        """Index the fetched IP4Address entities of a network."""
+        assigned = set()
+        for entity in entities:
+            address = Properties(entity['properties']).get('address')
+            if address:
+                assigned.add(int(ipaddress.ip_address(address)))
+        with self.lock:
+            self.networks[net_id] = assigned
+
+    def contains(self, net_id, ip):
+        """Check if an IP is already assigned in a network."""
+        return BluecatUtils.ipToInt(ip) in self.load(net_id)
+
+    def add(self, net_id, ip):
+        """Record an address as assigned after a successful write. Networks not yet loaded are left alone."""
+        with self.lock:
+            if net_id in self.networks:
+                ip_int = BluecatUtils.ipToInt(ip)
+                self.networks[net_id].add(ip_int)
+                if self.bluecat_manager.snapshot:
+                    self.bluecat_manager.snapshot.upsert("addresses", str(net_id), str(ip_int))
+
+class FreeAddressMap:
+    """Per-network bitmap of the addresses that are taken, for handing out the next free ones.
+
+    A network's bitmap is built once from its assigned addresses (one paged fetch through the AddressIndex),
+    with the network and broadcast addresses, the gateway and any addresses reserved for explicit rows in the
+    import marked as taken. Allocating is then a bit operation on a Python integer, so any number of hosts can
+    be placed without a round trip per candidate address.
+    """
+    def __init__(self):
+        self.networks = {} # (first, last) -> int, bit n set if address first + n is taken
+        self.reserved = [] # Sorted integer addresses that must not be handed out
+        self.lock = threading.RLock()
 
     @staticmethod
-    def processResult(client, result, ip, _type, chain):
+    def explicitAddresses(rows):
+        """Get the addresses that rows name explicitly: Host row addresses and Network row gateways, as integers."""
+        addresses = set()
+        for entry in rows:
+            column = 3 if entry and entry[0] == "Network" else 2
+            if len(entry) > column and entry[0] in ("Host", "Network"):
+                try:
+                    addresses.add(BluecatUtils.ipToInt(entry[column]))
+                except ValueError:
+                    pass # A CIDR or blank, or not an address at all
+        return addresses
+
+    def reserve(self, addresses):
+        """Keep addresses (integers) from being handed out, including in bitmaps that are already built."""
+        addresses = set(addresses)
+        with self.lock:
+            self.reserved = sorted(addresses.union(self.reserved))
+            for (first, last) in self.networks:
+                for address in addresses:
+                    if first <= address <= last:
+                        self.networks[(first, last)] |= 1 << (address - first)
+
+    def isLoaded(self, first, last):
+        return (first, last) in self.networks
+
+    def build(self, first, last, assigned, gateway=None):
+        """Build the bitmap for a network, unless it is already built.
+
+        Args:
+            first (int): The network address
+            last (int): The broadcast address
+            assigned (iterable): The integer addresses BAM already has in the network, reserved ones included
+            gateway (int, optional): The network's gateway address
+
+        Returns:
+            None
         """
-        Process the result of a getEntities call, update the chain and return the next set of entities.
-        
+        size = last - first + 1
+        taken = bytearray((size + 7) // 8)
+        reserved = self.reserved[bisect.bisect_left(self.reserved, first):bisect.bisect_right(self.reserved, last)]
+        edges = (first, last) if size > 2 else () # /31 and /32 networks have no network or broadcast address
+        for address in itertools.chain(assigned, reserved, edges, (gateway,) if gateway is not None else ()):
+            if first <= address <= last:
+                offset = address - first
+                taken[offset >> 3] |= 1 << (offset & 7)
+        with self.lock:
+            self.networks.setdefault((first, last), int.from_bytes(taken, "little"))
+
+    def allocate(self, first, last, count=1):
+        """Take the lowest free addresses in a network whose bitmap has been built.
+
         Args:
-            result (list): The result of a getEntities call.
-            ip (str): IP address to search for.
-            _type (str): Type of object to dig through.
-            chain (list): The current chain of matching objects.
-            
+            first (int): The network address
+            last (int): The broadcast address
+            count (int, optional): How many addresses to take. Defaults to 1.
+
         Returns:
-            tuple: A tuple containing a boolean indicating if the end of the chain is reached, 
-                   the next set of entities, and the updated chain.
-        """
-        end_of_chain = True
-        if result:
-            for obj in result:
-                cidr, start, end = BluecatUtils.extractCidrStartEnd(obj['properties'])
-                if BluecatUtils.isIpInBlock(ip, cidr, start, end):
-                    chain += [obj]
-                    next_id = obj['id']
-                    end_of_chain = False
-                    result = BluecatUtils.getEntities(client, next_id, _type)
-                    break
-        return end_of_chain, result, chain
+            list: The integer addresses taken, in ascending order
+        """
+        with self.lock:
+            taken = self.networks[(first, last)]
+            addresses = []
+            for _ in range(count):
+                lowest = ~taken & (taken + 1) # The lowest clear bit
+                offset = lowest.bit_length() - 1
+                if first + offset > last:
+                    raise ValueError(f"No free addresses left in {ipaddress.ip_address(first)}-{ipaddress.ip_address(last)}.")
+                taken |= lowest
+                addresses.append(first + offset)
+            self.networks[(first, last)] = taken
+            return addresses
+
+class Properties(dict):
+    """A BAM properties field ("key=value|key=value|") parsed once into an ordered key/value mapping.
+
+    str() turns it back into BAM's pipe format for update calls.
+    """
+    def __init__(self, properties=""):
+        super().__init__()
+        self.int_range = False # Not worked out yet
+        for prop in (properties or "").split('|'):
+            if prop:
+                key, _, value = prop.partition('=')
+                self[key] = value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.int_range = False
+
+    def copy(self):
+        properties = Properties()
+        properties.update(self)
+        return properties
+
+    def range(self):
+        """Get the (first, last) integer range of a block or network from its CIDR, or its start and end.
+            Worked out on the first call and kept, or None if the properties have neither.
+        """
+        if self.int_range is False:
+            self.int_range = None
+            if self.get('CIDR'):
+                network = ipaddress.ip_network(self['CIDR'], strict=False)
+                self.int_range = (int(network.network_address), int(network.broadcast_address))
+            elif self.get('start') and self.get('end'):
+                self.int_range = (int(ipaddress.ip_address(self['start'])), int(ipaddress.ip_address(self['end'])))
+        return self.int_range
+
+    def __str__(self):
+        return ''.join(f"{key}={value}|" for key, value in self.items())
+
+class ContainerRecord:
+    """Compact cached copy of a block or network, holding only the fields the tool uses.
+
+    Supports entity['field'] lookups like the zeep objects it stands in for.
+    """
+    __slots__ = ("id", "name", "type", "cidr", "first", "last", "gateway")
+
+    def __init__(self, _id, name, _type, cidr, first, last, gateway=None):
+        self.id = _id
+        self.name = name
+        self.type = _type
+        self.cidr = cidr
+        self.first = first
+        self.last = last
+        self.gateway = gateway # Integer gateway address of a network, None if it has none
+
+    @classmethod
+    def fromEntity(cls, entity, _type):
+        """Build a record from a BAM entity (or a snapshot row), parsing its properties once."""
+        properties = Properties(entity['properties'])
+        first, last = properties.range() or (None, None)
+        gateway = BluecatUtils.ipToInt(properties['gateway']) if properties.get('gateway') else None
+        return cls(entity['id'], entity['name'], _type, properties.get('CIDR'), first, last, gateway)
+
+    @property
+    def properties(self):
+        """The range (and gateway) as a BAM properties string, enough to rebuild the record from the snapshot cache."""
+        gateway = f"gateway={ipaddress.ip_address(self.gateway)}|" if self.gateway is not None else ""
+        if self.cidr:
+            return f"CIDR={self.cidr}|{gateway}"
+        return f"start={ipaddress.ip_address(self.first)}|end={ipaddress.ip_address(self.last)}|{gateway}"
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+class HostRecord:
+    """Compact cached copy of a host record: its ID, name, addresses and comments.
+
+    The full entity is only fetched when an update is about to be sent. Supports entity['field'] lookups.
+    """
+    __slots__ = ("id", "name", "addresses", "comments")
+    type = "HostRecord"
+
+    def __init__(self, _id, name, addresses, comments):
+        self.id = _id
+        self.name = name
+        self.addresses = addresses # Tuple of address strings
+        self.comments = comments # None if the record has no comments field
+
+    @classmethod
+    def fromEntity(cls, entity):
+        """Build a record from a BAM entity (or a snapshot row), parsing its properties once."""
+        properties = Properties(entity['properties'])
+        addresses = tuple(address for address in properties.get('addresses', '').split(',') if address)
+        return cls(entity['id'], entity['name'], addresses, properties.get('comments'))
+
+    @property
+    def properties(self):
+        """The addresses and comments as a BAM properties string, enough to rebuild the record from the snapshot cache."""
+        comments = f"comments={self.comments}|" if self.comments is not None else ""
+        return f"addresses={','.join(self.addresses)}|{comments}"
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+class BluecatUtils:
+    DUPLICATE_FAULTS = ("duplicate", "already exists")
+    TRANSIENT_FAULTS = ("timed out", "timeout", "temporarily unavailable", "try again", "too many requests", "server is busy")
+    TRANSIENT_STATUS = (408, 429, 502, 503, 504)
 
     @staticmethod
-    def extractCidrStartEnd(properties):
+    def faultKind(error):
+        """Sort an exception from a BAM call by what should be done about it.
+
+        Args:
+            error (Exception): The exception raised by the call
+
+        Returns:
+            str: "duplicate" if the object already exists, "transient" if the call is worth retrying
+                 (timeouts, dropped connections, overloaded server), otherwise "fatal"
+        """
+        message = str(error).lower()
+        if any(text in message for text in BluecatUtils.DUPLICATE_FAULTS):
+            return "duplicate"
+        if getattr(error, "status_code", None) in BluecatUtils.TRANSIENT_STATUS or isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+            return "transient"
+        # Errors from the HTTP libraries under zeep are all connection-level
+        if type(error).__module__.split('.')[0] in ("requests", "urllib3", "httpx", "httpcore"):
+            return "transient"
+        if any(text in message for text in BluecatUtils.TRANSIENT_FAULTS):
+            return "transient"
+        return "fatal"
+
+    @staticmethod
+    def checkIfExists(subnet, chain):
+        """Check if a subnet is in a chain."""
+        return any(link['cidr'] == subnet for link in chain)
+
+    @staticmethod        
+    def getEntities(client, _id, _type, page_size=None):
+        """Get all entities of a type under a parent from Bluecat API, as a list."""
+        return list(BluecatUtils.iterEntities(client, _id, _type, page_size))
+
+    @staticmethod
+    def iterEntities(client, _id, _type, page_size=None):
         """
-        Extract the CIDR, start, and end from the properties field.
+        Yield the entities of a type under a parent, one page of getEntities at a time.
+        Only one page is held in memory, and callers that stop iterating early never fetch the later pages.
         
         Args:
-            properties (str): The properties field containing the CIDR, start, and end values.
+            _id (int): The Bluecat ID of the parent object.
+            _type (str): Type of entities to get.
+            page_size (int, optional): Entities per getEntities call. Defaults to the "page_size" config value, or 1000.
         
-        Returns:
-            tuple: A tuple containing the CIDR, start, and end values (if present).
+        Yields:
+            The entities, in the order the API returns them.
         """
-        cidr, start, end = None, None, None
-        if "CIDR" in properties:
-            cidr = BluecatUtils.extractCidr(properties)
-        elif "start" in properties:
-            start, end = BluecatUtils.extractStartEnd(properties)
-        return cidr, start, end
+        page_size = page_size or config.get("page_size", 1000)
+        start = 0
+        while True:
+            page = client.service.getEntities(_id, _type, start, page_size) or []
+            yield from page
+            if len(page) < page_size:
+                return
+            start += page_size
 
-    @staticmethod        
-    def getEntities(client, _id, _type, end=999):
-        """Get entities from Bluecat API."""
-        return client.service.getEntities(_id, _type, 0, end)
+    @staticmethod
+    def hasEntityCount(client, _id, _type, count):
+        """Cheap staleness check: BAM still holds exactly count entities of a type under the parent."""
+        page = client.service.getEntities(_id, _type, max(count - 1, 0), 2) or []
+        return len(page) == min(count, 1)
+
+    @staticmethod
+    def findRange(starts, ranges, ip_int):
+        """Find which of a sorted list of non-overlapping ranges holds an IP, by bisection.
+
+        Args:
+            starts (list): The first address of each range, sorted
+            ranges (list): (first, last, ...) tuples in the same order as starts
+            ip_int (int): The IP address as an integer
+
+        Returns:
+            int: The index of the matching range, or None if no range holds the IP
+        """
+        i = bisect.bisect_right(starts, ip_int) - 1
+        if i >= 0 and ip_int <= ranges[i][1]:
+            return i
+        return None
 
     @staticmethod
-    def isIpInBlock(ip, block=None, start=None, end=None):
-        """Check if an IP is in a specific block (or start/end range)."""
-        if block:
-            ip_obj = ipaddress.ip_address(ip)
-            block_obj = ipaddress.ip_network(block)
-            return ip_obj in block_obj
-        if start:
-            ip_obj = ipaddress.ip_address(ip)
-            start_obj = ipaddress.ip_address(start)
-            end_obj = ipaddress.ip_address(end)
-            return start_obj <= ip_obj <= end_obj
+    def ipToInt(ip):
+        """Convert an IP address (string, ipaddress object or already an integer) to an integer."""
+        if isinstance(ip, int):
+            return ip
+        if isinstance(ip, str):
+            return int(ipaddress.ip_address(ip))
+        return int(ip)
     
+class SnapshotCache:
+    """Optional SQLite copy of the topology, address, zone and host caches, so that later runs start warm.
+
+    Everything is keyed by BAM host and view ID. A cached container is only used while it is younger than
+    the TTL and, if verification is on, while BAM still reports the same number of entities in it (one
+    small getEntities call instead of a full fetch). Writes made by the tool are applied as they happen.
+    """
+    def __init__(self, path, bam_hostname, view_id, ttl=None, verify=True):
+        self.bam_hostname = bam_hostname
+        self.view_id = str(view_id)
+        self.ttl = ttl # Seconds a cached container stays valid, None for no limit
+        self.verify = verify # Check entity counts against BAM before trusting a cached container
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS loaded (
+            bam TEXT, view TEXT, kind TEXT, key TEXT, loaded_at REAL,
+            PRIMARY KEY (bam, view, kind, key))""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS entities (
+            bam TEXT, view TEXT, kind TEXT, key TEXT, item TEXT, id INTEGER, name TEXT, properties TEXT,
+            PRIMARY KEY (bam, view, kind, key, item))""")
+
+    def load(self, kind, key):
+        """Get the cached rows of a container.
+
+        Args:
+            kind (str): "topology", "addresses", "zones" or "hosts"
+            key (str): The container within the kind e.g. "5:IP4Block" or a zone name
+
+        Returns:
+            list: Dicts of item, id, name and properties, or None if the container isn't cached or has expired
+        """
+        with self.lock:
+            loaded = self.connection.execute("SELECT loaded_at FROM loaded WHERE bam=? AND view=? AND kind=? AND key=?",
+                                             (self.bam_hostname, self.view_id, kind, key)).fetchone()
+            if loaded is None or (self.ttl is not None and time.time() - loaded[0] > self.ttl):
+                return None
+            rows = self.connection.execute("SELECT item, id, name, properties FROM entities WHERE bam=? AND view=? AND kind=? AND key=?",
+                                           (self.bam_hostname, self.view_id, kind, key)).fetchall()
+        return [{'item': item, 'id': _id, 'name': name, 'properties': properties} for item, _id, name, properties in rows]
+
+    def isCurrent(self, rows, client, parent_id, _type):
+        """Check cached rows against BAM's entity count, if verification is on."""
+        return not self.verify or BluecatUtils.hasEntityCount(client, parent_id, _type, len(rows))
+
+    async def isCurrentAsync(self, rows, client, parent_id, _type):
+        return not self.verify or await AsyncBluecatUtils.hasEntityCount(client, parent_id, _type, len(rows))
+
+    def store(self, kind, key, rows):
+        """Replace the cached contents of a container.
+
+        Args:
+            kind (str): The kind of container
+            key (str): The container within the kind
+            rows (iterable): (item, id, name, properties) tuples
+        """
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.execute("DELETE FROM entities WHERE bam=? AND view=? AND kind=? AND key=?", (self.bam_hostname, self.view_id, kind, key))
+                self.connection.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                            [(self.bam_hostname, self.view_id, kind, key) + tuple(row) for row in rows])
+                self.connection.execute("INSERT OR REPLACE INTO loaded VALUES (?, ?, ?, ?, ?)", (self.bam_hostname, self.view_id, kind, key, time.time()))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def isLoaded(self, kind, key):
+        """Check whether a container is cached and hasn't expired, without reading its rows."""
+        with self.lock:
+            loaded = self.connection.execute("SELECT loaded_at FROM loaded WHERE bam=? AND view=? AND kind=? AND key=?",
+                                             (self.bam_hostname, self.view_id, kind, key)).fetchone()
+        return loaded is not None and (self.ttl is None or time.time() - loaded[0] <= self.ttl)
+
+    def upsert(self, kind, key, item, _id=None, name=None, properties=None):
+        """Add or replace one row of a container after a write, if that container is cached."""
+        with self.lock:
+            self.connection.execute("""INSERT OR REPLACE INTO entities
+                SELECT bam, view, kind, key, ?, ?, ?, ? FROM loaded WHERE bam=? AND view=? AND kind=? AND key=?""",
+                (item, _id, name, properties, self.bam_hostname, self.view_id, kind, key))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def createClient(bam_hostname):
+    """Build the zeep client for BAM.
+
+    The WSDL is read from the "wsdl_file" config value if set (bound to this BAM's address), otherwise it
+    is downloaded from BAM through zeep's persistent SQLite cache, so only the first run pays for the fetch.
+    """
+    from zeep import Client
+    from zeep.cache import SqliteCache
+    from zeep.transports import Transport
+
+    transport = Transport(cache=SqliteCache(path=config.get("wsdl_cache"), timeout=config.get("wsdl_cache_ttl", 86400)))
+    if config.get("wsdl_file"):
+        client = Client(config["wsdl_file"], transport=transport)
+        return BoundServiceClient(client.create_service(next(iter(client.wsdl.bindings)), f"http://{bam_hostname}/Services/API"))
+    return Client(f"http://{bam_hostname}/Services/API?wsdl", transport=transport)
+
+class BoundServiceClient:
+    """Client-like holder for a service bound to an explicit address, as used with a local WSDL file."""
+    def __init__(self, service):
+        self.service = service
+
+class LazySession:
+    """Defers building the zeep client (loading the WSDL) and logging in until the first API call."""
+    def __init__(self, username, password, bam_hostname, client=None):
+        self.username = username
+        self.password = password
+        self.bam_hostname = bam_hostname
+        self.client = client
+        self.session_id = None
+        self.lock = threading.Lock()
+        self.service = LazyService(self)
+
+    def connect(self):
+        """Create the client and log in, if that hasn't happened yet, and return the real service."""
+        with self.lock:
+            if self.client is None:
+                self.client = createClient(self.bam_hostname)
+            if self.session_id is None:
+                self.session_id = self.client.service.login(self.username, self.password)
+        return self.client.service
+
+class LazyService:
+    def __init__(self, session):
+        self.session = session
+
+    def __getattr__(self, name):
+        return getattr(self.session.connect(), name)
+
 class BluecatManager:
-    def __init__(self, username, password, bam_hostname):
-        self.client = Client(f"http://{bam_hostname}/Services/API?wsdl")
-        self.session_id = self.client.service.login(username, password)
-        self.dns_dict = {}
+    def __init__(self, username, password, bam_hostname, client=None):
+        self.session = LazySession(username, password, bam_hostname, client)
+        self.instrumentation = Instrumentation(config.get("metrics_file"), config.get("metrics_interval", 60))
+        limiter = AdaptiveLimiter(TokenBucket(config.get("requests_per_second")), config.get("max_concurrent_requests", 10), config.get("adaptive_limits", True),
+                                  config.get("latency_target", 2.0), config.get("max_requests_per_second"))
+        self.client = RetryingClient(InstrumentedClient(self.session, self.instrumentation), limiter,
+                                     config.get("retries", 3), config.get("retry_backoff", 0.5), config.get("retry_max_backoff", 30))
+        self.dns_dict = {} # host area -> {relative hostname (uppercase) -> host record, or None if BAM has no such host}
+        self.dns_lock = threading.RLock()
+        self.dns_loader = Loader() # One fetch per zone dictionary, whichever thread asks first
         self.full_updates = [] # Which domains have had a full dictionary built
-        self.top_level_view_id = config["top_level_view_id"]
-        self.view_id = config["view_id"]
+        self.top_level_view_id = config.get("top_level_view_id")
+        self.view_id = config.get("view_id")
         self.block_properties = f"allowDuplicateHost=disable|inheritAllowDuplicateHost=true|pingBeforeAssign=disable|inheritPingBeforeAssign=true|inheritDefaultDomains=true|defaultView={self.top_level_view_id}|inheritDefaultView=true|inheritDNSRestrictions=true|"
 
         self.block = Block(self)
         self.network = Network(self)
         self.host = Host(self)
         self.utils = BluecatUtils()
+        self.topology = TopologyIndex(self)
+        self.addresses = AddressIndex(self)
+        self.free_addresses = FreeAddressMap()
+        self.zones = ZoneCache(self, config.get("zone_cache_ttl"))
+        self.snapshot = openSnapshot(bam_hostname, self.view_id)
+
+    @property
+    def session_id(self):
+        return self.session.session_id
+
+    def resetCaches(self):
+        """Forget the containers, addresses and host records read from BAM, keeping the reserved addresses."""
+        with self.dns_lock:
+            self.dns_dict = {}
+            self.full_updates = []
+        self.topology = TopologyIndex(self)
+        self.addresses = AddressIndex(self)
+        reserved = self.free_addresses.reserved
+        self.free_addresses = FreeAddressMap()
+        self.free_addresses.reserve(reserved)
 
     def logout(self):
-        self.client.service.logout()
+        if self.session.session_id is not None:
+            self.client.service.logout()
+        self.instrumentation.report()
+        if self.snapshot:
+            self.snapshot.close()
+
+def openSnapshot(bam_hostname, view_id):
+    """Open the SQLite snapshot cache if snapshot_file is configured, otherwise return None."""
+    if not config.get("snapshot_file"):
+        return None
+    return SnapshotCache(config["snapshot_file"], bam_hostname, view_id, config.get("snapshot_ttl"), config.get("snapshot_verify", True))
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by every thread making API calls."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate # Requests per second, None or 0 for no limit
+        self.capacity = capacity or max(1, rate or 1) # Allow up to a second's worth of requests in a burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def setRate(self, rate):
+        """Change the rate, keeping the burst to a second's worth of requests."""
+        with self.lock:
+            self.rate = rate
+            self.capacity = max(1, rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+class AdaptiveLimiter:
+    """Limits the request rate and the number of requests in flight, and adjusts both to how BAM is coping (AIMD).
+
+    Each call that comes back within latency_target adds a little to both limits, about one request per second
+    and one request in flight per round of calls, up to their ceilings. A transient fault or a slower call
+    halves them, at most once per cooldown, so a burst of slow calls only counts once. The configured rate
+    and concurrency are the ceilings unless max_rate is set higher.
+    """
+    def __init__(self, bucket, concurrency, adaptive=True, latency_target=None, max_rate=None, min_rate=1, cooldown=1.0):
+        self.bucket = bucket
+        self.concurrency = self.max_concurrency = max(1, concurrency)
+        self.adaptive = adaptive
+        self.latency_target = latency_target # Seconds, None to only back off on faults
+        self.max_rate = max_rate or bucket.rate
+        self.min_rate = min_rate
+        self.cooldown = cooldown
+        self.decreased_at = 0
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        with self.condition:
+            while self.in_flight >= int(self.concurrency):
+                self.condition.wait()
+            self.in_flight += 1
+        self.bucket.acquire()
+
+    def release(self, elapsed, transient=False):
+        """Record how a request went and free its slot."""
+        with self.condition:
+            self.in_flight -= 1
+            self.adjust(elapsed, transient)
+            self.condition.notify_all()
+
+    def adjust(self, elapsed, transient):
+        """Additive increase after a good call, multiplicative decrease after a transient fault or a slow call."""
+        if not self.adaptive:
+            return
+        rate = self.bucket.rate
+        if transient or (self.latency_target and elapsed > self.latency_target):
+            now = time.monotonic()
+            if now - self.decreased_at < self.cooldown:
+                return
+            self.decreased_at = now
+            self.concurrency = max(1, self.concurrency / 2)
+            if rate:
+                self.bucket.setRate(max(self.min_rate, rate / 2))
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            if rate:
+                self.bucket.setRate(min(self.max_rate, rate + 1 / rate))
+
+class RetryingClient:
+    """Wraps a zeep client in the request layer: every client.service call goes through the limiter, and
+    transient faults are retried with jittered exponential backoff. Duplicate and fatal faults are raised at once."""
+    def __init__(self, client, limiter, retries=3, backoff=0.5, max_backoff=30):
+        self.client = client
+        self.limiter = limiter
+        self.service = RetryingService(client.service, limiter, retries, backoff, max_backoff)
+
+class RetryingService:
+    def __init__(self, service, limiter, retries, backoff, max_backoff):
+        self.service = service
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def backoffDelay(self, attempt):
+        """Full jitter: a random wait up to the exponential backoff for the attempt, so retries don't arrive together."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def __getattr__(self, name):
+        operation = getattr(self.service, name)
+
+        def call(*args, **kwargs):
+            for attempt in itertools.count():
+                self.limiter.acquire()
+                start = time.perf_counter()
+                kind = None
+                try:
+                    return operation(*args, **kwargs)
+                except Exception as e:
+                    kind = BluecatUtils.faultKind(e)
+                    if kind != "transient" or attempt >= self.retries:
+                        raise
+                finally:
+                    self.limiter.release(time.perf_counter() - start, kind == "transient")
+                print(f"Retrying {name} after a transient fault.")
+                time.sleep(self.backoffDelay(attempt))
+        return call
+
+class LatencyHistogram:
+    """Fixed log-scale latency buckets (0.1ms up to ~4 minutes), so percentiles can be given without keeping every sample."""
+    bounds = [0.0001 * 1.2 ** i for i in range(80)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed, error=False):
+        self.counts[bisect.bisect_left(self.bounds, elapsed)] += 1
+        self.count += 1
+        self.errors += error
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples."""
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            'p50_ms': round(self.percentile(0.5) * 1000, 2),
+            'p90_ms': round(self.percentile(0.9) * 1000, 2),
+            'p99_ms': round(self.percentile(0.99) * 1000, 2),
+            'max_ms': round(self.max * 1000, 2),
+        }
+
+current_row_type = contextvars.ContextVar("current_row_type", default=None)
+
+class Instrumentation:
+    """Records call count, error count and latency for every SOAP operation, CSV row type and processing phase.
+
+    The summary is printed at logout. If a metrics file is given, a JSON line snapshot is also appended to it
+    every interval seconds while the import runs.
+    """
+    def __init__(self, metrics_file=None, interval=60):
+        self.histograms = {} # (category, name) -> LatencyHistogram, categories are "soap", "row" and "phase"
+        self.lock = threading.Lock()
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+        self.stream = None
+        if metrics_file:
+            self.stream = threading.Thread(target=self.streamMetrics, daemon=True)
+            self.stream.start()
+
+    def record(self, category, name, elapsed, error=False):
+        with self.lock:
+            if (category, name) not in self.histograms:
+                self.histograms[(category, name)] = LatencyHistogram()
+            self.histograms[(category, name)].record(elapsed, error)
+
+    def recordCall(self, operation, elapsed, error=False):
+        """Record a SOAP call, against the operation and against the type of row that made it."""
+        self.record("soap", operation, elapsed, error)
+        row_type = current_row_type.get()
+        if row_type:
+            self.record("soap", f"{row_type}.{operation}", elapsed, error)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a processing phase (validation, dig, exists, lookup, write), per row type."""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            row_type = current_row_type.get()
+            self.record("phase", f"{row_type}.{name}" if row_type else name, time.perf_counter() - start, error)
+
+    @contextlib.contextmanager
+    def row(self, row_type):
+        """Time a CSV row, and attribute the SOAP calls and phases inside it to its type."""
+        token = current_row_type.set(row_type)
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record("row", row_type, time.perf_counter() - start, error)
+            current_row_type.reset(token)
+
+    def summary(self):
+        with self.lock:
+            return {f"{category}:{name}": histogram.summary() for (category, name), histogram in sorted(self.histograms.items())}
+
+    def streamMetrics(self):
+        while not self.stopped.wait(self.interval):
+            self.writeMetrics()
+
+    def writeMetrics(self):
+        with open(self.metrics_file, "a") as metrics_file:
+            metrics_file.write(json.dumps({'time': time.time(), 'elapsed': round(time.monotonic() - self.started, 3), 'metrics': self.summary()}) + "\n")
+
+    def report(self):
+        """Print the summary table, and write a final snapshot to the metrics file."""
+        self.stopped.set()
+        if self.metrics_file:
+            self.writeMetrics()
+        print(f"{'metric':<40}{'count':>8}{'errors':>8}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, stats in self.summary().items():
+            print(f"{name:<40}{stats['count']:>8}{stats['errors']:>8}{stats['mean_ms']:>10}{stats['p50_ms']:>10}{stats['p90_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+
+class InstrumentedClient:
+    """Wraps a zeep client so every client.service call is timed into the instrumentation."""
+    def __init__(self, client, instrumentation):
+        self.client = client
+        self.service = InstrumentedService(client.service, instrumentation)
+
+class InstrumentedService:
+    def __init__(self, service, instrumentation):
+        self.service = service
+        self.instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        operation = getattr(self.service, name)
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            error = False
+            try:
+                return operation(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.instrumentation.recordCall(name, time.perf_counter() - start, error)
+        return call
+
+class Checkpoint:
+    """File of hashes of the rows that have been fully processed, one per line, so a restarted import can skip them.
+
+    Lines are appended and flushed as each row finishes, so the file is still valid if the run is killed part way.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.completed = set()
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r") as checkpoint_file:
+                self.completed.update(line.strip() for line in checkpoint_file if line.strip())
+        self.file = open(path, "a")
 
+    @staticmethod
+    def rowHash(entry):
+        return hashlib.sha1(json.dumps(entry).encode()).hexdigest()
+
+    def isDone(self, entry):
+        return self.rowHash(entry) in self.completed
+
+    def markDone(self, entry):
+        row_hash = self.rowHash(entry)
+        with self.lock:
+            if row_hash not in self.completed:
+                self.completed.add(row_hash)
+                self.file.write(row_hash + "\n")
+                self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class RejectFile:
+    """CSV of the rows that failed, written as they fail, with the error appended as an extra column."""
+    def __init__(self, path):
+        self.file = open(path, "w", newline='')
+        self.writer = csv.writer(self.file)
+        self.lock = threading.Lock()
+
+    def reject(self, entry, error):
+        with self.lock:
+            self.writer.writerow(list(entry) + [error])
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class RejectList:
+    """Rejected rows kept in memory, for a shard worker process to hand back to the parent."""
+    def __init__(self):
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def reject(self, entry, error):
+        with self.lock:
+            self.rows.append((list(entry), error))
+
+class CsvValidator:
+    """Offline checks for CSV rows that are bound to fail, run before logging in.
+
+    Every CIDR and address is parsed into an integer range once, then the ranges are sorted and swept in a single
+    pass with a stack of the containers still open, so the checks are O(n log n) however big the file is.
+    Errors, which leave the row out of the import:
+
+    - A CIDR or address that doesn't parse
+    - A Network or Block row inside a different Network row (reported against whichever row comes later)
+    - A Network whose gateway is outside it
+    - A Host on its Network row's gateway, network or broadcast address
+    - An address already given to a different hostname by an earlier row
+
+    Warnings, as the container may already be in BAM: a Network outside every Block row and a Host outside
+    every Network row.
+
+    The addresses the file assigns explicitly are collected on the way, so the import can keep them from being
+    handed out as free addresses without reading the file again.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.errors = {} # row number -> error
+        self.warnings = [] # (row number, warning)
+        self.explicit = set() # Integer Host row addresses and gateways
+
+    def error(self, number, message):
+        self.errors.setdefault(number, message)
+
+    def validate(self, rows):
+        """Check every row.
 
-file_path = ''
-username = ''
-password = os.environ.get("BLUECAT_API_PASSWORD")
-server_ip = ''
-bluecat_manager = BluecatManager(username, password, server_ip)
+        Args:
+            rows (iterable): The CSV rows
 
-with open(file_path, mode='r', newline='') as csvfile:
-    csv_reader = csv.reader(csvfile)
-    data = [row for row in csv_reader]
+        Returns:
+            CsvValidator: self, for chaining
+        """
+        items = [] # (first, -last, 0 for a container or 1 for a host, row number, type, text)
+        gateways = {} # Network row number -> gateway as an integer
+        hostnames = {} # Host row number -> uppercase hostname
+        for number, entry in enumerate(rows, 1):
+            self.rows += 1
+            if len(entry) < 3 or entry[0] not in ("Block", "Network", "Host"):
+                continue
+            if entry[0] == "Host" and Host.requestedNetwork(entry) is not None:
+                continue # Given the next free address when it is imported
+            try:
+                if entry[0] == "Host":
+                    first = last = int(ipaddress.ip_address(entry[2]))
+                else:
+                    network = ipaddress.ip_network(entry[2], strict=False)
+                    first, last = int(network.network_address), int(network.broadcast_address)
+            except ValueError:
+                self.error(number, f"Invalid {'address' if entry[0] == 'Host' else 'CIDR'} ({entry[2]}).")
+                continue
+            items.append((first, -last, 1 if entry[0] == "Host" else 0, number, entry[0], entry[2]))
+            if entry[0] == "Host":
+                hostnames[number] = entry[1].upper()
+                self.explicit.add(first)
+            elif entry[0] == "Network" and len(entry) == 4 and entry[3]: # The importer only sets a gateway from 4-column rows
+                try:
+                    gateways[number] = int(ipaddress.ip_address(entry[3]))
+                except ValueError:
+                    self.error(number, f"Invalid gateway ({entry[3]}).")
+                    continue
+                self.explicit.add(gateways[number])
+                if not first <= gateways[number] <= last:
+                    self.error(number, f"Gateway {entry[3]} is outside Network {entry[2]}.")
+
+        # Containers first, then the hosts against only the containers that will be imported
+        containers = sorted(item for item in items if item[4] != "Host")
+        self.sweep(containers, gateways, hostnames, True)
+        self.sweep(sorted([item for item in containers if item[3] not in self.errors] + [item for item in items if item[4] == "Host"]),
+                   gateways, hostnames, False)
+        return self
+
+    def sweep(self, items, gateways, hostnames, check_containers):
+        """Walk sorted ranges with a stack of the containers that are still open, checking each row against the
+        closest Network row and any Block row holding it."""
+        stack = [] # (last, closest Network row as (first, last, number, cidr) or None, inside a Block row)
+        owners = {} # address -> (row number, hostname) of the first row to use it
+        for first, negative_last, _, number, _type, text in items:
+            last = -negative_last
+            while stack and stack[-1][0] < first:
+                stack.pop()
+            network, in_block = stack[-1][1:] if stack else (None, False)
+
+            if _type == "Host":
+                self.checkHost(number, first, text, network, gateways, hostnames, owners)
+                continue
+            if check_containers and network is not None and (network[0], network[1]) != (first, last):
+                if number > network[2]:
+                    self.error(number, f"{_type} {text} is inside Network {network[3]} (line {network[2]}).")
+                else:
+                    self.error(network[2], f"Network {network[3]} overlaps {_type} {text} (line {number}).")
+            if _type == "Network":
+                if check_containers and not in_block:
+                    self.warnings.append((number, f"Network {text} isn't inside any Block row, so its block must already be in BAM."))
+                # A repeated Network row is imported as already existing, so the first row's gateway is the one that counts
+                if network is None or (network[0], network[1]) != (first, last):
+                    network = (first, last, number, text)
+            stack.append((last, network, in_block or _type == "Block"))
+
+    def checkHost(self, number, address, text, network, gateways, hostnames, owners):
+        """Check a Host row's address against the Network row holding it and the rows that came before it."""
+        if network is None:
+            self.warnings.append((number, f"Address {text} isn't inside any Network row, so its network must already be in BAM."))
+        else:
+            first, last, network_number, cidr = network
+            if address == gateways.get(network_number):
+                self.error(number, f"Address {text} is the gateway of Network {cidr} (line {network_number}).")
+            elif last - first > 1 and address in (first, last):
+                self.error(number, f"Address {text} is the {'network' if address == first else 'broadcast'} address of Network {cidr} (line {network_number}).")
+        # Rows with the same address arrive in CSV order, so the owner is always the earlier row
+        owner = owners.setdefault(address, (number, hostnames[number]))
+        if owner[1] != hostnames[number]:
+            self.error(number, f"Address {text} is already given to a different host on line {owner[0]}.")
+
+    def filter(self, rows, rejects=None):
+        """Yield the rows that passed, in order, writing the rest to the reject file."""
+        for number, entry in enumerate(rows, 1):
+            if number not in self.errors:
+                yield entry
+            elif rejects:
+                rejects.reject(entry, self.errors[number])
+
+    def printReport(self):
+        """Print the errors and warnings by CSV line."""
+        print(f"Validated {self.rows} rows: {len(self.errors)} errors, {len(self.warnings)} warnings.")
+        for number, message in sorted(self.errors.items()):
+            print(f"! line {number}: {message}")
+        for number, message in sorted(self.warnings):
+            print(f"? line {number}: {message}")
+
+class ImportEngine:
+    """Runs CSV rows concurrently on a worker pool, holding a row back only until the rows it depends on have finished.
+
+    A Block or Network row waits for earlier Block/Network rows that it overlaps. The Host rows of a batch are
+    held back until the batch's Block and Network rows are done, then grouped by hostname so that each host gets
+    a single create or update with all of its addresses and comment actions merged in CSV order. A hostname waits
+    for an earlier one that uses one of the same addresses. Everything else runs in parallel.
+
+    Rows are read from any iterable batch_size at a time, so a CSV can be streamed without loading it all. Each
+    batch finishes before the next starts, which keeps the dependency rules intact across batches. With a
+    checkpoint, finished rows are recorded and skipped on a rerun without any API calls, and with a reject file,
+    failed rows are written out with their error.
+
+    The addresses that rows assign explicitly are kept from free-address allocation before the first batch runs.
+    They are found from the rows themselves when they are a list; a streamed file needs them passed in as
+    reserved, e.g. from a CsvValidator pass, or only the rest of the batch is checked.
+    """
+    def __init__(self, bluecat_manager, workers=4, batch_size=1000, checkpoint=None, rejects=None, reserved=None):
+        self.bluecat_manager = bluecat_manager
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.checkpoint = checkpoint
+        self.rejects = rejects
+        self.reserved = reserved # Integer addresses assigned explicitly anywhere in the import, or None if unknown
+        self.report = {"rows": 0, "completed": 0, "skipped": 0, "rejected": 0}
+        self.report_lock = threading.Lock()
+        self.entry_type_mapping = {
+            "Block": bluecat_manager.block.ProcessEntry,
+            "Network": bluecat_manager.network.ProcessEntry,
+        }
+
+    def processRow(self, entry):
+        """Process a single CSV row. Errors are reported rather than raised so that the rest of the import carries on.
 
-entry_type_mapping = {
-    "Block": bluecat_manager.block.ProcessEntry,
-    "Network": bluecat_manager.network.ProcessEntry,
-    "Host": bluecat_manager.host.ProcessEntry,
-}
+        Returns:
+            str: The error if the row failed, otherwise None
+        """
+        process_entry_func = self.entry_type_mapping.get(entry[0]) if entry else None
+        if not process_entry_func:
+            print(f"Unknown entry type: {entry[0] if entry else ''}")
+            return f"Unknown entry type: {entry[0] if entry else ''}"
+        try:
+            with self.bluecat_manager.instrumentation.row(entry[0]):
+                process_entry_func(entry)
+        except Exception as e:
+            print(f"Failed to process {','.join(entry)}: {e}")
+            return str(e) or type(e).__name__
+
+    def recordResult(self, entry, error):
+        """Count a finished row, then checkpoint it or write it to the reject file."""
+        with self.report_lock:
+            self.report["rejected" if error else "completed"] += 1
+        if error:
+            if self.rejects:
+                self.rejects.reject(entry, error)
+        elif self.checkpoint:
+            self.checkpoint.markDone(entry)
 
-for entry in data:
-    process_entry_func = entry_type_mapping.get(entry[0])
-    if process_entry_func:
-        process_entry_func(entry)
-    else:
-        print(f"Unknown entry type: {entry[0]}")
-    time.sleep(1) # Adding just to avoid hitting server too hard - probably fine but I'm in no rush
+    @staticmethod
+    def skipHeader(rows):
+        """Yield the rows, leaving out a leading header row like the one in test.csv or written by BamExporter."""
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is not None and first[:1] != BamExporter.HEADER[:1]:
+            yield first
+        yield from rows
+
+    def reserveExplicit(self, rows):
+        """Reserve the addresses assigned explicitly anywhere in the import, if they are known up front.
+
+        Returns:
+            bool: False if they aren't, so each batch has to reserve its own
+        """
+        reserved = self.reserved
+        if reserved is None and isinstance(rows, list):
+            reserved = FreeAddressMap.explicitAddresses(rows)
+        if reserved is None:
+            return False
+        self.bluecat_manager.free_addresses.reserve(reserved)
+        return True
+
+    def batches(self, rows):
+        """Yield lists of up to batch_size rows, leaving out a header row and rows the checkpoint says are already done."""
+        rows = self.skipHeader(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.batch_size))
+            if not chunk:
+                return
+            batch = [entry for entry in chunk if not (self.checkpoint and self.checkpoint.isDone(entry))]
+            self.report["rows"] += len(chunk)
+            self.report["skipped"] += len(chunk) - len(batch)
+            if batch:
+                yield batch
+
+    @staticmethod
+    def containingRows(containers, value, max_prefix):
+        """Yield the latest earlier Block/Network row for every CIDR (up to max_prefix long) that contains value."""
+        for prefix in range(max_prefix + 1):
+            mask = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+            row = containers.get((prefix, value & mask))
+            if row is not None:
+                yield row
+
+    def buildDependencies(self, data):
+        """Work out which earlier rows each Block and Network row has to wait for.
+
+        Args:
+            data (list): The Block and Network rows of a batch
+
+        Returns:
+            list: A set of row indexes per row
+        """
+        dependencies = [set() for _ in data]
+        containers = {} # (prefix length, network address) -> latest Block/Network row with that CIDR
+        container_starts = [] # (first, last, row) for every Block/Network row, sorted
+
+        for i, entry in enumerate(data):
+            if len(entry) < 3:
+                continue
+            try:
+                if entry[0] in ("Block", "Network"):
+                    network = ipaddress.ip_network(entry[2], strict=False)
+                    first, last = int(network.network_address), int(network.broadcast_address)
+                    dependencies[i].update(self.containingRows(containers, first, network.prefixlen))
+                    # Earlier rows inside this one, as adding a block moves them underneath it
+                    lo = bisect.bisect_left(container_starts, (first, -1, -1))
+                    hi = bisect.bisect_right(container_starts, (last, float('inf'), float('inf')))
+                    dependencies[i].update(row for _, _, row in container_starts[lo:hi])
+                    containers[(network.prefixlen, first)] = i
+                    bisect.insort(container_starts, (first, last, i))
+            except ValueError:
+                pass # Not a valid CIDR/address, the row will report its own error when processed
+
+        return dependencies
+
+    def run(self, rows):
+        """Process all rows, returning once every row has finished.
+
+        Args:
+            rows (iterable): The CSV rows, e.g. a csv.reader
+
+        Returns:
+            dict: Counts of the rows read, completed, skipped (already in the checkpoint) and rejected
+        """
+        # Keep rows that ask for a free address from taking one that a later row assigns explicitly
+        reserved = self.reserveExplicit(rows)
+        for batch in self.batches(rows):
+            containers, groups = self.splitHosts(batch)
+            if not reserved:
+                self.bluecat_manager.free_addresses.reserve(FreeAddressMap.explicitAddresses(batch))
+            if containers:
+                self.runBatch(containers)
+            if groups:
+                self.runHosts(groups)
+        return self.report
+
+    @staticmethod
+    def zonesToPrefetch(groups):
+        """Pick the zones with at least prefetch_zone_hosts hostnames in a batch, where downloading the whole
+        zone once beats looking hosts up one at a time. Off unless prefetch_zone_hosts is set."""
+        threshold = config.get("prefetch_zone_hosts")
+        if not threshold:
+            return []
+        counts = defaultdict(int)
+        for entries in groups:
+            elements = entries[0][1].split('.') if len(entries[0]) > 1 else []
+            if len(elements) > 2:
+                counts[elements[-2].upper()] += 1
+        return [host_area for host_area, count in counts.items() if count >= threshold]
+
+    @staticmethod
+    def splitHosts(batch):
+        """Split a batch into its other rows and its Host rows grouped by hostname.
+
+        Returns:
+            tuple: (rows that aren't Host rows, lists of Host rows per hostname in CSV order)
+        """
+        rest, hosts = [], {}
+        for entry in batch:
+            if entry and entry[0] == "Host":
+                hosts.setdefault(entry[1].upper() if len(entry) > 1 else "", []).append(entry)
+            else:
+                rest.append(entry)
+        return rest, list(hosts.values())
+
+    @staticmethod
+    def groupDependencies(groups):
+        """Make a hostname's rows wait for an earlier hostname that uses one of the same addresses."""
+        dependencies = [set() for _ in groups]
+        owners = {} # address -> latest group using it
+        for i, entries in enumerate(groups):
+            for entry in entries:
+                try:
+                    address = BluecatUtils.ipToInt(entry[2])
+                except (ValueError, IndexError):
+                    continue # A CIDR, blank or missing address, the row will report its own error when processed
+                if owners.get(address, i) != i:
+                    dependencies[i].add(owners[address])
+                owners[address] = i
+        return dependencies
+
+    def processHostRows(self, entries):
+        """Process all the rows for one hostname as a single write.
+
+        Returns:
+            list: The error for each row, or None for rows that went through
+        """
+        try:
+            with self.bluecat_manager.instrumentation.row("Host"):
+                errors = self.bluecat_manager.host.ProcessEntries(entries)
+        except Exception as e:
+            errors = [str(e) or type(e).__name__] * len(entries)
+        for entry, error in zip(entries, errors):
+            if error:
+                print(f"Failed to process {','.join(entry)}: {error}")
+        return errors
+
+    def recordHostResults(self, entries, errors):
+        for entry, error in zip(entries, errors):
+            self.recordResult(entry, error)
+
+    def runHosts(self, groups):
+        """Process a batch's Host rows, one write per hostname, respecting the addresses they share."""
+        for host_area in self.zonesToPrefetch(groups):
+            self.bluecat_manager.host.prefetchZone(host_area)
+        self.runScheduled(groups, self.groupDependencies(groups), self.processHostRows, self.recordHostResults)
+
+    def runBatch(self, data):
+        """Process a list of rows concurrently, respecting the dependencies between them."""
+        self.runScheduled(data, self.buildDependencies(data), self.processRow, self.recordResult)
+
+    def runScheduled(self, items, dependencies, process, record):
+        """Run process on every item on the worker pool, starting each one once the items it depends on are done.
+
+        Args:
+            items (list): The work items, e.g. rows
+            dependencies (list): A set of item indexes per item
+            process (function): Called with an item, returning its result
+            record (function): Called with an item and its result once it is done
+        """
+        dependents = defaultdict(list)
+        waiting = []
+        for i, row_dependencies in enumerate(dependencies):
+            waiting.append(len(row_dependencies))
+            for dependency in row_dependencies:
+                dependents[dependency].append(i)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Completions are handled on this thread, so an error from process or record reaches the caller
+            running = {pool.submit(process, items[i]): i for i, count in enumerate(waiting) if count == 0}
+            while running:
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    record(items[i], future.result())
+                    for j in dependents.pop(i, []):
+                        waiting[j] -= 1
+                        if waiting[j] == 0:
+                            running[pool.submit(process, items[j])] = j
+
+class ImportPlanner:
+    """Works out the writes a CSV needs against BAM's current state before making any of them.
+
+    Rows are checked in CSV order against the topology, address and DNS caches, so each container, network and
+    zone is read from BAM once however many rows touch it, and against the changes planned by earlier rows.
+    The result is the blocks and networks to add and the host records to create or update, each host with its
+    final addresses and comments however many rows it appears in. Rows that change nothing are only counted.
+    """
+    def __init__(self, bluecat_manager, workers=4):
+        self.bluecat_manager = bluecat_manager
+        self.workers = max(1, workers)
+        self.blocks = [] # {'name', 'cidr'} in CSV order
+        self.networks = [] # {'name', 'cidr', 'gateway'} in CSV order
+        self.hosts = {} # uppercase hostname -> {'hostname', 'id', 'addresses', 'comments'}, id None for a new host
+        self.host_changes = {} # uppercase hostname -> (hostname, existing record, [(ip, comments, comments_action), ...])
+        self.errors = [] # (row, error)
+        self.unchanged = 0
+        self.planned_cidrs = set()
+        self.planned_networks = [] # (first, last) of the networks to add, sorted
+        self.planned_starts = [] # First address of each of planned_networks, for BluecatUtils.findRange
+        self.planned_ranges = set() # planned_networks again, for exact matches
+        self.planned_addresses = set() # Integer addresses the plan assigns
+
+    def plan(self, rows):
+        """Plan every row.
+
+        Args:
+            rows (iterable): The CSV rows
+
+        Returns:
+            ImportPlanner: self, for chaining
+        """
+        planners = {"Block": self.planBlock, "Network": self.planNetwork, "Host": self.planHost}
+        rows = list(ImportEngine.skipHeader(rows))
+        self.bluecat_manager.free_addresses.reserve(FreeAddressMap.explicitAddresses(rows))
+        # Download whole zones with enough hostnames in the CSV up front, as ImportEngine does
+        _, groups = ImportEngine.splitHosts(rows)
+        for host_area in ImportEngine.zonesToPrefetch(groups):
+            self.bluecat_manager.host.prefetchZone(host_area)
+        for entry in rows:
+            plan_entry_func = planners.get(entry[0]) if entry else None
+            if not plan_entry_func:
+                self.errors.append((entry, f"Unknown entry type: {entry[0] if entry else ''}"))
+                continue
+            try:
+                plan_entry_func(entry)
+            except Exception as e:
+                self.errors.append((entry, str(e) or type(e).__name__))
+
+        for key, (hostname, existing, changes) in self.host_changes.items():
+            addresses, comments = self.bluecat_manager.host.mergeChanges(existing, changes)
+            self.hosts[key] = {'hostname': hostname, 'id': existing['id'] if existing else None, 'addresses': addresses, 'comments': comments}
+        return self
+
+    def planBlock(self, entry):
+        network = ipaddress.ip_network(entry[2], strict=False)
+        chain = self.bluecat_manager.topology.chain(network.network_address, "IP4Block")
+        if self.bluecat_manager.utils.checkIfExists(entry[2], chain) or ("Block", entry[2]) in self.planned_cidrs:
+            self.unchanged += 1
+            return
+        self.planned_cidrs.add(("Block", entry[2]))
+        self.blocks.append({'name': entry[1], 'cidr': entry[2]})
+
+    def planNetwork(self, entry):
+        network = ipaddress.ip_network(entry[2], strict=False)
+        block_chain = self.bluecat_manager.topology.chain(network.network_address, "IP4Block")
+        network_chain = self.bluecat_manager.topology.chain(network.network_address, "IP4Network", block_chain[-1]['id']) if block_chain else []
+        if self.bluecat_manager.utils.checkIfExists(entry[2], network_chain) or ("Network", entry[2]) in self.planned_cidrs:
+            self.unchanged += 1
+            return
+        self.planned_cidrs.add(("Network", entry[2]))
+        first, last = int(network.network_address), int(network.broadcast_address)
+        i = bisect.bisect_left(self.planned_starts, first)
+        self.planned_starts.insert(i, first)
+        self.planned_networks.insert(i, (first, last))
+        self.planned_ranges.add((first, last))
+        self.networks.append({'name': entry[1], 'cidr': entry[2], 'gateway': entry[3] if len(entry) == 4 else ''})
+
+    def planHost(self, entry):
+        host = self.bluecat_manager.host
+        valid = host.checkIfValidHostname(entry[1])
+        if not valid[0]:
+            raise ValueError(valid[1])
+
+        address, cidr = entry[2], host.requestedNetwork(entry)
+        if cidr is not None:
+            address = self.allocateAddress(entry[1], cidr)
+            if address is None:
+                self.unchanged += 1
+                return
+        ip_int = BluecatUtils.ipToInt(address)
+        net_id = host.networkId(ip_int)
+        if net_id is None and BluecatUtils.findRange(self.planned_starts, self.planned_networks, ip_int) is None:
+            raise ValueError(f"Address ({address}) is not in a network.")
+        if ip_int in self.planned_addresses or (net_id is not None and self.bluecat_manager.addresses.contains(net_id, ip_int)):
+            self.unchanged += 1
+            return
+        self.planned_addresses.add(ip_int)
+
+        if entry[1].upper() not in self.host_changes:
+            self.host_changes[entry[1].upper()] = (entry[1], host.findExistingHost(entry[1]), [])
+        self.host_changes[entry[1].upper()][2].append((address,) + host.rowComments(entry))
+
+    def allocateAddress(self, hostname, cidr):
+        """Pick the next free address for a host row that names a network, which may be one the plan adds."""
+        host = self.bluecat_manager.host
+        if host.findNetwork(cidr) is not None:
+            return host.allocateAddress(hostname, cidr)
+        network = ipaddress.ip_network(cidr, strict=False)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        if (first, last) not in self.planned_ranges:
+            raise ValueError(f"Network {cidr} doesn't exist.")
+        return host.nextFreeAddress(first, last)
+
+    def summary(self):
+        """Count the planned changes.
 
-bluecat_manager.logout()
+        Returns:
+            dict: Numbers of blocks, networks, hosts to create and update, unchanged rows and rejected rows
+        """
+        creates = sum(1 for host in self.hosts.values() if host['id'] is None)
+        return {"blocks": len(self.blocks), "networks": len(self.networks), "create_hosts": creates,
+                "update_hosts": len(self.hosts) - creates, "unchanged": self.unchanged, "rejected": len(self.errors)}
+
+    def printPlan(self):
+        """Print the planned changes, + for additions and ~ for updates to existing host records."""
+        summary = self.summary()
+        print(f"Plan: {summary['blocks']} blocks and {summary['networks']} networks to add, {summary['create_hosts']} host records to create, "
+              f"{summary['update_hosts']} to update. {summary['unchanged']} rows unchanged, {summary['rejected']} rejected.")
+        for block in self.blocks:
+            print(f"+ block   {block['cidr']} ({block['name']})")
+        for network in self.networks:
+            gateway = f", gateway {network['gateway']}" if network['gateway'] else ""
+            print(f"+ network {network['cidr']} ({network['name']}){gateway}")
+        for planned in self.hosts.values():
+            comments = f", comments {json.dumps(planned['comments'])}" if planned['comments'] is not None else ""
+            print(f"{'+' if planned['id'] is None else '~'} host    {planned['hostname']}: {','.join(planned['addresses'])}{comments}")
+        for entry, error in self.errors:
+            print(f"! {','.join(entry)}: {error}")
+
+    def exportPlan(self, path):
+        """Write the planned changes to a JSON file."""
+        with open(path, "w") as plan_file:
+            json.dump({"summary": self.summary(), "blocks": self.blocks, "networks": self.networks,
+                       "hosts": list(self.hosts.values()), "rejected": [{"row": entry, "error": error} for entry, error in self.errors]}, plan_file, indent=4)
+
+    def apply(self):
+        """Make the planned writes: blocks and networks in CSV order, then the host records on the worker pool.
+
+        Returns:
+            dict: Counts of the writes made and the ones that failed
+        """
+        report = {"blocks": 0, "networks": 0, "create_hosts": 0, "update_hosts": 0, "failed": 0}
+        for kind, changes, process_entry_func in (("blocks", self.blocks, self.bluecat_manager.block.ProcessEntry),
+                                                  ("networks", self.networks, self.bluecat_manager.network.ProcessEntry)):
+            for change in changes:
+                entry = [kind[:-1].capitalize(), change['name'], change['cidr']] + ([change['gateway']] if change.get('gateway') else [])
+                try:
+                    process_entry_func(entry)
+                    report[kind] += 1
+                except Exception as e:
+                    print(f"Failed to add {change['cidr']}: {e}")
+                    report["failed"] += 1
+
+        def writeHost(key, planned):
+            if planned['id'] is None:
+                self.bluecat_manager.host.createHostRecord(planned['hostname'], planned['addresses'], planned['comments'])
+                return "create_hosts"
+            # Merge the rows into the record as it is at write time, in case it has changed since planning
+            self.bluecat_manager.host.writeHostRecord(planned['id'], planned['hostname'], self.host_changes[key][2])
+            return "update_hosts"
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [(planned, pool.submit(writeHost, key, planned)) for key, planned in self.hosts.items()]
+            for planned, future in futures:
+                try:
+                    report[future.result()] += 1
+                except Exception as e:
+                    print(f"Failed to write {planned['hostname']}: {e}")
+                    report["failed"] += 1
+        return report
+
+class BamExporter:
+    """Writes the blocks, networks and host records under a block and a view as a CSV in the importer's format.
+
+    The tree is walked a level at a time. The children of every container on a level, and later the host
+    records of every zone, are paged through concurrently on the worker pool. Each worker writes its rows as
+    its pages arrive, so memory holds about one page per worker and the network ranges, not the whole space.
+    A host gets one row per address inside the exported networks, and only the first row carries the
+    comments with the "add" action, so importing the file back into the same BAM changes nothing.
+    """
+    HEADER = ["Type", "Name", "CIDR/Address", "Default Gateway/Comment", "Comment Action"]
+
+    def __init__(self, bluecat_manager, output, workers=4):
+        self.bluecat_manager = bluecat_manager
+        self.writer = csv.writer(output)
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+        self.report = {"blocks": 0, "networks": 0, "hosts": 0, "skipped": 0}
+        self.networks = [] # (first, last) of every exported network, sorted once the containers are done
+        self.starts = []
+
+    def writeRows(self, kind, rows):
+        with self.lock:
+            self.writer.writerows(rows)
+            self.report[kind] += 1
+
+    def walk(self, root_id, visit):
+        """Call visit on the root, then level by level on the IDs it returns, each level on the worker pool."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            level = [root_id]
+            while level:
+                level = [child_id for children in pool.map(visit, level) for child_id in children]
+
+    def exportContainer(self, parent_id):
+        """Write the blocks and networks directly under a container, returning the IDs of the blocks to walk next."""
+        utils, client = self.bluecat_manager.utils, self.bluecat_manager.client
+        block_ids = []
+        for block in utils.iterEntities(client, parent_id, "IP4Block"):
+            block_ids.append(block['id'])
+            self.exportBlock(block)
+        for network in utils.iterEntities(client, parent_id, "IP4Network"):
+            properties = Properties(network['properties'])
+            if not properties.get('CIDR'):
+                continue
+            # The importer only sets the gateway from a row with exactly four columns
+            gateway = [properties['gateway']] if properties.get('gateway') else ["", ""]
+            self.writeRows("networks", [["Network", network['name'] or "", properties['CIDR']] + gateway])
+            with self.lock:
+                self.networks.append(properties.range())
+        return block_ids
+
+    def exportBlock(self, block):
+        """Write the row for a block."""
+        cidr = Properties(block['properties']).get('CIDR')
+        if cidr:
+            self.writeRows("blocks", [["Block", block['name'] or "", cidr, "", ""]])
+        else:
+            print(f"Block {block['name']} ({block['id']}) is a start/end range, which the CSV can't express, so only its contents are exported.")
+
+    def exportZone(self, zone_id):
+        """Write the host records in a zone, returning the IDs of its subzones to walk next."""
+        utils, client = self.bluecat_manager.utils, self.bluecat_manager.client
+        for host in utils.iterEntities(client, zone_id, "HostRecord"):
+            properties = Properties(host['properties'])
+            addresses = [address for address in properties.get('addresses', '').split(',')
+                         if address and BluecatUtils.findRange(self.starts, self.networks, BluecatUtils.ipToInt(address)) is not None]
+            if not addresses:
+                with self.lock:
+                    self.report["skipped"] += 1
+                continue
+            rows = [["Host", properties.get('absoluteName', host['name']), address, "", ""] for address in addresses]
+            if properties.get('comments'):
+                rows[0][3:] = [properties['comments'], "add"]
+            self.writeRows("hosts", rows)
+        return [zone['id'] for zone in utils.iterEntities(client, zone_id, "Zone")]
+
+    def export(self, root_id, view_id):
+        """Export everything under a block (or the configuration) and the host records under a view or zone.
+
+        Args:
+            root_id (int): The Bluecat ID of the block or configuration to export the blocks and networks of
+            view_id (int): The Bluecat ID of the view or zone to export the host records of
+
+        Returns:
+            dict: Counts of the blocks, networks and hosts written, and of hosts skipped for having no address in the exported networks
+        """
+        self.writer.writerow(self.HEADER)
+        # A block given as the root is exported along with its contents, so the file can recreate it
+        root = self.bluecat_manager.client.service.getEntityById(root_id)
+        if root and root['type'] == "IP4Block":
+            self.exportBlock(root)
+        self.walk(root_id, self.exportContainer)
+        self.networks.sort()
+        self.starts = [network[0] for network in self.networks]
+        self.walk(view_id, self.exportZone)
+        return self.report
+
+class AsyncBluecatUtils(BluecatUtils):
+    @staticmethod
+    async def iterEntities(client, _id, _type, page_size=None):
+        """Async counterpart of BluecatUtils.iterEntities, yielding entities one getEntities page at a time."""
+        page_size = page_size or config.get("page_size", 1000)
+        start = 0
+        while True:
+            page = await client.service.getEntities(_id, _type, start, page_size) or []
+            for entity in page:
+                yield entity
+            if len(page) < page_size:
+                return
+            start += page_size
+
+    @staticmethod
+    async def getEntities(client, _id, _type, page_size=None):
+        """Get all entities of a type under a parent, as a list."""
+        return [entity async for entity in AsyncBluecatUtils.iterEntities(client, _id, _type, page_size)]
+
+    @staticmethod
+    async def hasEntityCount(client, _id, _type, count):
+        page = await client.service.getEntities(_id, _type, max(count - 1, 0), 2) or []
+        return len(page) == min(count, 1)
+
+class AsyncLoader:
+    """Makes sure concurrent coroutines asking for the same uncached data share a single fetch."""
+    def __init__(self):
+        self.loading = {}
+
+    async def once(self, key, fetch):
+        if key not in self.loading:
+            self.loading[key] = asyncio.ensure_future(fetch())
+        try:
+            await self.loading[key]
+        finally:
+            if self.loading.get(key) is not None and self.loading[key].done():
+                del self.loading[key]
+
+class AsyncTopologyIndex(TopologyIndex):
+    def __init__(self, bluecat_manager):
+        super().__init__(bluecat_manager)
+        self.loader = AsyncLoader()
+
+    async def loadChildren(self, parent_id, _type):
+        key = (parent_id, _type)
+        if key not in self.containers:
+            async def fetch():
+                snapshot = self.bluecat_manager.snapshot
+                rows = snapshot.load("topology", f"{parent_id}:{_type}") if snapshot else None
+                if rows is not None and await snapshot.isCurrentAsync(rows, self.bluecat_manager.client, parent_id, _type):
+                    self.storeChildren(parent_id, _type, rows)
+                else:
+                    entities = await self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, parent_id, _type)
+                    self.storeChildren(parent_id, _type, entities)
+                    self.saveSnapshot(parent_id, _type, entities)
+            await self.loader.once(key, fetch)
+        return self.containers[key]
+
+    async def reloadChildren(self, parent_id):
+        for _type in ("IP4Block", "IP4Network"):
+            entities = await self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, parent_id, _type)
+            self.storeChildren(parent_id, _type, entities)
+            self.saveSnapshot(parent_id, _type, entities)
+
+    async def findChild(self, parent_id, _type, ip_int):
+        return self.searchContainer(await self.loadChildren(parent_id, _type), ip_int)
+
+    async def chain(self, ip, _type, begin_from=5):
+        ip_int = BluecatUtils.ipToInt(ip)
+        chain = []
+        parent_id = begin_from
+        while True:
+            entity = await self.findChild(parent_id, _type, ip_int)
+            if entity is None:
+                return chain
+            chain.append(entity)
+            parent_id = entity['id']
+
+class AsyncZoneCache(ZoneCache):
+    def __init__(self, bluecat_manager, ttl=None):
+        super().__init__(bluecat_manager, ttl)
+        self.loader = AsyncLoader()
+
+    async def refresh(self):
+        async def fetch():
+            zones = await self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, self.bluecat_manager.view_id, "Zone")
+            self.storeZones(zones)
+            if self.bluecat_manager.snapshot:
+                self.bluecat_manager.snapshot.store("zones", "zones", [(zone['name'].upper(), zone['id'], zone['name'], None) for zone in zones])
+        await self.loader.once("zones", fetch)
+
+    async def getId(self, name):
+        snapshot = self.bluecat_manager.snapshot
+        if self.zones is None and snapshot:
+            rows = snapshot.load("zones", "zones")
+            if rows is not None and await snapshot.isCurrentAsync(rows, self.bluecat_manager.client, self.bluecat_manager.view_id, "Zone"):
+                self.storeZones(rows)
+        if self.isStale():
+            await self.refresh()
+        return self.zones.get(name.upper())
+
+class AsyncAddressIndex(AddressIndex):
+    def __init__(self, bluecat_manager):
+        super().__init__(bluecat_manager)
+        self.loader = AsyncLoader()
+
+    async def load(self, net_id):
+        if net_id not in self.networks:
+            async def fetch():
+                snapshot = self.bluecat_manager.snapshot
+                rows = snapshot.load("addresses", str(net_id)) if snapshot else None
+                if rows is not None and await snapshot.isCurrentAsync(rows, self.bluecat_manager.client, net_id, "IP4Address"):
+                    self.networks[net_id] = {int(row['item']) for row in rows}
+                else:
+                    self.storeAddresses(net_id, await self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, net_id, "IP4Address"))
+                    self.saveSnapshot(net_id)
+            await self.loader.once(net_id, fetch)
+        return self.networks[net_id]
+
+    async def contains(self, net_id, ip):
+        return BluecatUtils.ipToInt(ip) in await self.load(net_id)
+
+class AsyncBlock(Block):
+    async def ProcessEntry(self, entry):
+        network = ipaddress.ip_network(entry[2], strict=False)
+        with self.bluecat_manager.instrumentation.phase("dig"):
+            chain = await self.bluecat_manager.topology.chain(network.network_address, "IP4Block")
+
+        if self.bluecat_manager.utils.checkIfExists(entry[2], chain):
+            print(f"Block {entry[2]} already exists.")
+        else:
+            properties = f"name={entry[1]}|" + self.bluecat_manager.block_properties
+            try:
+                with self.bluecat_manager.instrumentation.phase("write"):
+                    block_id = await self.bluecat_manager.client.service.addIP4BlockByCIDR(chain[-1]['id'], entry[2], properties)
+            except Exception as e:
+                if BluecatUtils.faultKind(e) != "duplicate":
+                    raise
+                await self.bluecat_manager.topology.reloadChildren(chain[-1]['id'])
+                if not self.bluecat_manager.utils.checkIfExists(entry[2], await self.bluecat_manager.topology.chain(network.network_address, "IP4Block")):
+                    raise
+                print(f"Block {entry[2]} already exists.")
+                return
+            self.bluecat_manager.topology.addChild(chain[-1]['id'], "IP4Block", block_id, entry[1], f"CIDR={entry[2]}|{properties}")
+            print(f"Added {entry[1]} block to {entry[2]}.")
+
+class AsyncNetwork(Network):
+    async def ProcessEntry(self, entry):
+        network = ipaddress.ip_network(entry[2], strict=False)
+        with self.bluecat_manager.instrumentation.phase("dig"):
+            block_chain = await self.bluecat_manager.topology.chain(network.network_address, "IP4Block")
+            network_chain = await self.bluecat_manager.topology.chain(network.network_address, "IP4Network", block_chain[-1]['id'])
+
+        if len(entry) != 4:
+            gateway = ''
+        else:
+            gateway = f'gateway={entry[3]}|'
+
+        if self.bluecat_manager.utils.checkIfExists(entry[2], network_chain):
+            print(f"Network {entry[2]} already exists.")
+        else:
+            properties = f'name={entry[1]}|{gateway}' + self.bluecat_manager.block_properties
+            try:
+                with self.bluecat_manager.instrumentation.phase("write"):
+                    network_id = await self.bluecat_manager.client.service.addIP4Network(block_chain[-1]['id'], entry[2], properties)
+            except Exception as e:
+                if BluecatUtils.faultKind(e) != "duplicate":
+                    raise
+                await self.bluecat_manager.topology.reloadChildren(block_chain[-1]['id'])
+                if not self.bluecat_manager.utils.checkIfExists(entry[2], await self.bluecat_manager.topology.chain(network.network_address, "IP4Network", block_chain[-1]['id'])):
+                    raise
+                print(f"Network {entry[2]} already exists.")
+                return
+            self.bluecat_manager.topology.addChild(block_chain[-1]['id'], "IP4Network", network_id, entry[1], f"CIDR={entry[2]}|{properties}")
+            print(f"Added {entry[1]} network to {entry[2]}.")
+
+class AsyncHost(Host):
+    """Async counterpart of Host. Only the methods that talk to BAM are overridden, the record editing and
+    validation logic is shared with Host."""
+    async def buildDnsDict(self, host_area):
+        subzone = await self.bluecat_manager.zones.getId(host_area)
+
+        if subzone is None:
+            return False
+
+        seen = dict(self.bluecat_manager.dns_dict.get(host_area, {}))
+        snapshot = self.bluecat_manager.snapshot
+        rows = snapshot.load("hosts", host_area) if snapshot else None
+        if rows is not None and await snapshot.isCurrentAsync(rows, self.bluecat_manager.client, subzone, "HostRecord"):
+            entities = rows
+        else:
+            entities = await self.bluecat_manager.utils.getEntities(self.bluecat_manager.client, subzone, "HostRecord")
+            self.saveSnapshot(host_area, entities)
+        zone_hosts = self.bluecat_manager.dns_dict.setdefault(host_area, {})
+        for entity in entities:
+            if entity['name'] is not None:
+                name = entity['name'].upper()
+                if zone_hosts.get(name) is seen.get(name): # Keep records written while the zone was being fetched
+                    zone_hosts[name] = self.dnsRecord(entity)
+
+        self.bluecat_manager.full_updates += [host_area]
+
+    def storeInDict(self, hostname, data):
+        # Everything runs on one event loop, so the dictionary needs no lock here
+        host_area, name = self.hostKey(hostname)
+        self.bluecat_manager.dns_dict.setdefault(host_area, {})[name] = self.dnsRecord(data)
+        if self.bluecat_manager.snapshot:
+            self.bluecat_manager.snapshot.upsert("hosts", host_area, name, data['id'], data['name'], data['properties'])
+
+    async def findExistingHost(self, hostname):
+        host_area, host_without_zone = self.hostKey(hostname)
+
+        zone_hosts = self.bluecat_manager.dns_dict.setdefault(host_area, {})
+        if host_area in self.bluecat_manager.full_updates or host_without_zone in zone_hosts:
+            return zone_hosts.get(host_without_zone)
+        snapshot = self.bluecat_manager.snapshot
+        if snapshot and snapshot.isLoaded("hosts", host_area):
+            await self.prefetchZone(host_area)
+            return zone_hosts.get(host_without_zone)
+        return await self.lookupHost(hostname)
+
+    async def lookupHost(self, hostname):
+        host_area, host_without_zone = self.hostKey(hostname)
+        zone_id = await self.bluecat_manager.zones.getId(host_area)
+        if zone_id is None:
+            return None
+        entity = await self.bluecat_manager.client.service.getEntityByName(zone_id, '.'.join(hostname.split('.')[:-2]), "HostRecord")
+        record = self.dnsRecord(entity) if entity and entity['id'] else None
+        self.bluecat_manager.dns_dict.setdefault(host_area, {})[host_without_zone] = record
+        return record
+
+    async def prefetchZone(self, host_area):
+        host_area = host_area.upper()
+
+        async def build():
+            if host_area not in self.bluecat_manager.full_updates:
+                print(f"Building dictionary for '{host_area.lower()}.'")
+                await self.buildDnsDict(host_area)
+
+        if host_area not in self.bluecat_manager.full_updates:
+            await self.bluecat_manager.dns_loader.once(host_area, build)
+
+    async def networkId(self, ip):
+        ip_int = BluecatUtils.ipToInt(ip)
+        block_chain = await self.bluecat_manager.topology.chain(ip_int, "IP4Block")
+        if not block_chain:
+            return None
+        network_chain = await self.bluecat_manager.topology.chain(ip_int, "IP4Network", block_chain[-1]['id'])
+        return network_chain[-1]['id'] if network_chain else None
+
+    async def findNetwork(self, cidr):
+        network = ipaddress.ip_network(cidr, strict=False)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        block_chain = await self.bluecat_manager.topology.chain(first, "IP4Block")
+        network_chain = await self.bluecat_manager.topology.chain(first, "IP4Network", block_chain[-1]['id']) if block_chain else []
+        if network_chain and (network_chain[-1].first, network_chain[-1].last) == (first, last):
+            return network_chain[-1]
+        return None
+
+    async def nextFreeAddress(self, first, last, net_id=None, gateway=None):
+        free = self.bluecat_manager.free_addresses
+        if not free.isLoaded(first, last):
+            free.build(first, last, await self.bluecat_manager.addresses.load(net_id) if net_id is not None else (), gateway)
+        return str(ipaddress.ip_address(free.allocate(first, last)[0]))
+
+    async def allocateAddress(self, hostname, cidr):
+        network = await self.findNetwork(cidr)
+        if network is None:
+            raise ValueError(f"Network {cidr} doesn't exist.")
+        existing = await self.findExistingHost(hostname)
+        if existing is not None and any(network.first <= BluecatUtils.ipToInt(address) <= network.last for address in existing.addresses):
+            return None
+        return await self.nextFreeAddress(network.first, network.last, network.id, network.gateway)
+
+    async def IsIpAlreadyAssigned(self, ip, net_id):
+        return await self.bluecat_manager.addresses.contains(net_id, ip)
+
+    async def createHostRecord(self, _name, addresses, comments = None):
+        properties = f"reverseRecord=true|comments={comments}" if comments else "reverseRecord=true"
+        add_id = await self.bluecat_manager.client.service.addHostRecord(self.bluecat_manager.top_level_view_id, _name, ','.join(addresses), "0", properties)
+        self.storeInDict(_name, HostRecord(add_id, '.'.join(_name.split('.')[:-2]), tuple(addresses), comments))
+        await self.recordAddresses(addresses)
+        print(f"Assigned {_name} to {', '.join(addresses)}.")
+
+    async def writeHostRecord(self, host_id, _name, changes):
+        host = await self.bluecat_manager.client.service.getEntityById(host_id)
+        current = HostRecord.fromEntity(host)
+        addresses, comments = self.mergeChanges(current, changes)
+        added = [address for address in addresses if address not in current.addresses]
+        properties = Properties(host['properties'])
+        properties['addresses'] = ','.join(addresses)
+        if comments is not None:
+            properties['comments'] = comments
+        host['properties'] = str(properties)
+        await self.bluecat_manager.client.service.update(host)
+        self.storeInDict(_name, host)
+        await self.recordAddresses(added)
+        print(f"Assigned {_name} to {', '.join(added)}. Existing record updated.")
+
+    async def recordAddresses(self, addresses):
+        for address in addresses:
+            net_id = await self.networkId(address)
+            if net_id is not None:
+                self.bluecat_manager.addresses.add(net_id, address)
+
+    async def writeHost(self, _name, changes):
+        with self.bluecat_manager.instrumentation.phase("lookup"):
+            existing = await self.findExistingHost(_name)
+        if existing is None:
+            addresses, comments = self.mergeChanges(None, changes)
+            try:
+                await self.createHostRecord(_name, addresses, comments)
+                return
+            except Exception as e:
+                if BluecatUtils.faultKind(e) != "duplicate":
+                    raise
+                existing = await self.lookupHost(_name)
+                if existing is None:
+                    raise
+                if set(addresses) <= set(existing.addresses) and comments == existing.comments:
+                    self.storeInDict(_name, existing)
+                    await self.recordAddresses(addresses)
+                    print(f"Assigned {_name} to {', '.join(addresses)}.")
+                    return
+        await self.writeHostRecord(existing['id'], _name, changes)
+
+    async def ProcessEntries(self, entries):
+        with self.bluecat_manager.instrumentation.phase("validation"):
+            valid = await self.checkIfValidHostname(entries[0][1])
+        if not valid[0]:
+            return [valid[1]] * len(entries)
+
+        errors = [None] * len(entries)
+        changes, pending, seen = [], [], set()
+        for i, entry in enumerate(entries):
+            try:
+                address, cidr = entry[2], self.requestedNetwork(entry)
+                if cidr is not None:
+                    with self.bluecat_manager.instrumentation.phase("allocate"):
+                        address = await self.allocateAddress(entry[1], cidr)
+                    if address is None:
+                        print(f"{entry[1]} already has an address in {cidr}.")
+                        continue
+                with self.bluecat_manager.instrumentation.phase("dig"):
+                    ip_int = BluecatUtils.ipToInt(address)
+                    net_id = await self.networkId(ip_int)
+                if net_id is None:
+                    raise ValueError(f"Address ({address}) is not in a network.")
+                with self.bluecat_manager.instrumentation.phase("exists"):
+                    assigned = ip_int in seen or await self.IsIpAlreadyAssigned(ip_int, net_id)
+                if assigned:
+                    print(f"Address ({address}) already assigned.")
+                    continue
+                seen.add(ip_int)
+                changes.append((address,) + self.rowComments(entry))
+                pending.append(i)
+            except Exception as e:
+                errors[i] = str(e) or type(e).__name__
+
+        if changes:
+            try:
+                with self.bluecat_manager.instrumentation.phase("write"):
+                    await self.writeHost(entries[0][1], changes)
+            except Exception as e:
+                for i in pending:
+                    errors[i] = str(e) or type(e).__name__
+        return errors
+
+    async def checkIfHostnameHasValidSubdomain(self, hostname):
+        elements = hostname.split('.')
+        return await self.bluecat_manager.zones.getId(elements[-2]) is not None
+
+    async def checkIfValidHostname(self, hostname):
+        if not self.checkIfHostnameHasTwoDomains(hostname):
+            return (False, f"Did you forget to add the full subdomain + domain for this hostname ({hostname})?")
+        if not self.checkIfHostnameIsIn(hostname):
+            return (False, f"This hostname ({hostname}) is not part of the parent domain.")
+        if not await self.checkIfHostnameHasValidSubdomain(hostname):
+            return (False, f"This subdomain doesn't exist. Please check the hostname ({hostname}).")
+        return (True, "")
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """Async counterpart of AdaptiveLimiter, capping the requests in flight on the event loop.
+
+    Requests aren't rate limited here, so only the concurrency is adjusted.
+    """
+    def __init__(self, concurrency, adaptive=True, latency_target=None, cooldown=1.0):
+        super().__init__(TokenBucket(None), concurrency, adaptive, latency_target, cooldown=cooldown)
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+
+    async def release(self, elapsed, transient=False):
+        async with self.condition:
+            self.in_flight -= 1
+            self.adjust(elapsed, transient)
+            self.condition.notify_all()
+
+class AsyncRetryingClient:
+    """Async counterpart of RetryingClient."""
+    def __init__(self, client, limiter, retries=3, backoff=0.5, max_backoff=30):
+        self.client = client
+        self.limiter = limiter
+        self.service = AsyncRetryingService(client.service, limiter, retries, backoff, max_backoff)
+
+class AsyncRetryingService(RetryingService):
+    def __getattr__(self, name):
+        operation = getattr(self.service, name)
+
+        async def call(*args, **kwargs):
+            for attempt in itertools.count():
+                await self.limiter.acquire()
+                start = time.perf_counter()
+                kind = None
+                try:
+                    return await operation(*args, **kwargs)
+                except Exception as e:
+                    kind = BluecatUtils.faultKind(e)
+                    if kind != "transient" or attempt >= self.retries:
+                        raise
+                finally:
+                    await self.limiter.release(time.perf_counter() - start, kind == "transient")
+                print(f"Retrying {name} after a transient fault.")
+                await asyncio.sleep(self.backoffDelay(attempt))
+        return call
+
+class AsyncInstrumentedClient:
+    """Async counterpart of InstrumentedClient."""
+    def __init__(self, client, instrumentation):
+        self.client = client
+        self.service = AsyncInstrumentedService(client.service, instrumentation)
+
+class AsyncInstrumentedService(InstrumentedService):
+    def __getattr__(self, name):
+        operation = getattr(self.service, name)
+
+        async def call(*args, **kwargs):
+            start = time.perf_counter()
+            error = False
+            try:
+                return await operation(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.instrumentation.recordCall(name, time.perf_counter() - start, error)
+        return call
+
+def createAsyncClient(bam_hostname, max_concurrent_requests):
+    """Build the async zeep client for BAM on a keep-alive httpx pool, loading the WSDL the same way as createClient.
+
+    Returns:
+        tuple: The client and the httpx client, which needs closing when finished
+    """
+    import httpx
+    from zeep import AsyncClient
+    from zeep.cache import SqliteCache
+    from zeep.transports import AsyncTransport
+
+    limits = httpx.Limits(max_connections=max_concurrent_requests, max_keepalive_connections=max_concurrent_requests)
+    http_client = httpx.AsyncClient(limits=limits)
+    transport = AsyncTransport(client=http_client, cache=SqliteCache(path=config.get("wsdl_cache"), timeout=config.get("wsdl_cache_ttl", 86400)))
+    if config.get("wsdl_file"):
+        client = AsyncClient(config["wsdl_file"], transport=transport)
+        return BoundServiceClient(client.create_service(next(iter(client.wsdl.bindings)), f"http://{bam_hostname}/Services/API")), http_client
+    return AsyncClient(f"http://{bam_hostname}/Services/API?wsdl", transport=transport), http_client
+
+class AsyncLazySession:
+    """Async counterpart of LazySession."""
+    def __init__(self, username, password, bam_hostname, max_concurrent_requests, client=None):
+        self.username = username
+        self.password = password
+        self.bam_hostname = bam_hostname
+        self.max_concurrent_requests = max_concurrent_requests
+        self.client = client
+        self.http_client = None
+        self.session_id = None
+        self.lock = asyncio.Lock()
+        self.service = AsyncLazyService(self)
+
+    async def connect(self):
+        async with self.lock:
+            if self.client is None:
+                self.client, self.http_client = createAsyncClient(self.bam_hostname, self.max_concurrent_requests)
+            if self.session_id is None:
+                self.session_id = await self.client.service.login(self.username, self.password)
+        return self.client.service
+
+    async def close(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+
+class AsyncLazyService:
+    def __init__(self, session):
+        self.session = session
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            service = await self.session.connect()
+            return await getattr(service, name)(*args, **kwargs)
+        return call
+
+class AsyncBluecatManager:
+    """Async counterpart of BluecatManager, built on zeep's async transport.
+
+    All requests share one keep-alive httpx connection pool, and max_concurrent_requests caps how many are
+    in flight at once to protect BAM. Logs in on the first API call, or on an explicit login().
+    """
+    def __init__(self, username, password, bam_hostname, max_concurrent_requests=10, client=None):
+        self.session = AsyncLazySession(username, password, bam_hostname, max_concurrent_requests, client)
+        self.instrumentation = Instrumentation(config.get("metrics_file"), config.get("metrics_interval", 60))
+        limiter = AsyncAdaptiveLimiter(max_concurrent_requests, config.get("adaptive_limits", True), config.get("latency_target", 2.0))
+        self.client = AsyncRetryingClient(AsyncInstrumentedClient(self.session, self.instrumentation), limiter,
+                                          config.get("retries", 3), config.get("retry_backoff", 0.5), config.get("retry_max_backoff", 30))
+        self.dns_dict = {} # host area -> {relative hostname (uppercase) -> host record, or None if BAM has no such host}
+        self.dns_loader = AsyncLoader() # One fetch per zone dictionary, whichever coroutine asks first
+        self.full_updates = [] # Which domains have had a full dictionary built
+        self.top_level_view_id = config.get("top_level_view_id")
+        self.view_id = config.get("view_id")
+        self.block_properties = f"allowDuplicateHost=disable|inheritAllowDuplicateHost=true|pingBeforeAssign=disable|inheritPingBeforeAssign=true|inheritDefaultDomains=true|defaultView={self.top_level_view_id}|inheritDefaultView=true|inheritDNSRestrictions=true|"
+
+        self.block = AsyncBlock(self)
+        self.network = AsyncNetwork(self)
+        self.host = AsyncHost(self)
+        self.utils = AsyncBluecatUtils()
+        self.topology = AsyncTopologyIndex(self)
+        self.addresses = AsyncAddressIndex(self)
+        self.free_addresses = FreeAddressMap()
+        self.zones = AsyncZoneCache(self, config.get("zone_cache_ttl"))
+        self.snapshot = openSnapshot(bam_hostname, self.view_id)
+
+    @property
+    def session_id(self):
+        return self.session.session_id
+
+    async def login(self):
+        await self.session.connect()
+
+    async def logout(self):
+        try:
+            if self.session.session_id is not None:
+                await self.client.service.logout()
+        finally:
+            await self.session.close()
+            self.instrumentation.report()
+            if self.snapshot:
+                self.snapshot.close()
+
+class AsyncImportEngine(ImportEngine):
+    """Runs every row as a coroutine on one event loop, with the same dependency rules as ImportEngine."""
+    async def processRow(self, entry):
+        process_entry_func = self.entry_type_mapping.get(entry[0]) if entry else None
+        if not process_entry_func:
+            print(f"Unknown entry type: {entry[0] if entry else ''}")
+            return f"Unknown entry type: {entry[0] if entry else ''}"
+        try:
+            with self.bluecat_manager.instrumentation.row(entry[0]):
+                await process_entry_func(entry)
+        except Exception as e:
+            print(f"Failed to process {','.join(entry)}: {e}")
+            return str(e) or type(e).__name__
+
+    async def processHostRows(self, entries):
+        try:
+            with self.bluecat_manager.instrumentation.row("Host"):
+                errors = await self.bluecat_manager.host.ProcessEntries(entries)
+        except Exception as e:
+            errors = [str(e) or type(e).__name__] * len(entries)
+        for entry, error in zip(entries, errors):
+            if error:
+                print(f"Failed to process {','.join(entry)}: {error}")
+        return errors
+
+    async def run(self, rows):
+        reserved = self.reserveExplicit(rows)
+        for batch in self.batches(rows):
+            containers, groups = self.splitHosts(batch)
+            if not reserved:
+                self.bluecat_manager.free_addresses.reserve(FreeAddressMap.explicitAddresses(batch))
+            if containers:
+                await self.runBatch(containers)
+            if groups:
+                await self.runHosts(groups)
+        return self.report
+
+    async def runBatch(self, data):
+        await self.runScheduled(data, self.buildDependencies(data), self.processRow, self.recordResult)
+
+    async def runHosts(self, groups):
+        for host_area in self.zonesToPrefetch(groups):
+            await self.bluecat_manager.host.prefetchZone(host_area)
+        await self.runScheduled(groups, self.groupDependencies(groups), self.processHostRows, self.recordHostResults)
+
+    async def runScheduled(self, items, dependencies, process, record):
+        finished = [asyncio.Event() for _ in items]
+
+        async def runRow(i):
+            for dependency in dependencies[i]:
+                await finished[dependency].wait()
+            record(items[i], await process(items[i]))
+            finished[i].set()
+
+        await asyncio.gather(*(runRow(i) for i in range(len(items))))
+
+async def runAsyncImport(username, password, bam_hostname, rows, checkpoint=None, rejects=None, reserved=None):
+    """Import the rows with an AsyncBluecatManager and log out.
+
+    Returns:
+        dict: The AsyncImportEngine report
+    """
+    bluecat_manager = AsyncBluecatManager(username, password, bam_hostname, config.get("max_concurrent_requests", 10))
+    try:
+        engine = AsyncImportEngine(bluecat_manager, batch_size=config.get("batch_size", 1000), checkpoint=checkpoint, rejects=rejects, reserved=reserved)
+        return await engine.run(rows)
+    finally:
+        await bluecat_manager.logout()
+
+
+class ShardedImport:
+    """Splits an import into independent shards by top-level block and runs them on a pool of worker processes.
+
+    A row belongs to the top-level block holding its address, as found in the topology index, and shards that share a hostname
+    are merged, so no two processes ever write the same container or host record at once. Each worker process logs in once and keeps its session for every
+    shard it runs, so there are never more BAM sessions open than processes.
+
+    Rows are read batch_size at a time, as ImportEngine reads them, and each batch is split into shards that all
+    finish before the next batch starts. Only a batch is held in memory, and the checkpoint and reject file are
+    written by this process as each shard comes back, so a crash loses at most the shards still running. The
+    shard reports are merged into one.
+
+    A shard key stays pinned to the process that first ran it, so a process's cached containers and addresses
+    are only ever changed by that process. When a hostname merges keys pinned to different processes, the one
+    that takes them over forgets what it has cached before running the shard.
+    """
+    def __init__(self, bluecat_manager, processes=4, checkpoint=None, rejects=None, batch_size=1000, reserved=None):
+        self.bluecat_manager = bluecat_manager
+        self.processes = max(1, processes)
+        self.checkpoint = checkpoint
+        self.rejects = rejects
+        self.batch_size = max(1, batch_size)
+        self.reserved = reserved # Integer addresses assigned explicitly anywhere in the import, or None if unknown
+        self.top_level = None # The top-level blocks, loaded on the first partition
+        self.parents = {} # Shard key -> the key of the shard it was merged into, kept for the whole import
+        self.pinned = {} # Root shard key -> index of the worker process that runs it
+        self.stale = set() # Root shard keys whose process has to forget its caches before running them
+        self.report = {"rows": 0, "completed": 0, "skipped": 0, "rejected": 0, "shards": 0}
+
+    @staticmethod
+    def rowAddress(entry):
+        """Get the integer address that places a row in the tree (a container's first address, or a host's address), or None."""
+        if len(entry) < 3 or entry[0] not in ("Block", "Network", "Host"):
+            return None
+        value = (Host.requestedNetwork(entry) or entry[2]) if entry[0] == "Host" else entry[2]
+        try:
+            return int(ipaddress.ip_network(value, strict=False).network_address)
+        except ValueError:
+            return None
+
+    def batches(self, rows):
+        """Yield lists of up to batch_size rows, leaving out a header row and rows the checkpoint says are already done."""
+        rows = ImportEngine.skipHeader(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.batch_size))
+            if not chunk:
+                return
+            batch = [entry for entry in chunk if not (self.checkpoint and self.checkpoint.isDone(entry))]
+            self.report["rows"] += len(chunk)
+            self.report["skipped"] += len(chunk) - len(batch)
+            if batch:
+                yield batch
+
+    def findShard(self, key):
+        """Get the root key of the shard a key has been merged into."""
+        while self.parents.setdefault(key, key) != key:
+            key = self.parents[key]
+        return key
+
+    def mergeShards(self, key, other):
+        """Merge the shard holding key into the one holding other, moving it to other's process if they differ."""
+        key, other = self.findShard(key), self.findShard(other)
+        if key == other:
+            return
+        self.parents[key] = other
+        worker = self.pinned.pop(key, None)
+        if worker is not None and self.pinned.setdefault(other, worker) != worker:
+            self.stale.add(other)
+        if key in self.stale:
+            self.stale.discard(key)
+            self.stale.add(other)
+
+    def partition(self, rows):
+        """Split a batch of rows into shards that can run at the same time, each keeping the rows in CSV order.
+
+        Args:
+            rows (list): The CSV rows
+
+        Returns:
+            dict: Root shard key -> the shard's rows
+        """
+        if self.top_level is None:
+            self.top_level = self.bluecat_manager.topology.loadChildren(5, "IP4Block")
+
+        keys, hostnames = [], {}
+        for entry in rows:
+            # Rows that aren't under any top-level block share the None shard, where they fail as they would anyway
+            address = self.rowAddress(entry)
+            record = self.bluecat_manager.topology.searchContainer(self.top_level, address) if address is not None else None
+            key = record.id if record is not None else None
+            if entry[0] == "Host" and len(entry) > 2:
+                self.mergeShards(key, hostnames.setdefault(entry[1].upper(), key))
+            keys.append(key)
+
+        shards = defaultdict(list)
+        for entry, key in zip(rows, keys):
+            shards[self.findShard(key)].append(entry)
+        return shards
+
+    def recordShard(self, shard, report, rejected):
+        """Merge a finished shard's report, then checkpoint its rows or write them to the reject file."""
+        self.report["completed"] += report["completed"]
+        self.report["rejected"] += report["rejected"]
+        failed = set()
+        for entry, error in rejected:
+            failed.add(Checkpoint.rowHash(entry))
+            if self.rejects:
+                self.rejects.reject(entry, error)
+        if self.checkpoint:
+            for entry in shard:
+                if Checkpoint.rowHash(entry) not in failed:
+                    self.checkpoint.markDone(entry)
+
+    def run(self, rows, username, password, bam_hostname):
+        """Split each batch of rows into shards and run them on the worker processes, returning once every batch is done.
+
+        Args:
+            rows (iterable): The CSV rows, e.g. a csv.reader
+
+        Returns:
+            dict: Counts of the rows read, completed, skipped (already in the checkpoint) and rejected, and the number of shards
+        """
+        reserved = self.reserved
+        if reserved is None and isinstance(rows, list):
+            reserved = FreeAddressMap.explicitAddresses(rows)
+        settings = dict(config)
+        # The rate limits are for the whole import, so they are shared between the processes
+        for key in ("requests_per_second", "max_requests_per_second"):
+            if settings.get(key):
+                settings[key] = settings[key] / self.processes
+
+        pools = {} # Worker index -> its single-process pool, started when it is first given a shard
+        try:
+            for batch in self.batches(rows):
+                shards = self.partition(batch)
+                self.report["shards"] += len(shards)
+                futures, loads = {}, [0] * self.processes
+                # Pinned shards first, then new ones, largest first, each to the process with the fewest rows so far
+                for key, shard in sorted(shards.items(), key=lambda item: (item[0] not in self.pinned, -len(item[1]))):
+                    worker = self.pinned.setdefault(key, loads.index(min(loads)))
+                    loads[worker] += len(shard)
+                    if worker not in pools:
+                        pools[worker] = ProcessPoolExecutor(max_workers=1, initializer=startShardWorker,
+                                                            initargs=(settings, username, password, bam_hostname, reserved))
+                    futures[pools[worker].submit(runShard, shard, key in self.stale)] = shard
+                self.stale.clear()
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    try:
+                        report, rejected = future.result()
+                    except Exception as e:
+                        report = {"completed": 0, "rejected": len(shard)}
+                        rejected = [(entry, str(e) or type(e).__name__) for entry in shard]
+                    self.recordShard(shard, report, rejected)
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+        return self.report
+
+shard_manager = None # A shard worker process's BluecatManager, logged in on its first call
+shard_reserved = None # The explicit addresses the worker reserved when it started, None if the parent didn't know them
+
+def startShardWorker(settings, username, password, bam_hostname, reserved=None):
+    """Set up a shard worker process with the parent's config and its own BAM session, logged out when the process exits.
+    The addresses the whole import assigns explicitly are reserved once here, rather than sent with every shard."""
+    global shard_manager, shard_reserved
+    config.clear()
+    config.update(settings)
+    shard_manager = BluecatManager(username, password, bam_hostname)
+    shard_reserved = reserved
+    if reserved:
+        shard_manager.free_addresses.reserve(reserved)
+    Finalize(shard_manager, shard_manager.logout, exitpriority=10)
+
+def runShard(rows, reset=False):
+    """Import one shard with the worker process's session.
+
+    Args:
+        rows (list): The shard's rows
+        reset (bool): Forget everything cached first, as another process has written some of the shard's containers
+
+    Returns:
+        tuple: (the ImportEngine report, [(row, error), ...] for the rejected rows)
+    """
+    if reset:
+        shard_manager.resetCaches()
+    rejects = RejectList()
+    # Without the whole import's explicit addresses, the engine finds the shard's own
+    reserved = () if shard_reserved is not None else None
+    engine = ImportEngine(shard_manager, config.get("workers", 4), config.get("batch_size", 1000), rejects=rejects, reserved=reserved)
+    return engine.run(rows), rejects.rows
+
+def runShardedImport(username, password, bam_hostname, rows, processes, checkpoint=None, rejects=None, reserved=None):
+    """Split the rows by top-level block and import the shards on worker processes.
+
+    Returns:
+        dict: The merged ShardedImport report
+    """
+    bluecat_manager = BluecatManager(username, password, bam_hostname)
+    importer = ShardedImport(bluecat_manager, processes, checkpoint, rejects, config.get("batch_size", 1000), reserved)
+    try:
+        # The top-level blocks are all that partitioning reads from BAM, so only the workers' sessions stay open while the shards run
+        importer.top_level = bluecat_manager.topology.loadChildren(5, "IP4Block")
+    finally:
+        bluecat_manager.logout()
+    return importer.run(rows, username, password, bam_hostname)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add the blocks, networks and hosts in a CSV file to Bluecat Address Manager.")
+    parser.add_argument("file_path", help="The CSV file to import, or to write with --export")
+    parser.add_argument("--server", help="BAM hostname or IP, defaults to bam_hostname in the config")
+    parser.add_argument("--user", help="BAM API username, defaults to username in the config")
+    parser.add_argument("--config", default="config.json", help="Path to the JSON config file")
+    parser.add_argument("--checkpoint", help="File recording finished rows, which are skipped when the import is rerun")
+    parser.add_argument("--rejects", help="CSV file that failed rows are written to, with the error as an extra column")
+    parser.add_argument("--plan", action="store_true", help="Work out and print the changes the CSV needs without writing anything")
+    parser.add_argument("--plan-file", help="With --plan, also write the planned changes to this JSON file")
+    parser.add_argument("--apply", action="store_true", help="With --plan, make the planned changes")
+    parser.add_argument("--shards", type=int, help="Split the import by top-level block and run it on this many worker processes, each with its own BAM session")
+    parser.add_argument("--validate", action="store_true", help="Only check the CSV offline for rows that are bound to fail, without logging in")
+    parser.add_argument("--export", action="store_true", help="Write the blocks, networks and host records in BAM to the CSV instead of importing it")
+    parser.add_argument("--block", type=int, default=5, help="With --export, the block (or configuration) ID to export the containers under")
+    parser.add_argument("--view", type=int, help="With --export, the view or zone ID to export the host records under, defaults to view_id in the config")
+    args = parser.parse_args(argv)
+
+    loadConfig(args.config)
+    server_ip = args.server or config.get("bam_hostname", "")
+    username = args.user or config.get("username", "")
+    password = os.environ.get("BLUECAT_API_PASSWORD")
+    checkpoint_path = args.checkpoint or config.get("checkpoint_file")
+    rejects_path = args.rejects or config.get("reject_file")
+    shard_processes = args.shards or config.get("shard_processes")
+
+    if args.export:
+        bluecat_manager = BluecatManager(username, password, server_ip)
+        try:
+            with open(args.file_path, mode='w', newline='') as output:
+                exported = BamExporter(bluecat_manager, output, config.get("workers", 4)).export(args.block, args.view or bluecat_manager.view_id)
+        finally:
+            bluecat_manager.logout()
+        print(f"Exported {exported['blocks']} blocks, {exported['networks']} networks and {exported['hosts']} host records. "
+              f"{exported['skipped']} host records had no address in the exported networks.")
+        return
+
+    validator = None
+    if args.validate or config.get("validate", True):
+        # One offline pass over the file before logging in, then the import reads it again without the failing rows
+        with open(args.file_path, mode='r', newline='') as csvfile:
+            validator = CsvValidator().validate(csv.reader(csvfile))
+        validator.printReport()
+        if args.validate:
+            # A non-zero exit lets scripts and CI stop before importing a file that would have rejected rows
+            if validator.errors:
+                sys.exit(1)
+            return
+        reserved = validator.explicit
+    else:
+        # Still one pass ahead of the import, so free addresses skip the explicit ones in every batch, not just their own
+        with open(args.file_path, mode='r', newline='') as csvfile:
+            reserved = FreeAddressMap.explicitAddresses(csv.reader(csvfile))
+
+    # Opened only once an import is going ahead, so a validation-only run leaves the reject file alone
+    checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+    rejects = RejectFile(rejects_path) if rejects_path else None
+    try:
+        with open(args.file_path, mode='r', newline='') as csvfile:
+            # Rows are streamed from the file rather than read into memory up front
+            csv_reader = csv.reader(csvfile)
+            if validator:
+                csv_reader = validator.filter(csv_reader, rejects)
+
+            if args.plan:
+                bluecat_manager = BluecatManager(username, password, server_ip)
+                try:
+                    planner = ImportPlanner(bluecat_manager, config.get("workers", 4)).plan(csv_reader)
+                    planner.printPlan()
+                    if args.plan_file:
+                        planner.exportPlan(args.plan_file)
+                    if rejects:
+                        for entry, error in planner.errors:
+                            rejects.reject(entry, error)
+                    if args.apply:
+                        applied = planner.apply()
+                        print(f"Applied {applied['blocks']} blocks, {applied['networks']} networks, {applied['create_hosts']} new host records "
+                              f"and {applied['update_hosts']} host record updates. {applied['failed']} failed.")
+                finally:
+                    bluecat_manager.logout()
+                return
+            elif shard_processes:
+                report = runShardedImport(username, password, server_ip, csv_reader, shard_processes, checkpoint, rejects, reserved)
+            elif config.get("async", False):
+                # One event loop with pooled connections, at most max_concurrent_requests in flight
+                report = asyncio.run(runAsyncImport(username, password, server_ip, csv_reader, checkpoint, rejects, reserved))
+            else:
+                bluecat_manager = BluecatManager(username, password, server_ip)
+
+                # Rows run in parallel where they don't depend on each other, with the request rate capped by requests_per_second
+                engine = ImportEngine(bluecat_manager, config.get("workers", 4), config.get("batch_size", 1000), checkpoint, rejects, reserved)
+                try:
+                    report = engine.run(csv_reader)
+                finally:
+                    bluecat_manager.logout()
+    finally:
+        if checkpoint:
+            checkpoint.close()
+        if rejects:
+            rejects.close()
+
+    if validator:
+        report["rows"] += len(validator.errors)
+        report["rejected"] += len(validator.errors)
+    print(f"Read {report['rows']} rows: {report['completed']} completed, {report['skipped']} skipped from the checkpoint, {report['rejected']} rejected.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import ipaddress
+import random
+import threading
+import time
+import asyncio
+from collections import Counter
+
+class Fault(Exception):
+    """Stands in for zeep.exceptions.Fault, the error BAM raises for a rejected call."""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+class TransportError(Exception):
+    """Stands in for zeep.exceptions.TransportError, raised when the server answers with an HTTP error such as 503."""
+    def __init__(self, status_code, message=""):
+        super().__init__(f"Server returned HTTP status {status_code}{': ' + message if message else ''}")
+        self.status_code = status_code
+
+class FakeBAMService:
+    """In-process stand-in for the parts of the BAM SOAP API that Auto-IPAM uses.
+
+    Entities are plain dicts with the same keys as the zeep objects (id, name, type, properties), and every
+    call can be given a latency so that timings look like a real server. Call counts are kept per operation.
+    A share of calls can be made to fail with a 503 before doing anything, to exercise retries, and a share of
+    add calls can fail with a 504 after making their change, as if the reply was lost, so the retry is a duplicate.
+    """
+    def __init__(self, latency=0.0, latencies=None, configuration_id=5, error_rate=0.0, lost_reply_rate=0.0):
+        self.latency = latency # Seconds added to every call
+        self.latencies = latencies or {} # Per-operation overrides e.g. {"getEntities": 0.05}
+        self.error_rate = error_rate # Fraction of calls (other than login/logout) that fail with a transient 503
+        self.lost_reply_rate = lost_reply_rate # Fraction of add calls that fail with a 504 after making their change
+        self.blocking = True # Sleep for the latency inside the call, turned off when the latency is awaited instead
+        self.calls = Counter()
+        self.lock = threading.RLock()
+        self.entities = {}
+        self.children = {} # parent ID -> {type: [child IDs]}
+        self.names = {} # (parent ID, type, uppercase name) -> ID
+        self.allocations = {} # address -> (IP4Address ID, linked host record ID)
+        self.ranges = {} # block/network ID -> (first, last) integer range
+        self.next_id = 100000
+        self.configuration_id = configuration_id
+        self.store(configuration_id, None, "Configuration", "Default", "")
+
+    # Setting up data
+
+    def store(self, _id, parent_id, _type, name, properties):
+        self.entities[_id] = {'id': _id, 'name': name, 'type': _type, 'properties': properties, 'parent': parent_id}
+        self.children.setdefault(_id, {})
+        if parent_id is not None:
+            self.children.setdefault(parent_id, {}).setdefault(_type, []).append(_id)
+            if name is not None:
+                self.names[(parent_id, _type, name.upper())] = _id
+        return _id
+
+    def childrenOf(self, parent_id, *types):
+        for _type in types:
+            for child_id in self.children.get(parent_id, {}).get(_type, []):
+                yield self.entities[child_id]
+
+    def newId(self):
+        self.next_id += 1
+        return self.next_id
+
+    def addView(self, name):
+        """Add a DNS view under the configuration."""
+        with self.lock:
+            return self.store(self.newId(), self.configuration_id, "View", name, "")
+
+    def addZone(self, parent_id, name):
+        """Add a DNS zone under a view or another zone."""
+        with self.lock:
+            parent = self.entities[parent_id]
+            absolute = name if parent['type'] == "View" else f"{name}.{self.absoluteName(parent_id)}"
+            return self.store(self.newId(), parent_id, "Zone", name, f"absoluteName={absolute}|deployable=true|")
+
+    def absoluteName(self, zone_id):
+        for prop in self.entities[zone_id]['properties'].split('|'):
+            if prop.startswith("absoluteName="):
+                return prop[len("absoluteName="):]
+
+    # Helpers
+
+    def delay(self, operation):
+        return self.latencies.get(operation, self.latency)
+
+    def wait(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+        if self.blocking and self.delay(operation):
+            time.sleep(self.delay(operation))
+        if self.error_rate and operation not in ("login", "logout") and random.random() < self.error_rate:
+            raise TransportError(503, "Service temporarily unavailable")
+
+    def reply(self, operation, result):
+        """Return an add call's result, unless lost_reply_rate says the reply never arrives."""
+        if self.lost_reply_rate and random.random() < self.lost_reply_rate:
+            raise TransportError(504, f"Gateway timeout after {operation}")
+        return result
+
+    @staticmethod
+    def parseProperties(properties):
+        parsed = {}
+        for prop in (properties or "").split('|'):
+            if '=' in prop:
+                key, value = prop.split('=', 1)
+                parsed[key] = value
+        return parsed
+
+    def entityRange(self, entity):
+        if entity['id'] in self.ranges:
+            return self.ranges[entity['id']]
+        properties = self.parseProperties(entity['properties'])
+        if 'CIDR' in properties:
+            network = ipaddress.ip_network(properties['CIDR'], strict=False)
+            self.ranges[entity['id']] = int(network.network_address), int(network.broadcast_address)
+        elif 'start' in properties:
+            self.ranges[entity['id']] = int(ipaddress.ip_address(properties['start'])), int(ipaddress.ip_address(properties['end']))
+        return self.ranges.get(entity['id'])
+
+    def copy(self, entity):
+        return {'id': entity['id'], 'name': entity['name'], 'type': entity['type'], 'properties': entity['properties']}
+
+    def findNetwork(self, address):
+        """Find the network holding an address by walking the block tree."""
+        parent_id = self.configuration_id
+        while True:
+            for child in self.childrenOf(parent_id, "IP4Block", "IP4Network"):
+                first, last = self.entityRange(child)
+                if first <= address <= last:
+                    if child['type'] == "IP4Network":
+                        return child
+                    parent_id = child['id']
+                    break
+            else:
+                return None
+
+    def findZone(self, view_id, labels):
+        """Walk zones from the view for the labels (rightmost first). Returns the deepest zone and the unmatched labels."""
+        zone_id = view_id
+        remaining = list(labels)
+        while remaining and (zone_id, "Zone", remaining[-1].upper()) in self.names:
+            zone_id = self.names[(zone_id, "Zone", remaining.pop().upper())]
+        return zone_id, remaining
+
+    def assignAddresses(self, host_id, addresses):
+        """Create the IP4Address objects for a host record's addresses, failing if any is already in use."""
+        networks = []
+        for address in addresses:
+            if address in self.allocations:
+                if self.allocations[address][1] != host_id:
+                    raise Fault(f"Address {address} is already allocated")
+                continue
+            network = self.findNetwork(int(ipaddress.ip_address(address)))
+            if network is None:
+                raise Fault(f"No network found for address {address}")
+            networks.append((network['id'], address))
+        for network_id, address in networks:
+            address_id = self.store(self.newId(), network_id, "IP4Address", None, f"address={address}|state=STATIC|")
+            self.allocations[address] = (address_id, host_id)
+
+    def allocate(self, network_id, address, state="STATIC"):
+        """Add an IP4Address with no host record, e.g. a reserved or DHCP address."""
+        with self.lock:
+            address_id = self.store(self.newId(), network_id, "IP4Address", None, f"address={address}|state={state}|")
+            self.allocations[address] = (address_id, None)
+            return address_id
+
+    # API surface
+
+    def login(self, username, password):
+        self.wait("login")
+        return "fake-session"
+
+    def logout(self):
+        self.wait("logout")
+
+    def getEntities(self, parentId, type, start, count):
+        self.wait("getEntities")
+        with self.lock:
+            matching = self.children.get(parentId, {}).get(type, [])
+            return [self.copy(self.entities[child_id]) for child_id in matching[start:start + count]]
+
+    def getEntityById(self, id):
+        self.wait("getEntityById")
+        with self.lock:
+            if id not in self.entities:
+                return {'id': 0, 'name': None, 'type': None, 'properties': None}
+            return self.copy(self.entities[id])
+
+    def getEntityByName(self, parentId, name, type):
+        self.wait("getEntityByName")
+        with self.lock:
+            if (parentId, type, name.upper()) in self.names:
+                return self.copy(self.entities[self.names[(parentId, type, name.upper())]])
+            return {'id': 0, 'name': None, 'type': None, 'properties': None}
+
+    def addIP4BlockByCIDR(self, parentId, CIDR, properties):
+        self.wait("addIP4BlockByCIDR")
+        return self.reply("addIP4BlockByCIDR", self.addContainer(parentId, CIDR, properties, "IP4Block"))
+
+    def addIP4Network(self, blockId, CIDR, properties):
+        self.wait("addIP4Network")
+        return self.reply("addIP4Network", self.addContainer(blockId, CIDR, properties, "IP4Network"))
+
+    def addContainer(self, parent_id, cidr, properties, _type):
+        with self.lock:
+            network = ipaddress.ip_network(cidr, strict=False)
+            first, last = int(network.network_address), int(network.broadcast_address)
+            parent = self.entities.get(parent_id)
+            if parent is None or parent['type'] not in ("Configuration", "IP4Block"):
+                raise Fault(f"Invalid parent {parent_id} for {cidr}")
+            if parent['type'] == "IP4Block":
+                parent_first, parent_last = self.entityRange(parent)
+                if not (parent_first <= first and last <= parent_last):
+                    raise Fault(f"{cidr} is outside the parent block")
+            moved = []
+            for child in self.childrenOf(parent_id, "IP4Block", "IP4Network"):
+                child_first, child_last = self.entityRange(child)
+                if child_first <= first and last <= child_last:
+                    if child['type'] == _type and (child_first, child_last) == (first, last):
+                        raise Fault(f"Duplicate of another item: {cidr}")
+                    raise Fault(f"{cidr} overlaps {child['name']}, add it inside the existing object")
+                if first <= child_first and child_last <= last:
+                    if _type == "IP4Network":
+                        raise Fault(f"{cidr} overlaps {child['name']}")
+                    moved.append(child)
+                elif not (child_last < first or last < child_first):
+                    raise Fault(f"{cidr} overlaps {child['name']}")
+            name = self.parseProperties(properties).get('name')
+            _id = self.store(self.newId(), parent_id, _type, name, f"CIDR={cidr}|{properties}")
+            for child in moved:
+                self.children[parent_id][child['type']].remove(child['id'])
+                self.children[_id].setdefault(child['type'], []).append(child['id'])
+                child['parent'] = _id
+            return _id
+
+    def addHostRecord(self, viewId, absoluteName, addresses, ttl, properties):
+        self.wait("addHostRecord")
+        with self.lock:
+            view = self.entities.get(viewId)
+            if view is None or view['type'] != "View":
+                raise Fault(f"Invalid view {viewId}")
+            labels = absoluteName.split('.')
+            zone_id, remaining = self.findZone(viewId, labels)
+            if zone_id == viewId or not remaining:
+                raise Fault(f"No zone found for {absoluteName}")
+            name = '.'.join(remaining)
+            if (zone_id, "HostRecord", name.upper()) in self.names:
+                raise Fault(f"Duplicate of another item: {absoluteName}")
+            host_id = self.newId()
+            address_list = [address for address in addresses.split(',') if address]
+            self.assignAddresses(host_id, address_list)
+            self.store(host_id, zone_id, "HostRecord", name, f"absoluteName={absoluteName}|addresses={','.join(address_list)}|{properties}|")
+        return self.reply("addHostRecord", host_id)
+
+    def update(self, entity):
+        self.wait("update")
+        with self.lock:
+            stored = self.entities.get(entity['id'])
+            if stored is None:
+                raise Fault(f"Object {entity['id']} not found")
+            if stored['type'] == "HostRecord":
+                old = set(self.parseProperties(stored['properties']).get('addresses', '').split(','))
+                new = [address for address in self.parseProperties(entity['properties']).get('addresses', '').split(',') if address]
+                self.assignAddresses(stored['id'], [address for address in new if address not in old])
+                for address in old.difference(new):
+                    if address in self.allocations:
+                        self.release(address)
+            if stored['name'] != entity['name']:
+                self.names.pop((stored['parent'], stored['type'], (stored['name'] or '').upper()), None)
+                if entity['name'] is not None:
+                    self.names[(stored['parent'], stored['type'], entity['name'].upper())] = stored['id']
+            stored['name'] = entity['name']
+            stored['properties'] = entity['properties']
+
+    def release(self, address):
+        address_id, _ = self.allocations.pop(address)
+        address_entity = self.entities.pop(address_id)
+        self.children[address_entity['parent']]["IP4Address"].remove(address_id)
+
+class FakeBAMClient:
+    """Looks like a zeep Client as far as Auto-IPAM is concerned: just a .service."""
+    def __init__(self, service=None, **kwargs):
+        self.service = service or FakeBAMService(**kwargs)
+
+class AsyncFakeBAMService:
+    """Awaitable view of a FakeBAMService, for the AsyncBluecatManager. Latency is awaited rather than slept."""
+    def __init__(self, service):
+        self.fake = service
+        self.fake.blocking = False
+
+    def __getattr__(self, name):
+        operation = getattr(self.fake, name)
+
+        async def call(*args, **kwargs):
+            if self.fake.delay(name):
+                await asyncio.sleep(self.fake.delay(name))
+            return operation(*args, **kwargs)
+        return call
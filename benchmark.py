@@ -0,0 +1,146 @@
+"""Benchmarks Auto-IPAM against the in-process fake BAM, so performance changes can be measured without a live server.
+
+Synthetic CSVs mix Block, Network and Host rows (many hosts per zone, some multi-homed), or a real CSV such
+as test.csv can be given. For each run the wall time, SOAP calls per row and peak memory are reported
+(peak memory is traced for the whole process, so it includes the fake's own store).
+
+Usage:
+    python benchmark.py                         # 1k, 10k and 100k synthetic rows
+    python benchmark.py --rows 1000 --latency 0.002 --workers 8
+    python benchmark.py --csv test.csv
+"""
+import argparse
+import asyncio
+import csv
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+
+import AutoIPAM
+from FakeBAM import FakeBAMService, FakeBAMClient, AsyncFakeBAMService
+
+PARENT_DOMAIN = "xxx"
+ZONES = ["test", "fake"] + [f"zone{i}" for i in range(8)]
+HEADER = ["Type", "Name", "CIDR/Address", "Default Gateway/Comment", "Comment Action"]
+
+def generateRows(count, hosts_per_network=50, multi_homed_every=10):
+    """Generate a synthetic import of roughly count rows.
+
+    /16 blocks hold /24 networks (gateway .254), each followed by its hosts. Every multi_homed_every-th host
+    reuses the previous hostname so that multi-homed hosts are exercised too.
+
+    Args:
+        count (int): The number of data rows to generate
+        hosts_per_network (int, optional): Host rows per network
+        multi_homed_every (int, optional): How often a host row repeats the previous hostname
+
+    Returns:
+        list: The CSV rows, including the header
+    """
+    networks = max(1, count // (hosts_per_network + 1))
+    blocks = (networks + 255) // 256
+    rows = [HEADER]
+    for b in range(blocks):
+        rows.append(["Block", f"Bench Block {b}", f"10.{b}.0.0/16", "", ""])
+
+    host_count = 0
+    actions = ["add", "append", "replace", ""]
+    for n in range(networks):
+        if len(rows) > count:
+            break
+        b, c = divmod(n, 256)
+        rows.append(["Network", f"Bench Network {n}", f"10.{b}.{c}.0/24", f"10.{b}.{c}.254"])
+        for h in range(1, hosts_per_network + 1):
+            if len(rows) > count:
+                break
+            # Every multi_homed_every-th host keeps the last hostname, even when a Network row came in between
+            if not host_count or host_count % multi_homed_every:
+                hostname = f"host{host_count}.{ZONES[host_count % len(ZONES)]}.{PARENT_DOMAIN}"
+            action = actions[host_count % len(actions)]
+            comment = f"Benchmark host {host_count}" if action else ""
+            rows.append(["Host", hostname, f"10.{b}.{c}.{h}", comment, action])
+            host_count += 1
+    return rows
+
+def readRows(file_path):
+    with open(file_path, mode='r', newline='') as csvfile:
+        return [row for row in csv.reader(csvfile)]
+
+def seedService(service):
+    """Give the fake the structure the importer expects: a 10.0.0.0/8 root block, a view, the parent zone and its subzones.
+
+    Returns:
+        tuple: (top level view ID, view ID used for zone lookups)
+    """
+    service.addContainer(service.configuration_id, "10.0.0.0/8", "name=Benchmark Root|", "IP4Block")
+    top_level_view_id = service.addView("default")
+    view_id = service.addZone(top_level_view_id, PARENT_DOMAIN)
+    for zone in ZONES:
+        service.addZone(view_id, zone)
+    return top_level_view_id, view_id
+
+def runImport(rows, latency=0.0, workers=4, use_async=False, error_rate=0.0):
+    """Import rows into a freshly seeded fake BAM and measure the run.
+
+    Returns:
+        dic: The measurements for the run
+    """
+    service = FakeBAMService(latency=latency, error_rate=error_rate)
+    top_level_view_id, view_id = seedService(service)
+    AutoIPAM.config.update(top_level_view_id=top_level_view_id, view_id=view_id, parent_domain=PARENT_DOMAIN, requests_per_second=None)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if use_async:
+            async def run():
+                bluecat_manager = AutoIPAM.AsyncBluecatManager("benchmark", "benchmark", "fake-bam", AutoIPAM.config.get("max_concurrent_requests", 10), client=FakeBAMClient(AsyncFakeBAMService(service)))
+                await AutoIPAM.AsyncImportEngine(bluecat_manager).run(rows)
+                await bluecat_manager.logout()
+            asyncio.run(run())
+        else:
+            bluecat_manager = AutoIPAM.BluecatManager("benchmark", "benchmark", "fake-bam", client=FakeBAMClient(service))
+            AutoIPAM.ImportEngine(bluecat_manager, workers).run(rows)
+            bluecat_manager.logout()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    data_rows = max(1, len(rows) - 1)
+    calls = {operation: count for operation, count in service.calls.items() if operation not in ("login", "logout")}
+    return {
+        'rows': data_rows,
+        'wall_time': round(elapsed, 3),
+        'rows_per_second': round(data_rows / elapsed, 1) if elapsed else None,
+        'soap_calls': sum(calls.values()),
+        'calls_per_row': round(sum(calls.values()) / data_rows, 2),
+        'calls': calls,
+        'peak_memory_mb': round(peak / 1024 / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Auto-IPAM against an in-process fake BAM.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000], help="Synthetic CSV sizes to run")
+    parser.add_argument("--csv", help="Run this CSV instead of synthetic rows, e.g. test.csv")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of latency added to every SOAP call")
+    parser.add_argument("--workers", type=int, default=4, help="ImportEngine worker threads")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of SOAP calls that fail with a transient 503 and are retried")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the AsyncBluecatManager")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per run instead of a table")
+    args = parser.parse_args()
+
+    runs = [(args.csv, readRows(args.csv))] if args.csv else [(f"synthetic {count}", generateRows(count)) for count in args.rows]
+
+    if not args.json:
+        print(f"{'input':<18}{'rows':>8}{'wall s':>10}{'rows/s':>10}{'calls':>10}{'calls/row':>11}{'peak MB':>9}")
+    for name, rows in runs:
+        result = runImport(rows, args.latency, args.workers, args.use_async, args.error_rate)
+        if args.json:
+            print(json.dumps({'input': name, **result}))
+        else:
+            print(f"{name:<18}{result['rows']:>8}{result['wall_time']:>10}{result['rows_per_second']:>10}{result['soap_calls']:>10}{result['calls_per_row']:>11}{result['peak_memory_mb']:>9}")
+
+if __name__ == "__main__":
+    main()
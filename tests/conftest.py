@@ -0,0 +1,37 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AutoIPAM
+import benchmark
+from FakeBAM import FakeBAMClient, FakeBAMService
+
+
+@pytest.fixture
+def service():
+    return FakeBAMService()
+
+
+@pytest.fixture
+def bluecat_manager(service, monkeypatch):
+    """A BluecatManager talking to a freshly seeded FakeBAM, with no rate limit and no snapshot cache."""
+    top_level_view_id, view_id = benchmark.seedService(service)
+    monkeypatch.setattr(AutoIPAM, "config", {"top_level_view_id": top_level_view_id, "view_id": view_id,
+                                             "parent_domain": benchmark.PARENT_DOMAIN})
+    manager = AutoIPAM.BluecatManager("test", "test", "fake-bam", client=FakeBAMClient(service))
+    yield manager
+    manager.logout()
+
+
+@pytest.fixture
+def run_import(bluecat_manager):
+    """Import rows through ImportEngine, returning the report with the engine's output swallowed."""
+    def run(rows):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return AutoIPAM.ImportEngine(bluecat_manager, 4).run(rows)
+    return run
@@ -0,0 +1,47 @@
+import asyncio
+import contextlib
+import io
+
+import pytest
+
+import AutoIPAM
+import benchmark
+from FakeBAM import AsyncFakeBAMService, FakeBAMClient, FakeBAMService
+from test_import_engine import TEST_CSV
+
+
+def state(service):
+    """Everything the import can change, comparable between two fakes seeded the same way."""
+    return sorted((entity['type'], entity['name'], entity['properties'], service.entities[entity['parent']]['name'] if entity['parent'] else None)
+                  for entity in service.entities.values())
+
+
+def runAsync(service, rows):
+    async def run():
+        bluecat_manager = AutoIPAM.AsyncBluecatManager("test", "test", "fake-bam", 10, client=FakeBAMClient(AsyncFakeBAMService(service)))
+        bluecat_manager.client.service.backoff = 0
+        try:
+            return await AutoIPAM.AsyncImportEngine(bluecat_manager).run(rows)
+        finally:
+            await bluecat_manager.logout()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(run())
+
+
+@pytest.mark.parametrize("lost_reply_rate", [0.0, 1.0])
+def test_async_import_of_test_csv_matches_sync(service, bluecat_manager, run_import, lost_reply_rate):
+    rows = benchmark.readRows(TEST_CSV)
+    sync_report = run_import(rows)
+
+    async_service = FakeBAMService(lost_reply_rate=lost_reply_rate)
+    benchmark.seedService(async_service)
+    async_report = runAsync(async_service, rows)
+
+    assert async_report == sync_report == {"rows": 8, "completed": 8, "skipped": 0, "rejected": 0}
+    assert state(async_service) == state(service)
+    # Running it again changes nothing
+    writes = {operation: count for operation, count in async_service.calls.items() if operation.startswith("add") or operation == "update"}
+    runAsync(async_service, rows)
+    assert {operation: count for operation, count in async_service.calls.items() if operation.startswith("add") or operation == "update"} == writes
+    assert state(async_service) == state(service)
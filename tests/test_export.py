@@ -0,0 +1,67 @@
+import contextlib
+import csv
+import io
+
+from AutoIPAM import BamExporter, BluecatManager, ImportEngine
+from FakeBAM import FakeBAMClient
+
+ROWS = [
+    ["Block", "B", "10.1.0.0/16", "", ""],
+    ["Network", "With Gateway", "10.1.1.0/24", "10.1.1.254"],
+    ["Network", "No Gateway", "10.1.2.0/24", "", ""],
+    ["Network", "Outside", "10.2.0.0/24", "", ""],
+    ["Host", "a.test.xxx", "10.1.1.1", "First", "add"],
+    ["Host", "a.test.xxx", "10.1.2.1", "Second", "append"],
+    ["Host", "b.test.xxx", "10.1.2.2", "", ""],
+    ["Host", "c.test.xxx", "10.2.0.1", "", ""],
+]
+
+
+def export(bluecat_manager, root_id):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = BamExporter(bluecat_manager, output).export(root_id, bluecat_manager.view_id)
+    return report, list(csv.reader(io.StringIO(output.getvalue())))
+
+
+def blockId(bluecat_manager, ip):
+    return bluecat_manager.topology.chain(ip, "IP4Block")[-1]['id']
+
+
+def test_export_of_a_block_starts_with_the_block_itself(bluecat_manager, run_import):
+    run_import(ROWS)
+    report, rows = export(bluecat_manager, blockId(bluecat_manager, "10.1.0.1"))
+    assert rows[:2] == [BamExporter.HEADER, ["Block", "B", "10.1.0.0/16", "", ""]]
+    assert report == {"blocks": 1, "networks": 2, "hosts": 2, "skipped": 1}
+    assert sorted(rows[2:]) == sorted([
+        # Only a network with a gateway gets a four-column row, the only kind the importer reads a gateway from
+        ["Network", "With Gateway", "10.1.1.0/24", "10.1.1.254"],
+        ["Network", "No Gateway", "10.1.2.0/24", "", ""],
+        ["Host", "a.test.xxx", "10.1.1.1", "First\r\nSecond", "add"],
+        ["Host", "a.test.xxx", "10.1.2.1", "", ""],
+        ["Host", "b.test.xxx", "10.1.2.2", "", ""],
+    ])
+
+
+def test_export_of_the_configuration_has_no_root_row(bluecat_manager, run_import):
+    run_import(ROWS)
+    report, rows = export(bluecat_manager, 5)
+    assert ["Block", "Benchmark Root", "10.0.0.0/8", "", ""] in rows
+    assert [row[1] for row in rows if row[0] == "Block"].count("B") == 1
+    assert report == {"blocks": 2, "networks": 3, "hosts": 3, "skipped": 0}
+
+
+def test_reimporting_an_export_changes_nothing(service, bluecat_manager, run_import):
+    run_import(ROWS)
+    _, rows = export(bluecat_manager, 5)
+    calls = dict(service.calls)
+    # A fresh manager, so nothing is known from the first import
+    fresh = BluecatManager("test", "test", "fake-bam", client=FakeBAMClient(service))
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = ImportEngine(fresh, 4).run(rows)
+        fresh.logout()
+    # The header row is skipped, not rejected
+    assert report == {"rows": len(rows) - 1, "completed": len(rows) - 1, "skipped": 0, "rejected": 0}
+    writes = [operation for operation, count in service.calls.items() if (operation.startswith("add") or operation == "update")
+              and count != calls.get(operation, 0)]
+    assert writes == []
@@ -0,0 +1,132 @@
+import contextlib
+import io
+import ipaddress
+
+import pytest
+
+from AutoIPAM import CsvValidator, FreeAddressMap, ImportEngine
+
+
+def ip(text):
+    return int(ipaddress.ip_address(text))
+
+
+def addresses(values):
+    return [str(ipaddress.ip_address(value)) for value in values]
+
+
+def built(cidr, assigned=(), gateway=None, reserved=()):
+    network = ipaddress.ip_network(cidr)
+    first, last = int(network.network_address), int(network.broadcast_address)
+    free = FreeAddressMap()
+    free.reserve(ip(address) for address in reserved)
+    free.build(first, last, [ip(address) for address in assigned], ip(gateway) if gateway else None)
+    return free, first, last
+
+
+def test_allocates_lowest_free_addresses():
+    free, first, last = built("10.0.1.0/24", assigned=["10.0.1.1", "10.0.1.3"], gateway="10.0.1.2")
+    assert addresses(free.allocate(first, last, 3)) == ["10.0.1.4", "10.0.1.5", "10.0.1.6"]
+    assert addresses(free.allocate(first, last)) == ["10.0.1.7"]
+
+
+def test_network_and_broadcast_addresses_are_never_handed_out():
+    free, first, last = built("10.0.1.0/30")
+    assert addresses(free.allocate(first, last, 2)) == ["10.0.1.1", "10.0.1.2"]
+    with pytest.raises(ValueError, match="No free addresses left in 10.0.1.0-10.0.1.3."):
+        free.allocate(first, last)
+
+
+def test_point_to_point_network_uses_both_addresses():
+    free, first, last = built("10.0.2.0/31")
+    assert addresses(free.allocate(first, last, 2)) == ["10.0.2.0", "10.0.2.1"]
+    with pytest.raises(ValueError):
+        free.allocate(first, last)
+
+
+def test_single_address_network():
+    free, first, last = built("10.0.3.7/32")
+    assert addresses(free.allocate(first, last)) == ["10.0.3.7"]
+    with pytest.raises(ValueError):
+        free.allocate(first, last)
+
+
+def test_running_out_takes_nothing():
+    free, first, last = built("10.0.1.0/29", gateway="10.0.1.6")
+    with pytest.raises(ValueError):
+        free.allocate(first, last, 6)
+    # A failed allocation leaves every address it looked at free
+    assert addresses(free.allocate(first, last, 5)) == ["10.0.1.1", "10.0.1.2", "10.0.1.3", "10.0.1.4", "10.0.1.5"]
+
+
+def test_reserved_addresses_are_skipped_before_and_after_building():
+    free, first, last = built("10.0.1.0/24", reserved=["10.0.1.1"])
+    free.reserve([ip("10.0.1.2"), ip("10.9.9.9")])
+    assert addresses(free.allocate(first, last)) == ["10.0.1.3"]
+
+
+def test_explicit_addresses():
+    rows = [
+        ["Network", "N", "10.0.1.0/24", "10.0.1.254"],
+        ["Network", "M", "10.0.2.0/24", "", ""],
+        ["Host", "a.test.xxx", "10.0.1.1", "", ""],
+        ["Host", "b.test.xxx", "10.0.1.0/24", "", ""],
+        ["Host", "c.test.xxx", "", "", "", "10.0.1.0/24"],
+        ["Block", "B", "10.0.0.0/16", "", ""],
+    ]
+    assert FreeAddressMap.explicitAddresses(rows) == {ip("10.0.1.254"), ip("10.0.1.1")}
+
+
+def hostAddresses(service):
+    return {entity['name']: entity['properties'].split("addresses=")[1].split("|")[0]
+            for entity in service.entities.values() if entity['type'] == "HostRecord"}
+
+
+def test_import_allocates_around_gateway_and_explicit_rows(service, run_import):
+    report = run_import([
+        ["Network", "N", "10.5.0.0/29", "10.5.0.6"],
+        ["Host", "a.test.xxx", "10.5.0.0/29", "", ""],
+        ["Host", "b.test.xxx", "10.5.0.0/29", "", ""],
+        ["Host", "x.test.xxx", "10.5.0.1", "", ""],
+        ["Host", "c.test.xxx", "10.5.0.0/29", "", ""],
+        ["Host", "d.test.xxx", "10.5.0.0/29", "", ""],
+        ["Host", "e.test.xxx", "10.5.0.0/29", "", ""],
+    ])
+    assert report["rejected"] == 1
+    assert hostAddresses(service) == {"a": "10.5.0.2", "b": "10.5.0.3", "x": "10.5.0.1", "c": "10.5.0.4", "d": "10.5.0.5"}
+
+
+def test_import_does_not_allocate_again_for_a_host_already_in_the_network(service, run_import):
+    rows = [["Network", "N", "10.5.0.0/29", "", ""], ["Host", "a.test.xxx", "10.5.0.0/29", "", ""]]
+    run_import(rows)
+    writes = service.calls["addHostRecord"]
+    report = run_import(rows)
+    assert report["rejected"] == 0
+    assert service.calls["addHostRecord"] == writes
+    assert "update" not in service.calls
+    assert hostAddresses(service) == {"a": "10.5.0.1"}
+
+
+def importInBatches(bluecat_manager, rows, reserved=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ImportEngine(bluecat_manager, 4, batch_size=2, reserved=reserved).run(rows)
+
+
+BATCH_CROSSING_ROWS = [
+    ["Network", "N", "10.9.0.0/24", "", ""],
+    ["Host", "a.test.xxx", "10.9.0.0/24", "", ""],
+    ["Host", "b.test.xxx", "10.9.0.1", "", ""],
+]
+
+
+def test_explicit_address_in_a_later_batch_is_not_allocated(service, bluecat_manager):
+    report = importInBatches(bluecat_manager, BATCH_CROSSING_ROWS)
+    assert report["rejected"] == 0
+    assert hostAddresses(service) == {"a": "10.9.0.2", "b": "10.9.0.1"}
+
+
+def test_streamed_rows_use_the_addresses_reserved_by_the_validator(service, bluecat_manager):
+    reserved = CsvValidator().validate(BATCH_CROSSING_ROWS).explicit
+    report = importInBatches(bluecat_manager, iter(BATCH_CROSSING_ROWS), reserved)
+    assert report["rejected"] == 0
+    assert hostAddresses(service) == {"a": "10.9.0.2", "b": "10.9.0.1"}
@@ -0,0 +1,92 @@
+import pytest
+
+import benchmark
+from AutoIPAM import Host, HostRecord
+from test_free_addresses import hostAddresses
+from test_import_engine import TEST_CSV
+
+host = Host(None)
+
+
+@pytest.mark.parametrize("entry, expected", [
+    (["Host", "a.test.xxx", "10.0.1.1", "Note", "Append"], ("Note", "Append")),
+    (["Host", "a.test.xxx", "10.0.1.1", "", ""], (None, None)),
+    (["Host", "a.test.xxx", "10.0.1.1", "Note", ""], (None, None)),
+    (["Host", "a.test.xxx", "10.0.1.1", "Note"], (None, None)),
+    (["Host", "a.test.xxx", "10.0.1.1", "Note", "prepend"], (None, None)),
+    (["Host", "a.test.xxx", "10.0.1.1", "a|b", "add"], (None, None)),
+])
+def test_row_comments(entry, expected, capsys):
+    assert host.rowComments(entry) == expected
+    excluded = "Excluded comments from (a.test.xxx, 10.0.1.1)" in capsys.readouterr().out
+    assert excluded == (expected == (None, None) and len(entry) > 4 and bool(entry[3] and entry[4]))
+
+
+@pytest.mark.parametrize("changes, expected", [
+    # A new host takes the first row's comments whatever its action
+    ([("10.0.1.1", "First", "append"), ("10.0.1.2", "Second", "append"), ("10.0.1.3", None, None)],
+     (["10.0.1.1", "10.0.1.2", "10.0.1.3"], "First\r\nSecond")),
+    ([("10.0.1.1", "First", "replace"), ("10.0.1.2", "Second", "add")], (["10.0.1.1", "10.0.1.2"], "First")),
+    ([("10.0.1.1", "First", "add"), ("10.0.1.2", "Second", "replace"), ("10.0.1.1", "Third", "append")],
+     (["10.0.1.1", "10.0.1.2"], "Second\r\nThird")),
+    ([("10.0.1.1", None, None)], (["10.0.1.1"], None)),
+])
+def test_merge_changes_for_a_new_host(changes, expected):
+    assert host.mergeChanges(None, changes) == expected
+
+
+@pytest.mark.parametrize("comments, changes, expected", [
+    ("Old", [("10.0.1.1", "New", "add")], (["10.0.1.1"], "Old")),
+    (None, [("10.0.1.2", "New", "add")], (["10.0.1.1", "10.0.1.2"], "New")),
+    ("Old", [("10.0.1.2", "New", "append"), ("10.0.1.3", "Newer", "append")], (["10.0.1.1", "10.0.1.2", "10.0.1.3"], "Old\r\nNew\r\nNewer")),
+    ("Old", [("10.0.1.2", "New", "replace"), ("10.0.1.3", "Newer", "add")], (["10.0.1.1", "10.0.1.2", "10.0.1.3"], "New")),
+    ("Old", [("10.0.1.2", None, None)], (["10.0.1.1", "10.0.1.2"], "Old")),
+])
+def test_merge_changes_for_an_existing_host(comments, changes, expected):
+    existing = HostRecord(7, "a", ("10.0.1.1",), comments)
+    assert host.mergeChanges(existing, changes) == expected
+    assert existing.addresses == ("10.0.1.1",)
+
+
+def hostComments(service):
+    return {entity['name']: entity['properties'].split("comments=")[1].split("|")[0]
+            for entity in service.entities.values() if entity['type'] == "HostRecord" and "comments=" in entity['properties']}
+
+
+def test_import_test_csv(service, run_import):
+    report = run_import(benchmark.readRows(TEST_CSV))
+    assert report["rejected"] == 0
+    assert hostAddresses(service) == {"test-host": "10.10.10.1,10.10.10.17,10.10.10.18,10.10.10.19", "test-host2": "10.10.10.2"}
+    assert hostComments(service) == {"test-host": "This is a comment\r\nFinal comment", "test-host2": "This is another comment"}
+    # Every row for a hostname goes into one create
+    writes = {operation: count for operation, count in service.calls.items() if operation.startswith("add") or operation == "update"}
+    assert writes == {"addIP4BlockByCIDR": 1, "addIP4Network": 2, "addHostRecord": 2}
+
+
+def test_rows_for_an_existing_host_are_merged_into_one_update(service, run_import):
+    run_import(benchmark.readRows(TEST_CSV))
+    report = run_import([
+        ["Host", "test-host.test.xxx", "10.10.10.20", "Second line", "append"],
+        ["Host", "test-host.test.xxx", "10.10.10.21", "Ignored", "add"],
+        ["Host", "TEST-HOST.test.xxx", "10.10.10.22", "Third line", "append"],
+    ])
+    assert report["rejected"] == 0
+    assert service.calls["update"] == 1
+    assert hostAddresses(service)["test-host"] == "10.10.10.1,10.10.10.17,10.10.10.18,10.10.10.19,10.10.10.20,10.10.10.21,10.10.10.22"
+    assert hostComments(service)["test-host"] == "This is a comment\r\nFinal comment\r\nSecond line\r\nThird line"
+
+
+def setHostAddresses(service, name, addresses):
+    """Change a host record behind the importer's back, as another tool would."""
+    for entity in service.entities.values():
+        if entity['type'] == "HostRecord" and entity['name'] == name:
+            entity['properties'] = entity['properties'].replace(entity['properties'].split("addresses=")[1].split("|")[0], addresses)
+
+
+def test_update_keeps_addresses_added_since_the_host_was_cached(service, run_import):
+    rows = [["Network", "N", "10.7.0.0/24", "", ""], ["Host", "a.test.xxx", "10.7.0.1", "", ""]]
+    run_import(rows)
+    setHostAddresses(service, "a", "10.7.0.1,10.7.0.50")
+    report = run_import([["Host", "a.test.xxx", "10.7.0.2", "", ""]])
+    assert report["rejected"] == 0
+    assert hostAddresses(service) == {"a": "10.7.0.1,10.7.0.50,10.7.0.2"}
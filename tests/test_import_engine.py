@@ -0,0 +1,18 @@
+import os
+
+import benchmark
+
+TEST_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.csv")
+
+
+def test_header_row_is_skipped_not_rejected(run_import):
+    rows = benchmark.readRows(TEST_CSV)
+    assert rows[0] == benchmark.HEADER
+    assert run_import(rows) == {"rows": len(rows) - 1, "completed": len(rows) - 1, "skipped": 0, "rejected": 0}
+    # Importing the same file again changes nothing and still rejects nothing
+    assert run_import(rows)["rejected"] == 0
+
+
+def test_header_row_is_only_skipped_at_the_start(run_import):
+    report = run_import([["Network", "N", "10.5.0.0/24", "", ""], benchmark.HEADER])
+    assert report == {"rows": 2, "completed": 1, "skipped": 0, "rejected": 1}
@@ -0,0 +1,38 @@
+import contextlib
+import io
+
+from AutoIPAM import ImportPlanner
+from test_free_addresses import hostAddresses
+from test_hosts import setHostAddresses
+
+
+def plan(bluecat_manager, rows):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ImportPlanner(bluecat_manager).plan(rows)
+
+
+def test_hosts_in_networks_the_plan_adds(service, bluecat_manager):
+    rows = [["Network", f"N{i}", f"10.6.{i}.0/24", "", ""] for i in range(0, 20, 2)] + [
+        ["Host", "a.test.xxx", "10.6.4.9", "", ""],
+        ["Host", "b.test.xxx", "10.6.18.0/24", "", ""],
+        ["Host", "c.test.xxx", "10.6.3.1", "", ""],
+        ["Host", "d.test.xxx", "10.6.3.0/24", "", ""],
+    ]
+    planner = plan(bluecat_manager, rows)
+    assert [error for _, error in planner.errors] == ["Address (10.6.3.1) is not in a network.", "Network 10.6.3.0/24 doesn't exist."]
+    assert {host['hostname']: host['addresses'] for host in planner.hosts.values()} == {"a.test.xxx": ["10.6.4.9"], "b.test.xxx": ["10.6.18.1"]}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        applied = planner.apply()
+    assert applied == {"blocks": 0, "networks": 10, "create_hosts": 2, "update_hosts": 0, "failed": 0}
+    assert hostAddresses(service) == {"a": "10.6.4.9", "b": "10.6.18.1"}
+    assert plan(bluecat_manager, rows).summary()["unchanged"] == 12
+
+
+def test_apply_merges_into_the_host_as_it_is_at_write_time(service, bluecat_manager, run_import):
+    run_import([["Network", "N", "10.7.0.0/24", "", ""], ["Host", "a.test.xxx", "10.7.0.1", "", ""]])
+    planner = plan(bluecat_manager, [["Host", "a.test.xxx", "10.7.0.2", "", ""]])
+    setHostAddresses(service, "a", "10.7.0.1,10.7.0.50")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert planner.apply()["update_hosts"] == 1
+    assert hostAddresses(service) == {"a": "10.7.0.1,10.7.0.50,10.7.0.2"}
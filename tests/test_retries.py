@@ -0,0 +1,144 @@
+import contextlib
+import io
+
+import pytest
+
+import AutoIPAM
+import benchmark
+from AutoIPAM import AdaptiveLimiter, BluecatUtils, ImportEngine, RetryingService, TokenBucket
+from FakeBAM import Fault, TransportError
+from test_free_addresses import hostAddresses
+from test_hosts import hostComments
+from test_import_engine import TEST_CSV
+
+
+class RequestsError(Exception):
+    """Looks like an exception from the requests library under zeep."""
+    __module__ = "requests.exceptions"
+
+
+@pytest.mark.parametrize("error, kind", [
+    (Fault("Duplicate of another item: 10.0.0.0/16"), "duplicate"),
+    (Fault("Object already exists"), "duplicate"),
+    (TransportError(503, "Service temporarily unavailable"), "transient"),
+    (TransportError(429), "transient"),
+    (TransportError(500), "fatal"),
+    (ConnectionError("Connection reset"), "transient"),
+    (TimeoutError(), "transient"),
+    (RequestsError("Read timed out"), "transient"),
+    (Fault("The server is busy, try again later"), "transient"),
+    (Fault("Invalid view 5"), "fatal"),
+    (ValueError("Network 10.0.0.0/24 doesn't exist."), "fatal"),
+])
+def test_fault_kind(error, kind):
+    assert BluecatUtils.faultKind(error) == kind
+
+
+class FlakyService:
+    """Fails each call with the next of a list of errors, then succeeds."""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.attempts = 0
+
+    def getEntityById(self, _id):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'id': _id}
+
+
+def retrying(service, retries=3, backoff=0.5, max_backoff=30):
+    limiter = AdaptiveLimiter(TokenBucket(None), 4, adaptive=False)
+    return RetryingService(service, limiter, retries, backoff, max_backoff), limiter
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(AutoIPAM.time, "sleep", slept.append)
+    return slept
+
+
+def test_transient_faults_are_retried_with_backoff(sleeps, capsys):
+    flaky = FlakyService([TransportError(503), ConnectionError()])
+    service, limiter = retrying(flaky, backoff=0.5)
+    assert service.getEntityById(7) == {'id': 7}
+    assert flaky.attempts == 3
+    assert len(sleeps) == 2 and 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+    assert limiter.in_flight == 0
+    assert capsys.readouterr().out.count("Retrying getEntityById after a transient fault.") == 2
+
+
+def test_retries_give_up_after_the_limit(sleeps):
+    flaky = FlakyService([TransportError(503)] * 5)
+    service, limiter = retrying(flaky, retries=2)
+    with pytest.raises(TransportError):
+        service.getEntityById(7)
+    assert flaky.attempts == 3
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize("error", [Fault("Duplicate of another item: x"), Fault("Invalid view 5")])
+def test_duplicate_and_fatal_faults_are_raised_at_once(sleeps, error):
+    flaky = FlakyService([error])
+    service, _ = retrying(flaky)
+    with pytest.raises(Fault):
+        service.getEntityById(7)
+    assert flaky.attempts == 1 and sleeps == []
+
+
+def test_backoff_is_capped():
+    service, _ = retrying(FlakyService([]), backoff=0.5, max_backoff=2)
+    assert all(0 <= service.backoffDelay(attempt) <= 2 for attempt in range(10) for _ in range(20))
+    assert max(service.backoffDelay(0) for _ in range(200)) <= 0.5
+
+
+def test_adaptive_limiter_adds_after_good_calls_and_halves_after_faults():
+    bucket = TokenBucket(10)
+    limiter = AdaptiveLimiter(bucket, 8, latency_target=1.0, max_rate=20, cooldown=60)
+    limiter.adjust(0.1, False)
+    assert limiter.concurrency == 8 and bucket.rate == pytest.approx(10.1)
+
+    limiter.adjust(0.1, True)
+    assert limiter.concurrency == 4 and bucket.rate == pytest.approx(5.05)
+    # Within the cooldown, another fault or a slow call changes nothing
+    limiter.adjust(0.1, True)
+    limiter.adjust(5.0, False)
+    assert limiter.concurrency == 4 and bucket.rate == pytest.approx(5.05)
+
+    limiter.decreased_at = 0
+    limiter.adjust(5.0, False)
+    assert limiter.concurrency == 2 and bucket.rate == pytest.approx(2.525)
+    limiter.adjust(0.1, False)
+    assert limiter.concurrency == 2.5 and bucket.rate == pytest.approx(2.525 + 1 / 2.525)
+
+
+def test_adaptive_limiter_keeps_to_its_floor_and_ceilings():
+    bucket = TokenBucket(2)
+    limiter = AdaptiveLimiter(bucket, 1, max_rate=2, min_rate=1.5, cooldown=0)
+    limiter.adjust(0.1, True)
+    limiter.adjust(0.1, True)
+    assert limiter.concurrency == 1 and bucket.rate == 1.5
+    for _ in range(20):
+        limiter.adjust(0.1, False)
+    assert limiter.concurrency == 1 and bucket.rate == 2
+
+    fixed = AdaptiveLimiter(TokenBucket(10), 4, adaptive=False)
+    fixed.adjust(0.1, True)
+    assert fixed.concurrency == 4 and fixed.bucket.rate == 10
+
+
+def test_writes_whose_reply_is_lost_are_recovered_from_the_duplicate(service, bluecat_manager):
+    service.lost_reply_rate = 1.0
+    bluecat_manager.client.service.backoff = 0
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        report = ImportEngine(bluecat_manager, 4).run(benchmark.readRows(TEST_CSV))
+    assert report == {"rows": 8, "completed": 8, "skipped": 0, "rejected": 0}
+    # Each add was made once, then retried into a duplicate
+    assert (service.calls["addIP4BlockByCIDR"], service.calls["addIP4Network"], service.calls["addHostRecord"]) == (2, 4, 4)
+    assert "Block 10.10.10.0/27 already exists." in output.getvalue()
+    assert hostAddresses(service) == {"test-host": "10.10.10.1,10.10.10.17,10.10.10.18,10.10.10.19", "test-host2": "10.10.10.2"}
+    # The rows aren't applied a second time to the records they created, which would append the comments again
+    assert hostComments(service) == {"test-host": "This is a comment\r\nFinal comment", "test-host2": "This is another comment"}
+    assert "update" not in service.calls
+    assert [entity['name'] for entity in service.entities.values() if entity['type'] == "IP4Network"] == ["Test Network 1", "Test Network 2"]
@@ -0,0 +1,55 @@
+import contextlib
+import io
+
+import AutoIPAM
+from AutoIPAM import Checkpoint, CsvValidator, RejectList, ShardedImport
+from FakeBAM import FakeBAMClient
+
+
+def addTopLevelBlock(service, cidr):
+    return service.addContainer(service.configuration_id, cidr, "name=Other Root|", "IP4Block")
+
+
+def test_shards_merged_by_a_hostname_stay_merged_and_move_to_one_process(service, bluecat_manager):
+    other = addTopLevelBlock(service, "172.16.0.0/12")
+    importer = ShardedImport(bluecat_manager, 2)
+    first = importer.partition([["Host", "a.test.xxx", "10.1.0.1", "", ""], ["Host", "b.test.xxx", "172.16.0.1", "", ""]])
+    assert len(first) == 2
+    importer.pinned = {key: worker for worker, key in enumerate(first)}
+
+    second = importer.partition([["Host", "c.test.xxx", "10.1.0.2", "", ""], ["Host", "c.test.xxx", "172.16.0.2", "", ""]])
+    [(root, shard)] = second.items()
+    assert len(shard) == 2
+    assert importer.pinned == {root: importer.pinned[root]} and importer.stale == {root}
+    assert importer.findShard(other) == root
+    assert list(importer.partition([["Host", "d.test.xxx", "172.16.0.3", "", ""]])) == [root]
+
+
+def test_run_checkpoints_every_batch(service, bluecat_manager, monkeypatch, tmp_path):
+    addTopLevelBlock(service, "172.16.0.0/12")
+    # Forked worker processes each get their own copy of the fake
+    monkeypatch.setattr(AutoIPAM, "createClient", lambda bam_hostname: FakeBAMClient(service))
+    rows = [
+        ["Network", "N", "10.1.0.0/24", "", ""],
+        ["Network", "M", "172.16.0.0/24", "", ""],
+        ["Host", "a.test.xxx", "10.1.0.0/24", "", ""],
+        ["Host", "b.test.xxx", "172.16.0.0/24", "", ""],
+        ["Host", "c.test.xxx", "10.1.0.1", "", ""],
+        ["Host", "d.test.xxx", "172.16.0.5", "", ""],
+        ["Host", "e.test.xxx", "192.168.0.1", "", ""],
+    ]
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint"))
+    rejects = RejectList()
+    importer = ShardedImport(bluecat_manager, 2, checkpoint, rejects, 2, CsvValidator().validate(rows).explicit)
+    recorded = []
+    record = importer.recordShard
+    monkeypatch.setattr(importer, "recordShard", lambda shard, report, rejected: (recorded.append(len(shard)), record(shard, report, rejected)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = importer.run(iter(rows), "test", "test", "fake-bam")
+    checkpoint.close()
+
+    assert report == {"rows": 7, "completed": 6, "skipped": 0, "rejected": 1, "shards": 7}
+    assert recorded == [1] * 7
+    assert rejects.rows == [(rows[6], "Address (192.168.0.1) is not in a network.")]
+    with open(tmp_path / "checkpoint") as checkpoint_file:
+        assert len(checkpoint_file.read().split()) == 6
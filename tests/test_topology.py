@@ -0,0 +1,65 @@
+from AutoIPAM import ContainerRecord, Properties, TopologyIndex
+
+
+def test_properties_round_trip():
+    raw = "CIDR=10.0.1.0/24|name=N|gateway=10.0.1.254|comments=first=1\r\nsecond|"
+    properties = Properties(raw)
+    assert properties == {"CIDR": "10.0.1.0/24", "name": "N", "gateway": "10.0.1.254", "comments": "first=1\r\nsecond"}
+    assert str(properties) == raw
+    assert str(Properties(str(properties))) == raw
+    assert str(Properties("")) == "" and str(Properties(None)) == ""
+
+
+def test_properties_copy_is_independent():
+    properties = Properties("addresses=10.0.1.1|")
+    changed = properties.copy()
+    changed["addresses"] += ",10.0.1.2"
+    changed["comments"] = "new"
+    assert str(properties) == "addresses=10.0.1.1|"
+    assert str(changed) == "addresses=10.0.1.1,10.0.1.2|comments=new|"
+
+
+def test_properties_range():
+    assert Properties("CIDR=10.0.1.0/24|").range() == (167772416, 167772671)
+    assert Properties("start=10.0.1.5|end=10.0.1.9|").range() == (167772421, 167772425)
+    assert Properties("name=x|").range() is None
+
+
+def test_container_record_round_trips_through_its_properties():
+    record = ContainerRecord.fromEntity({"id": 7, "name": "N", "properties": "CIDR=10.0.1.0/24|name=N|gateway=10.0.1.254|"}, "IP4Network")
+    again = ContainerRecord.fromEntity({"id": 7, "name": "N", "properties": record.properties}, "IP4Network")
+    assert (again.cidr, again.first, again.last, again.gateway) == (record.cidr, record.first, record.last, record.gateway)
+    assert record.properties == "CIDR=10.0.1.0/24|gateway=10.0.1.254|"
+
+
+def childNames(topology, parent_id, _type):
+    return [child[2]['name'] for child in topology.loadChildren(parent_id, _type)['children']]
+
+
+def test_block_added_around_existing_networks_takes_them_over(bluecat_manager, run_import):
+    run_import([
+        ["Network", "N1", "10.1.0.0/24", "", ""],
+        ["Network", "N2", "10.1.1.0/24", "", ""],
+        ["Network", "N3", "10.2.0.0/24", "", ""],
+    ])
+    topology = bluecat_manager.topology
+    root = topology.chain("10.1.0.1", "IP4Block")[-1]
+    assert childNames(topology, root['id'], "IP4Network") == ["N1", "N2", "N3"]
+
+    # Added in a later run, so the block is created around networks that are already in the index
+    run_import([["Block", "B", "10.1.0.0/16", "", ""]])
+    block_chain = topology.chain("10.1.0.1", "IP4Block")
+    assert [block['name'] for block in block_chain] == ["Benchmark Root", "B"]
+    block = block_chain[-1]
+    assert childNames(topology, root['id'], "IP4Network") == ["N3"]
+    assert childNames(topology, block['id'], "IP4Network") == ["N1", "N2"]
+    assert topology.chain("10.1.1.9", "IP4Network", block['id'])[-1]['name'] == "N2"
+
+    # The index matches what BAM itself now has
+    fresh = TopologyIndex(bluecat_manager)
+    for parent_id in (root['id'], block['id']):
+        for _type in ("IP4Block", "IP4Network"):
+            assert childNames(fresh, parent_id, _type) == childNames(topology, parent_id, _type)
+
+    report = run_import([["Host", "a.test.xxx", "10.1.0.5", "", ""]])
+    assert report["rejected"] == 0
@@ -0,0 +1,164 @@
+import pytest
+
+from AutoIPAM import CsvValidator, main
+
+
+def validate(rows):
+    return CsvValidator().validate(rows)
+
+
+def test_valid_rows_pass():
+    validator = validate([
+        ["Type", "Name", "CIDR/Address", "Default Gateway/Comment", "Comment Action"],
+        ["Block", "B", "10.0.0.0/16", "", ""],
+        ["Network", "N", "10.0.1.0/24", "10.0.1.254"],
+        ["Host", "a.test.xxx", "10.0.1.1", "", ""],
+        ["Host", "a.test.xxx", "10.0.1.2", "", ""],
+    ])
+    assert validator.rows == 5
+    assert validator.errors == {}
+    assert validator.warnings == []
+
+
+def test_container_inside_network_is_an_error():
+    validator = validate([
+        ["Block", "B", "10.0.0.0/16", "", ""],
+        ["Network", "N", "10.0.1.0/24", "", ""],
+        ["Network", "Inner", "10.0.1.128/25", "", ""],
+        ["Block", "Inner Block", "10.0.1.0/26", "", ""],
+    ])
+    assert validator.errors == {
+        3: "Network 10.0.1.128/25 is inside Network 10.0.1.0/24 (line 2).",
+        4: "Block 10.0.1.0/26 is inside Network 10.0.1.0/24 (line 2).",
+    }
+
+
+def test_network_after_a_network_inside_it_reports_the_outer_row():
+    validator = validate([
+        ["Network", "Inner", "10.0.1.128/25", "", ""],
+        ["Network", "Outer", "10.0.1.0/24", "", ""],
+    ])
+    assert validator.errors == {2: "Network 10.0.1.0/24 overlaps Network 10.0.1.128/25 (line 1)."}
+
+
+def test_networks_inside_blocks_and_nested_blocks_are_fine():
+    validator = validate([
+        ["Block", "Outer", "10.0.0.0/8", "", ""],
+        ["Block", "Inner", "10.1.0.0/16", "", ""],
+        ["Network", "N", "10.1.1.0/24", "", ""],
+    ])
+    assert validator.errors == {}
+    assert validator.warnings == []
+
+
+def test_repeated_network_uses_the_first_rows_gateway():
+    validator = validate([
+        ["Network", "N", "10.0.1.0/24", "10.0.1.1"],
+        ["Network", "N again", "10.0.1.0/24", "", ""],
+        ["Host", "a.test.xxx", "10.0.1.1", "", ""],
+    ])
+    assert validator.errors == {3: "Address 10.0.1.1 is the gateway of Network 10.0.1.0/24 (line 1)."}
+
+
+def test_host_on_gateway_network_or_broadcast_address():
+    validator = validate([
+        ["Network", "N", "10.0.1.0/24", "10.0.1.254"],
+        ["Host", "gateway.test.xxx", "10.0.1.254", "", ""],
+        ["Host", "network.test.xxx", "10.0.1.0", "", ""],
+        ["Host", "broadcast.test.xxx", "10.0.1.255", "", ""],
+        ["Host", "fine.test.xxx", "10.0.1.1", "", ""],
+    ])
+    assert validator.errors == {
+        2: "Address 10.0.1.254 is the gateway of Network 10.0.1.0/24 (line 1).",
+        3: "Address 10.0.1.0 is the network address of Network 10.0.1.0/24 (line 1).",
+        4: "Address 10.0.1.255 is the broadcast address of Network 10.0.1.0/24 (line 1).",
+    }
+
+
+def test_point_to_point_networks_have_no_network_or_broadcast_address():
+    validator = validate([
+        ["Network", "P2P", "10.0.2.0/31", "", ""],
+        ["Network", "Loopback", "10.0.3.1/32", "", ""],
+        ["Host", "a.test.xxx", "10.0.2.0", "", ""],
+        ["Host", "b.test.xxx", "10.0.2.1", "", ""],
+        ["Host", "c.test.xxx", "10.0.3.1", "", ""],
+    ])
+    assert validator.errors == {}
+
+
+def test_gateway_outside_network():
+    validator = validate([["Network", "N", "10.0.1.0/24", "10.0.2.1"]])
+    assert validator.errors == {1: "Gateway 10.0.2.1 is outside Network 10.0.1.0/24."}
+
+
+def test_gateway_only_read_from_four_column_network_rows():
+    validator = validate([
+        ["Network", "N", "10.0.1.0/24", "10.0.2.1", ""],
+        ["Host", "a.test.xxx", "10.0.1.1", "", ""],
+    ])
+    assert validator.errors == {}
+
+
+def test_host_in_a_rejected_network_is_checked_against_the_valid_one():
+    validator = validate([
+        ["Network", "N", "10.0.1.0/24", "10.0.1.1"],
+        ["Network", "Inner", "10.0.1.0/25", "", ""],
+        ["Host", "a.test.xxx", "10.0.1.1", "", ""],
+    ])
+    assert validator.errors == {
+        2: "Network 10.0.1.0/25 is inside Network 10.0.1.0/24 (line 1).",
+        3: "Address 10.0.1.1 is the gateway of Network 10.0.1.0/24 (line 1).",
+    }
+
+
+def test_address_given_to_two_hostnames():
+    validator = validate([
+        ["Network", "N", "10.0.1.0/24", "", ""],
+        ["Host", "a.test.xxx", "10.0.1.5", "", ""],
+        ["Host", "A.TEST.XXX", "10.0.1.5", "Same host", "append"],
+        ["Host", "b.test.xxx", "10.0.1.5", "", ""],
+    ])
+    assert validator.errors == {4: "Address 10.0.1.5 is already given to a different host on line 2."}
+
+
+def test_unparseable_rows_and_missing_containers():
+    validator = validate([
+        ["Network", "Bad", "10.0.1.0/33", "", ""],
+        ["Host", "a.test.xxx", "10.0.1.300", "", ""],
+        ["Network", "Loose", "10.0.2.0/24", "", ""],
+        ["Host", "b.test.xxx", "10.9.9.9", "", ""],
+        ["Host", "c.test.xxx", "", "", "", "10.0.2.0/24"],
+    ])
+    assert validator.errors == {1: "Invalid CIDR (10.0.1.0/33).", 2: "Invalid address (10.0.1.300)."}
+    assert [number for number, _ in validator.warnings] == [3, 4]
+
+
+def test_filter_leaves_out_rejected_rows():
+    rows = [
+        ["Network", "N", "10.0.1.0/24", "10.0.1.1"],
+        ["Host", "a.test.xxx", "10.0.1.1", "", ""],
+        ["Host", "b.test.xxx", "10.0.1.2", "", ""],
+    ]
+    rejected = []
+
+    class Rejects:
+        def reject(self, entry, error):
+            rejected.append((entry, error))
+
+    validator = validate(rows)
+    assert list(validator.filter(rows, Rejects())) == [rows[0], rows[2]]
+    assert rejected == [(rows[1], "Address 10.0.1.1 is the gateway of Network 10.0.1.0/24 (line 1).")]
+
+
+def test_validate_only_run_exits_non_zero_on_errors(tmp_path, capsys):
+    config_path = tmp_path / "config.json"
+    config_path.write_text("{}")
+    csv_path = tmp_path / "import.csv"
+    csv_path.write_text("Network,N,10.0.1.0/24,10.0.1.1\nHost,b.test.xxx,10.0.1.2,,\n")
+    assert main([str(csv_path), "--validate", "--config", str(config_path)]) is None
+
+    csv_path.write_text("Network,N,10.0.1.0/24,10.0.1.1\nHost,a.test.xxx,10.0.1.1,,\n")
+    with pytest.raises(SystemExit) as exit_info:
+        main([str(csv_path), "--validate", "--config", str(config_path)])
+    assert exit_info.value.code == 1
+    assert "10.0.1.1 is the gateway" in capsys.readouterr().out